@@ -2,15 +2,69 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import cloudinary
 from flask_login import LoginManager
-from urllib.parse import quote
+import os
+from bookapp import database
 
 
 app = Flask("__name__")
 app.secret_key = '^&*)%T*O&T*^&%)*^T%*&T)*O&RTO)(*FGKYTDFHKTFGK'
-app.config["SQLALCHEMY_DATABASE_URI"] = "mysql+pymysql://root:%s@localhost/bookstoredb?charset=utf8mb4" % quote ('Admin@123')
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = True
+# CSDL lấy từ biến môi trường (xem bookapp/database.py): URI, pool, bản sao chỉ đọc
+database.configure(app)
+# Backend tìm kiếm: 'index' (chỉ mục trong bộ nhớ), 'fulltext' (MySQL FULLTEXT), 'like'
+app.config["SEARCH_BACKEND"] = "index"
 
-db = SQLAlchemy(app)
+# Session phía server: 'filesystem', 'sqlite', 'memory' (LRU trong tiến trình) hoặc 'cookie' (mặc định của Flask)
+app.config["SESSION_BACKEND"] = os.environ.get("BOOKAPP_SESSION_BACKEND", "filesystem")
+app.config["SESSION_DIR"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "session_data")
+app.config["SESSION_SQLITE_PATH"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db")
+app.config["SESSION_SWEEP_INTERVAL"] = 600  # Giây giữa hai lần dọn session hết hạn
+
+# Hàng đợi xuất báo cáo chạy nền
+app.config["JOB_DB_PATH"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")
+app.config["JOB_ARTIFACT_DIR"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts")
+app.config["JOB_WORKERS"] = 2
+
+# Ảnh thu nhỏ tạo khi cần (xem bookapp/images.py) và nơi lưu file người dùng tải lên:
+# 'cloudinary' hoặc 'local' (thư mục static/uploads, dùng khi chạy cục bộ/thử nghiệm)
+app.config["IMAGE_CACHE_DIR"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_cache")
+app.config["UPLOAD_STORAGE"] = os.environ.get("BOOKAPP_UPLOAD_STORAGE", "cloudinary")
+app.config["UPLOAD_DIR"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+
+# Đo số câu SQL/thời gian theo route (BOOKAPP_PROFILING=1 để bật), xem tại /admin/perf
+app.config["PROFILING"] = os.environ.get("BOOKAPP_PROFILING") == "1"
+app.config["PROFILING_QUERY_BUDGET"] = 20  # Số câu SQL tối đa cho một request
+app.config["PROFILING_ROUTE_BUDGETS"] = {}  # Ngân sách riêng theo route, ví dụ {'/api/pay': 10}
+
+# Bộ nhớ đệm trang/fragment cho cửa hàng (xem bookapp/page_cache.py)
+app.config["PAGE_CACHE"] = os.environ.get("BOOKAPP_PAGE_CACHE", "1") == "1"
+app.config["PAGE_CACHE_SIZE"] = 512  # Số trang tối đa
+app.config["PAGE_CACHE_TTL"] = 60  # Giây; giới hạn độ trễ khi nhiều tiến trình cùng ghi
+app.config["PAGE_CACHE_MAX_BYTES"] = 32 * 1024 * 1024
+
+# Thông tin người dùng đăng nhập lưu đệm cho user_loader (xem bookapp/principals.py)
+app.config["PRINCIPAL_CACHE"] = os.environ.get("BOOKAPP_PRINCIPAL_CACHE", "1") == "1"
+app.config["PRINCIPAL_CACHE_SIZE"] = 10000
+app.config["PRINCIPAL_CACHE_TTL"] = 60  # Giây; đổi quyền/khóa tài khoản ở tiến trình khác có hiệu lực sau tối đa TTL
+
+# Gợi ý "khách hàng cũng mua" (xem bookapp/recommendations.py): chỉ mục top-k trên đĩa,
+# dựng lại ở luồng nền sau RECOMMENDATION_REBUILD_AFTER hóa đơn mới
+app.config["RECOMMENDATION_DIR"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recommendation_index")
+app.config["RECOMMENDATION_TOP_K"] = 20
+app.config["RECOMMENDATION_REBUILD_AFTER"] = 500
+
+# Báo cáo doanh số theo khoảng thời gian (xem bookapp/analytics.py)
+app.config["ANALYTICS_CACHE_SIZE"] = 128  # Số báo cáo tối đa trong bộ nhớ đệm
+app.config["ANALYTICS_CACHE_TTL"] = 600  # Giây, cho khoảng đã kết thúc trước hôm nay
+app.config["ANALYTICS_OPEN_RANGE_TTL"] = 60  # Giây, cho khoảng chứa hôm nay (hóa đơn ở tiến trình khác)
+
+# Kế hoạch nhập hàng chạy nền qua hàng đợi job (xem bookapp/inventory.py), 0 để tắt lịch chạy
+app.config["INVENTORY_PLAN_INTERVAL"] = 3600  # Giây
+app.config["INVENTORY_LOOKBACK_DAYS"] = 90
+
+# Sổ biến động tồn kho (xem bookapp/ledger.py): chụp số dư từng sách theo chu kỳ, 0 để tắt
+app.config["STOCK_SNAPSHOT_INTERVAL"] = 86400  # Giây
+
+db = SQLAlchemy(app, session_options={'class_': database.RoutingSession})
 
 cloudinary.config(
     cloud_name = 'djbi959vf',
@@ -20,3 +74,29 @@ cloudinary.config(
 
 login = LoginManager(app=app)
 
+from bookapp.principals import principal_cache
+principal_cache.init_app(app)
+
+from bookapp.session_store import init_session_store
+init_session_store(app)
+
+from bookapp.profiling import profiler
+profiler.init_app(app)
+
+from bookapp.page_cache import page_cache
+page_cache.init_app(app)
+
+from bookapp.images import image_service
+image_service.init_app(app)
+
+from bookapp.recommendations import recommender
+recommender.init_app(app)
+
+from bookapp.analytics import sales_analytics
+sales_analytics.init_app(app)
+
+from bookapp.inventory import inventory_planner
+inventory_planner.init_app(app)
+
+from bookapp.ledger import stock_ledger
+stock_ledger.init_app(app)
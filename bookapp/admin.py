@@ -2,11 +2,14 @@ from datetime import datetime
 from flask_admin import Admin, AdminIndexView
 from flask_admin.contrib.sqla import ModelView
 from bookapp import db, app
-from bookapp.models import BookCategory, Book, UserRole, Regulation, ImportEntry, RegulationImport
+from bookapp.models import BookCategory, Book, UserRole, Regulation, ImportEntry
 from flask_admin import BaseView, expose
 from flask_login import current_user, logout_user
-from flask import redirect, flash, url_for, request, render_template
-import utils
+from flask import redirect, flash, url_for, request, render_template, Response
+from bookapp import utils, bulk_import
+from bookapp.regulations import regulation_engine, RULE_CODES
+from bookapp.profiling import profiler
+from bookapp import inventory, ledger
 
 
 class AuthenticatedModelView(ModelView):
@@ -14,12 +17,23 @@ class AuthenticatedModelView(ModelView):
         return current_user.is_authenticated and current_user.user_role == UserRole.ADMIN
 
 
-class BookView(AuthenticatedModelView):
+class CatalogModelView(AuthenticatedModelView):
+    # Thay đổi sách/danh mục làm số lượng sách theo danh mục bị cũ
+    def after_model_change(self, form, model, is_created):
+        utils.invalidate_book_categories()
+
+    def after_model_delete(self, model):
+        utils.invalidate_book_categories()
+
+
+class BookView(CatalogModelView):
     column_filters = ['name','price']
     column_searchable_list = ['name','author']
 
     column_list = ['name', 'author', 'description', 'price', 'image', 'active', 'created_date', 'stock', 'category']
+    # Tồn kho không nằm trong form (form gửi lại số cũ sẽ ghi đè lượt bán xen giữa); sửa bằng "Điều chỉnh tồn kho"
     form_columns = ['name', 'author', 'description', 'price', 'image', 'active', 'created_date', 'category_id']
+    edit_template = 'admin/book_edit.html'
     column_labels = {
         'name': 'Tên sách',
         'author': 'Tác giả',
@@ -32,8 +46,34 @@ class BookView(AuthenticatedModelView):
         'category': 'Danh mục'
     }
 
+    def get_query(self):
+        # Cột "Danh mục" đọc book.category: nạp cùng câu SELECT thay vì mỗi dòng một truy vấn
+        return utils.admin_book_query()
+
+    @expose('/adjust-stock/', methods=['POST'])
+    def adjust_stock(self):
+        book_id = request.form.get('id', type=int)
+        delta = request.form.get('delta', type=int)
+        return_url = url_for('.edit_view', id=book_id)
+        if not book_id or not delta:
+            flash('Vui lòng nhập số lượng điều chỉnh khác 0!', 'error')
+            return redirect(return_url)
+        try:
+            if not ledger.adjust(book_id, delta, user_id=current_user.id,
+                                 note=request.form.get('note') or 'Sửa trong trang quản trị'):
+                db.session.rollback()
+                flash('Không thể điều chỉnh: sách không tồn tại hoặc tồn kho sẽ bị âm!', 'error')
+                return redirect(return_url)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Đã xảy ra lỗi: {str(e)}', 'error')
+            return redirect(return_url)
+        flash(f'Đã điều chỉnh tồn kho {delta:+d}', 'success')
+        return redirect(return_url)
+
 
-class BookCategoryView(AuthenticatedModelView):
+class BookCategoryView(CatalogModelView):
     column_list = ['name']
     form_columns = ['name']
     column_labels = {
@@ -56,7 +96,9 @@ class BookImportView(BaseView):
     def index(self):
         books = Book.query.all()
         regulations = Regulation.query.filter_by(is_active=True).all()
-        return self.render('admin/book_import.html', books=books, regulations=regulations)
+        # Điền sẵn từ trang "Sắp hết hàng": ?book_name=...&category_name=...&quantity=...&unit_price=...
+        prefill = {name: request.args.get(name, '') for name in ('book_name', 'category_name', 'quantity', 'unit_price')}
+        return self.render('admin/book_import.html', books=books, regulations=regulations, prefill=prefill)
 
     @expose('/add', methods=['POST'])
     def add_import(self):
@@ -73,35 +115,14 @@ class BookImportView(BaseView):
                 flash('Vui lòng điền đầy đủ thông tin!', 'error')
                 return redirect(url_for('.index'))
 
-            active_regulations = Regulation.query.filter_by(is_active=True).all()
-            max_stock_regulation = None
-            min_import_regulation = None
-
-            # Tìm các quy định về số lượng tồn tối đa và số lượng nhập tối thiểu
-            for regulation in active_regulations:
-                if regulation.name == "Số lượng tồn tối đa":
-                    max_stock_regulation = regulation
-                elif regulation.name == "Số lượng nhập tối thiểu":
-                    min_import_regulation = regulation
-
-            # Kiểm tra số lượng nhập tối thiểu
-            if min_import_regulation and quantity < float(min_import_regulation.value):
-                flash(f'Số lượng nhập phải lớn hơn hoặc bằng {min_import_regulation.value}!', 'error')
-                return redirect(url_for('.index'))
-
-            # Kiểm tra số lượng tồn tối đa
+            # Kiểm tra số lượng nhập tối thiểu và số lượng tồn tối đa theo bản chụp quy định hiện hành
+            rules = regulation_engine.snapshot()
             current_book = Book.query.filter_by(name=book_name).first()
             current_stock = current_book.stock if current_book else 0
-
-            if max_stock_regulation:
-                max_allowed = float(max_stock_regulation.value)
-                if (current_stock + quantity) > max_allowed:
-                    allowed_import = max_allowed - current_stock
-                    if allowed_import <= 0:
-                        flash(f'Không thể nhập thêm sách vì đã đạt số lượng tồn tối đa ({max_allowed})!', 'error')
-                    else:
-                        flash(f'Số lượng nhập vượt quá quy định! Bạn chỉ được phép nhập thêm {allowed_import} cuốn.', 'error')
-                    return redirect(url_for('.index'))
+            errors = rules.check_imports([(book_name, book_name, quantity)], {book_name: current_stock})
+            if errors:
+                flash(errors[book_name], 'error')
+                return redirect(url_for('.index'))
 
             # Xử lý thêm sách
             category = BookCategory.query.filter_by(name=category_name).first()
@@ -111,15 +132,15 @@ class BookImportView(BaseView):
                 db.session.commit()
 
             if current_book:
-                current_book.stock += quantity
                 flash(f'Cập nhật số lượng sách "{book_name}" thành công!', 'success')
             else:
+                # Sách mới bắt đầu từ 0, số lượng nhập được cộng như sách đã có
                 current_book = Book(
                     name=book_name,
                     author=None,
                     description=None,
                     price=unit_price,
-                    stock=quantity,
+                    stock=0,
                     category_id=category.id,
                     created_date=import_date
                 )
@@ -132,27 +153,54 @@ class BookImportView(BaseView):
                 book_name=book_name,
                 quantity=quantity,
                 unit_price=unit_price,
-                import_date=import_date
+                import_date=import_date,
+                regulation_version_id=rules.version
             )
             db.session.add(import_entry)
             db.session.flush()
-
-            for regulation in active_regulations:
-                reg_import = RegulationImport(
-                    regulation_id=regulation.id,
-                    import_entry_id=import_entry.id,
-                    applied_value=regulation.value
-                )
-                db.session.add(reg_import)
-
+            # stock = stock + quantity ngay trong CSDL: không ghi đè lượt trừ kho của đơn hàng đang thanh toán
+            if not ledger.adjust(current_book.id, quantity, user_id=current_user.id,
+                                 kind=ledger.IMPORT, ref_id=import_entry.id):
+                raise ValueError('Số lượng nhập làm tồn kho bị âm!')
             db.session.commit()
+            utils.invalidate_book_categories()
 
         except Exception as e:
             db.session.rollback()
+            # Danh mục mới có thể đã được commit trước khi lỗi xảy ra
+            utils.invalidate_book_categories()
             flash(f'Đã xảy ra lỗi: {str(e)}', 'error')
 
         return redirect(url_for('.index'))
 
+    @expose('/bulk', methods=['POST'])
+    def bulk_import(self):
+        upload = request.files.get('import_file')
+        if not upload or not upload.filename:
+            flash('Vui lòng chọn file CSV/XLSX!', 'error')
+            return redirect(url_for('.index'))
+
+        dry_run = bool(request.form.get('dry_run'))
+        try:
+            report = bulk_import.import_file(upload.filename, upload.stream, dry_run=dry_run)
+        except Exception as e:
+            flash(f'Không thể nhập file: {str(e)}', 'error')
+            return redirect(url_for('.index'))
+        finally:
+            if not dry_run:
+                utils.invalidate_book_categories()
+
+        if dry_run:
+            flash(f'Kiểm tra xong: {report.imported}/{report.total} dòng hợp lệ.', 'success')
+        else:
+            flash(f'Đã nhập {report.imported}/{report.total} dòng '
+                  f'({report.created_books} sách mới, {report.created_categories} thể loại mới).', 'success')
+        if report.errors:
+            flash(f'{len(report.errors)} dòng bị lỗi, xem chi tiết bên dưới.', 'error')
+
+        regulations = Regulation.query.filter_by(is_active=True).all()
+        return self.render('admin/book_import.html', books=[], regulations=regulations, report=report, prefill={})
+
     def get_integer_form_value(self, field_name, default_value=None):
         value = request.form.get(field_name)
         try:
@@ -179,22 +227,33 @@ class BookImportView(BaseView):
 
 
 class RegulationView(BaseView):
+    history_page_size = 20
+
+    def get_query(self):
+        return utils.regulation_query()
+
+    def render_page(self, regulation=None):
+        # Lịch sử nhập chỉ nạp một trang theo bộ lọc; bảng tổng hợp theo tháng tính trong SQL
+        filters = utils.import_filters(request.args)
+        page = max(request.args.get('page', 1, type=int), 1)
+        args = {k: v for k, v in request.args.items() if k != 'page' and v}
+        return self.render('admin/regulation.html',
+                         regulation=regulation,
+                         regulations=self.get_query().all(),
+                         history=utils.paginate_import_entries(page=page, per_page=self.history_page_size, **filters),
+                         summary=utils.import_summary(**filters),
+                         filter_args=args,
+                         rule_codes=RULE_CODES)
+
     @expose('/')
     def index(self):
-        regulations = Regulation.query.all()
-        import_entries = ImportEntry.query.all()
-        return self.render('admin/regulation.html',
-                         regulations=regulations,
-                         import_entries=import_entries)
+        return self.render_page()
 
     @expose('/edit/<int:id>', methods=['GET'])
     def edit_form(self, id):
         regulation = Regulation.query.get(id)
         if regulation:
-            return self.render('admin/regulation.html',
-                             regulation=regulation,
-                             regulations=Regulation.query.all(),
-                             import_entries=ImportEntry.query.all())
+            return self.render_page(regulation)
         else:
             flash('Quy định không tồn tại', 'error')
             return redirect(url_for('.index'))
@@ -213,10 +272,12 @@ class RegulationView(BaseView):
 
             regulation = Regulation.query.get(regulation_id)
             if regulation:
+                regulation.code = request.form.get('code') or None
                 regulation.name = name
                 regulation.value = value
                 regulation.is_active = is_active
                 db.session.commit()
+                regulation_engine.publish()
                 flash('Cập nhật quy định thành công!', 'success')
             else:
                 flash('Quy định không tồn tại', 'error')
@@ -233,6 +294,7 @@ class RegulationView(BaseView):
         if regulation:
             db.session.delete(regulation)
             db.session.commit()
+            regulation_engine.publish()
             flash('Quy định đã được xóa thành công.', 'success')
         else:
             flash('Không tìm thấy quy định.', 'error')
@@ -249,9 +311,11 @@ class RegulationView(BaseView):
                 flash('Tên và giá trị không thể để trống!', 'error')
                 return redirect(url_for('.index'))
 
-            new_regulation = Regulation(name=name, value=value, is_active=is_active)
+            new_regulation = Regulation(code=request.form.get('code') or None, name=name, value=value,
+                                        is_active=is_active)
             db.session.add(new_regulation)
             db.session.commit()
+            regulation_engine.publish()
 
             flash('Thêm quy định thành công!', 'success')
 
@@ -265,6 +329,78 @@ class RegulationView(BaseView):
         return current_user.is_authenticated and current_user.user_role in [UserRole.ADMIN, UserRole.QLKHO]
 
 
+class LowStockView(BaseView):
+    sort_columns = ('name', 'category', 'stock', 'velocity', 'days_of_cover', 'lead_days', 'quantity', 'status')
+    # Thứ tự khi sắp theo trạng thái: gấp nhất trước
+    status_order = {inventory.OUT: 0, inventory.REORDER: 1, inventory.BLOCKED: 2, inventory.WATCH: 3, inventory.OK: 4}
+
+    @expose('/')
+    def index(self):
+        job, plan = inventory.inventory_planner.latest()
+        books = inventory.refresh(plan) if plan else []
+
+        status = request.args.get('status')
+        if status in inventory.STATUSES:
+            books = [b for b in books if b['status'] == status]
+        sort = request.args.get('sort', 'days_of_cover')
+        sort = sort if sort in self.sort_columns else 'days_of_cover'
+        descending = request.args.get('direction') == 'desc'
+
+        def sort_key(book):
+            value = self.status_order[book['status']] if sort == 'status' else book[sort]
+            return (value is None) != descending, value if value is not None else 0, book['name']
+        books.sort(key=sort_key, reverse=descending)
+
+        return self.render('admin/low_stock.html',
+                         job=job,
+                         plan=plan,
+                         books=books,
+                         status=status,
+                         sort=sort,
+                         direction='desc' if descending else 'asc',
+                         statuses=inventory.STATUSES)
+
+    @expose('/refresh', methods=['POST'])
+    def refresh(self):
+        job = inventory.inventory_planner.submit(user_id=current_user.id)
+        if job['status'] == 'done':
+            flash('Kế hoạch nhập hàng đã là mới nhất.', 'success')
+        else:
+            flash('Đang lập lại kế hoạch nhập hàng, vui lòng tải lại trang sau ít phút.', 'success')
+        return redirect(url_for('.index'))
+
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.user_role in [UserRole.ADMIN, UserRole.QLKHO]
+
+
+class PerfView(BaseView):
+    @expose('/')
+    def index(self):
+        return self.render('admin/perf.html',
+                         enabled=profiler.enabled,
+                         report=profiler.report(),
+                         budget=profiler.query_budget,
+                         page_cache=utils.page_cache_stats(),
+                         category_cache=utils.category_catalog_stats(),
+                         principal_cache=utils.principal_cache_stats(),
+                         recommendations=utils.recommendation_stats(),
+                         analytics_cache=utils.sales_analytics_stats(),
+                         stock_ledger=utils.stock_ledger_stats())
+
+    @expose('/metrics')
+    def metrics(self):
+        return Response(profiler.prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    @expose('/reset', methods=['POST'])
+    def reset(self):
+        profiler.reset()
+        flash('Đã xóa số liệu hiệu năng.', 'success')
+        return redirect(url_for('.index'))
+
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.user_role == UserRole.ADMIN
+
+
 class MyAdminIndexView(AdminIndexView):
     @expose('/')
     def index(self):
@@ -287,13 +423,24 @@ class StatsView(BaseView):
 
         years = range(2020, current_date.year + 1)
 
+        # Báo cáo theo khoảng thời gian tùy chọn (ngày/tuần/tháng/năm)
+        sales_range = utils.sales_range(request.args)
+        try:
+            sales = utils.sales_report(**sales_range)
+        except ValueError as e:
+            flash(str(e), 'error')
+            sales = None
+
         return self.render('admin/stats.html',
                          year=year,
                          month=month,
                          years=years,
                          revenue_stats=revenue_stats,
                          book_stats=book_stats,
-                         total_revenue=total_revenue)
+                         total_revenue=total_revenue,
+                         sales=sales,
+                         sales_range=sales_range,
+                         granularities=utils.GRANULARITIES)
     def is_accessible(self):
         return current_user.is_authenticated and current_user.user_role in [UserRole.ADMIN, UserRole.QLKHO]
 
@@ -307,6 +454,8 @@ admin = Admin(app=app,
 admin.add_view(BookCategoryView(BookCategory, db.session, name='Danh mục sách'))
 admin.add_view(BookView(Book, db.session, name='Sách'))
 admin.add_view(BookImportView(name='Lập Phiếu Nhập Sách', endpoint='bookimportview'))
+admin.add_view(LowStockView(name='Sắp Hết Hàng', endpoint='lowstockview', url='/admin/low-stock'))
 admin.add_view(RegulationView(name='Thay Đổi Quy Định', endpoint='regulationview'))
 admin.add_view(StatsView(name='Thống Kê - Báo Cáo', endpoint='statsview'))
+admin.add_view(PerfView(name='Hiệu năng', endpoint='perfview', url='/admin/perf'))
 admin.add_view(LogoutView(name='Đăng xuất'))
\ No newline at end of file
@@ -0,0 +1,324 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, func, type_coerce, String
+from bookapp import db
+from bookapp.cache import LRUCache
+from bookapp.models import Book, BookCategory, Receipt, ReceiptDetail
+
+GRANULARITIES = {
+    'day': 'Ngày',
+    'week': 'Tuần',
+    'month': 'Tháng',
+    'year': 'Năm'
+}
+MAX_PERIODS = 5000  # Ví dụ: theo ngày tối đa khoảng 13 năm
+
+
+class SalesFrame:
+    """Các dòng hóa đơn trong khoảng thời gian, mỗi cột là một mảng NumPy"""
+    __slots__ = ('day', 'receipt_id', 'book_id', 'category_id', 'quantity', 'revenue')
+
+    def __init__(self, day, receipt_id, book_id, category_id, quantity, revenue):
+        self.day = day
+        self.receipt_id = receipt_id
+        self.book_id = book_id
+        self.category_id = category_id
+        self.quantity = quantity
+        self.revenue = revenue
+
+    def __len__(self):
+        return len(self.receipt_id)
+
+
+def fetch_sales(start, end, chunk_size=50000):
+    """Một câu truy vấn lọc theo khoảng created_date (dùng chỉ mục ix_receipt_created_date),
+    đọc từng khối chunk_size dòng; thể loại được gán bằng tra cứu mảng thay cho JOIN bảng book"""
+    # Chi tiết nhất là theo ngày: lấy DATE(created_date) và để NumPy chuyển cả khối,
+    # nhanh hơn nhiều so với dựng một đối tượng datetime cho từng dòng
+    stmt = select(type_coerce(func.date(Receipt.created_date), String),
+                  ReceiptDetail.receipt_id,
+                  ReceiptDetail.product_id,
+                  func.coalesce(ReceiptDetail.quantity, 0),
+                  func.coalesce(ReceiptDetail.unit_price, 0)) \
+        .join(Receipt, ReceiptDetail.receipt_id == Receipt.id) \
+        .where(Receipt.created_date >= start, Receipt.created_date < end)
+
+    # Chạy thẳng trên Connection (vẫn theo định tuyến bản sao của session): bỏ qua lớp xử lý kết quả của ORM
+    connection = db.session.connection(bind_arguments={'clause': stmt})
+    columns = [[], [], [], [], []]
+    for rows in connection.execution_options(yield_per=chunk_size).execute(stmt).partitions():
+        day, receipt_id, book_id, quantity, unit_price = zip(*rows)
+        columns[0].append(np.array(day, dtype='datetime64[D]'))
+        columns[1].append(np.array(receipt_id, dtype=np.int64))
+        columns[2].append(np.array(book_id, dtype=np.int64))
+        columns[3].append(np.array(quantity, dtype=np.int64))
+        columns[4].append(np.array(unit_price, dtype=np.float64))
+    if not columns[0]:
+        empty = np.empty(0, dtype=np.int64)
+        return SalesFrame(np.empty(0, dtype='datetime64[D]'), empty, empty, empty, empty, np.empty(0))
+
+    day, receipt_id, book_id, quantity, unit_price = (np.concatenate(c) for c in columns)
+    catalog = np.array(db.session.query(Book.id, Book.category_id).order_by(Book.id).all(),
+                       dtype=np.int64).reshape(-1, 2)
+    category_id = np.zeros(len(book_id), dtype=np.int64)  # 0: sách đã bị xóa
+    if len(catalog):
+        position = np.minimum(np.searchsorted(catalog[:, 0], book_id), len(catalog) - 1)
+        category_id = np.where(catalog[position, 0] == book_id, catalog[position, 1], 0)
+    return SalesFrame(day, receipt_id, book_id, category_id, quantity, quantity * unit_price)
+
+
+def bucket(dates, granularity):
+    """Đầu kỳ của mỗi ngày; tuần bắt đầu từ thứ Hai (1970-01-01 là thứ Năm)"""
+    days = dates.astype('datetime64[D]')
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    return days.astype('datetime64[M]' if granularity == 'month' else 'datetime64[Y]').astype('datetime64[D]')
+
+
+def period_axis(start, end, granularity):
+    """Mọi kỳ trong [start, end), kể cả kỳ không bán được gì (để trung bình trượt/tăng trưởng đúng)"""
+    first, last = bucket(np.array([start, end - timedelta(seconds=1)], dtype='datetime64[s]'), granularity)
+    if granularity in ('day', 'week'):
+        return np.arange(first, last + 1, 7 if granularity == 'week' else 1, dtype='datetime64[D]')
+    unit = 'M' if granularity == 'month' else 'Y'
+    return np.arange(first.astype(f'datetime64[{unit}]'), last.astype(f'datetime64[{unit}]') + 1) \
+        .astype('datetime64[D]')
+
+
+def moving_average(values, window):
+    """Trung bình window kỳ gần nhất; NaN cho các kỳ đầu chưa đủ dữ liệu"""
+    result = np.full(len(values), np.nan)
+    if window >= 1 and len(values) >= window:
+        sums = np.cumsum(np.concatenate(([0.0], values)))
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+def growth(values):
+    """Tăng trưởng (%) so với kỳ trước; NaN khi kỳ trước bằng 0"""
+    result = np.full(len(values), np.nan)
+    previous = values[:-1]
+    np.divide((values[1:] - previous) * 100.0, previous, out=result[1:], where=previous != 0)
+    return result
+
+
+def _number(value, digits=2):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def _share(values, total):
+    return values * 100.0 / total if total else np.zeros(len(values))
+
+
+def summarize(frame, start, end, granularity='month', window=3, top=10):
+    """Doanh thu, số lượng, số hóa đơn, tỷ trọng, trung bình trượt và tăng trưởng theo kỳ;
+    kèm tỷ trọng theo thể loại và các sách bán chạy nhất trong cả khoảng"""
+    periods = period_axis(start, end, granularity)
+    n = len(periods)
+    index = np.searchsorted(periods, bucket(frame.day, granularity))
+    revenue = np.bincount(index, weights=frame.revenue, minlength=n)
+    units = np.bincount(index, weights=frame.quantity, minlength=n)
+    # Mỗi hóa đơn thuộc đúng một kỳ: đếm theo dòng đầu tiên của từng hóa đơn
+    _, first_line = np.unique(frame.receipt_id, return_index=True)
+    orders = np.bincount(index[first_line], minlength=n)
+    total_revenue = float(revenue.sum())
+    share = _share(revenue, total_revenue)
+    average = moving_average(revenue, window)
+    change = growth(revenue)
+
+    labels = np.datetime_as_string(periods, unit='Y' if granularity == 'year' else
+                                   'M' if granularity == 'month' else 'D')
+    report_periods = [{
+        'period': str(labels[i]),
+        'revenue': round(float(revenue[i]), 2),
+        'units': int(units[i]),
+        'orders': int(orders[i]),
+        'share': round(float(share[i]), 2),
+        'moving_average': _number(average[i]),
+        'growth': _number(change[i])
+    } for i in range(n)]
+
+    categories, category_index = np.unique(frame.category_id, return_inverse=True)
+    category_revenue = np.bincount(category_index, weights=frame.revenue, minlength=len(categories))
+    category_units = np.bincount(category_index, weights=frame.quantity, minlength=len(categories))
+    category_share = _share(category_revenue, total_revenue)
+    names = dict(db.session.query(BookCategory.id, BookCategory.name)
+                 .filter(BookCategory.id.in_(categories.tolist())).all()) if len(categories) else {}
+    report_categories = [{
+        'id': int(categories[i]),
+        'name': names.get(int(categories[i]), ''),
+        'revenue': round(float(category_revenue[i]), 2),
+        'units': int(category_units[i]),
+        'share': round(float(category_share[i]), 2)
+    } for i in np.argsort(-category_revenue, kind='stable')]
+
+    books, book_index = np.unique(frame.book_id, return_inverse=True)
+    book_units = np.bincount(book_index, weights=frame.quantity, minlength=len(books))
+    book_revenue = np.bincount(book_index, weights=frame.revenue, minlength=len(books))
+    total_units = float(book_units.sum())
+    best = np.argsort(-book_units, kind='stable')[:top]
+    names = dict(db.session.query(Book.id, Book.name)
+                 .filter(Book.id.in_(books[best].tolist())).all()) if len(best) else {}
+    report_books = [{
+        'id': int(books[i]),
+        'name': names.get(int(books[i]), ''),
+        'units': int(book_units[i]),
+        'revenue': round(float(book_revenue[i]), 2),
+        'share': round(float(book_units[i] * 100.0 / total_units), 2) if total_units else 0
+    } for i in best]
+
+    return {
+        'start': start.date().isoformat(),
+        'end': (end - timedelta(days=1)).date().isoformat(),
+        'granularity': granularity,
+        'window': window,
+        'periods': report_periods,
+        'categories': report_categories,
+        'books': report_books,
+        'totals': {
+            'revenue': round(total_revenue, 2),
+            'units': int(total_units),
+            'orders': int(len(first_line)),
+            'lines': len(frame)
+        }
+    }
+
+
+class SalesAnalytics:
+    """Báo cáo doanh số cho khoảng thời gian bất kỳ, lưu đệm LRU theo (khoảng, độ chi tiết, ...).
+    Khoảng đã kết thúc trước hôm nay không đổi nên giữ lâu; khoảng chứa hôm nay bị bỏ khi có hóa đơn mới."""
+
+    def __init__(self, max_size=128, ttl=600, open_ttl=60):
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+        self.open_ttl = open_ttl
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.last_timings = None
+
+    def init_app(self, app):
+        self.cache = LRUCache(max_size=app.config.get('ANALYTICS_CACHE_SIZE', self.cache.max_size),
+                              ttl=app.config.get('ANALYTICS_CACHE_TTL', self.cache.ttl))
+        self.open_ttl = app.config.get('ANALYTICS_OPEN_RANGE_TTL', self.open_ttl)
+
+    def sales_changed(self):
+        """Gọi sau khi commit hóa đơn: các khoảng chứa hôm nay phải tính lại"""
+        with self._lock:
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.cache.clear()
+
+    def report(self, start, end, granularity='month', window=3, top=10):
+        """start/end là datetime, end không bao gồm (đầu ngày sau ngày cuối cùng)"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'Độ chi tiết không hợp lệ: {granularity}')
+        if end <= start:
+            raise ValueError('Ngày kết thúc phải sau ngày bắt đầu')
+        if len(period_axis(start, end, granularity)) > MAX_PERIODS:
+            raise ValueError('Khoảng thời gian quá dài cho độ chi tiết này')
+
+        is_open = end > datetime.combine(datetime.now().date(), datetime.min.time())
+        generation = self._generation
+        key = (start, end, granularity, window, top, generation if is_open else None)
+        report = self.cache.get(key)
+        if report is not None:
+            return report
+
+        started = time.perf_counter()
+        frame = fetch_sales(start, end)
+        fetched = time.perf_counter()
+        report = summarize(frame, start, end, granularity, window, top)
+        self.last_timings = {
+            'rows': len(frame),
+            'fetch_ms': round((fetched - started) * 1000, 1),
+            'compute_ms': round((time.perf_counter() - fetched) * 1000, 1)
+        }
+        report['timings'] = self.last_timings
+        with self._lock:
+            # Không lưu kết quả đọc trước một hóa đơn mới xảy ra trong lúc đang tính
+            if generation == self._generation or not is_open:
+                self.cache.set(key, report, ttl=self.open_ttl if is_open else None)
+        return report
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['last'] = self.last_timings
+        return stats
+
+
+sales_analytics = SalesAnalytics()
+
+
+def benchmark_report(lines=1_000_000, books=2000, categories=20, users=50, months=12):
+    """Sinh bảng hóa đơn giả lập khoảng `lines` dòng rồi so sánh báo cáo 12 tháng:
+    truy vấn SQL từng tháng (cách cũ) với một lần đọc + gom nhóm NumPy (lạnh/ấm)"""
+    import random
+    from bookapp import app, benchmark, utils
+    from bookapp.analytics import sales_analytics  # Bản mà app dùng (kể cả khi chạy bằng python -m)
+
+    results = {}
+    with app.app_context():
+        started = time.perf_counter()
+        # Mỗi hóa đơn có 1-3 dòng (trung bình 2)
+        results['dataset'] = benchmark.seed(books, categories, users, receipts=lines // 2, months=months,
+                                            rnd=random.Random(42))
+        results['dataset']['seed_s'] = round(time.perf_counter() - started, 2)
+
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        end = today + timedelta(days=1)
+        start = datetime(end.year - 1, end.month, 1)
+        months_in_range = []
+        cursor = start
+        while cursor < end:
+            months_in_range.append((cursor.month, cursor.year))
+            cursor = datetime(cursor.year + cursor.month // 12, cursor.month % 12 + 1, 1)
+
+        started = time.perf_counter()
+        sql_revenue = []
+        for month, year in months_in_range:
+            sql_revenue.append(sum(row[1] or 0 for row in utils.stats_by_category_live(month, year)))
+            utils.stats_book_sold_live(month, year)
+        results['sql_per_month_s'] = round(time.perf_counter() - started, 3)
+
+        sales_analytics.clear()
+        for granularity in ('month', 'week', 'day'):
+            started = time.perf_counter()
+            report = sales_analytics.report(start, end, granularity)
+            cold = time.perf_counter() - started
+            started = time.perf_counter()
+            sales_analytics.report(start, end, granularity)
+            warm = time.perf_counter() - started
+            if granularity == 'month':
+                # Cùng số liệu với cách cũ (sai số làm tròn số thực)
+                results['matches_sql'] = all(abs(p['revenue'] - r) < 1 for p, r in zip(report['periods'], sql_revenue))
+            results[granularity] = {
+                'periods': len(report['periods']),
+                'rows': report['timings']['rows'],
+                'fetch_s': round(report['timings']['fetch_ms'] / 1000, 3),
+                'compute_s': round(report['timings']['compute_ms'] / 1000, 3),
+                'cold_s': round(cold, 3),
+                'warm_ms': round(warm * 1000, 3)
+            }
+    results['cache'] = sales_analytics.stats()
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from bookapp import app
+
+    # python -m bookapp.analytics [số dòng]: benchmark trên bảng hóa đơn giả lập (mặc định một triệu dòng)
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        sys.exit('Benchmark xóa và tạo lại toàn bộ bảng: hãy đặt BOOKAPP_DATABASE_URI trỏ tới một file SQLite, ví dụ\n'
+                 'BOOKAPP_DATABASE_URI=sqlite:////tmp/bookapp-bench.db python -m bookapp.analytics')
+    report = benchmark_report(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
+    print(f"SQL từng tháng: {report['sql_per_month_s']} s, NumPy theo tháng: lạnh {report['month']['cold_s']} s, "
+          f"ấm {report['month']['warm_ms']} ms", file=sys.stderr)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
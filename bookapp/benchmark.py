@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from bookapp import app, db
+from bookapp.models import User, UserRole, BookCategory, Book, Receipt, ReceiptDetail, \
+    DeliveryMethod, PaymentMethod
+
+WORDS = ['Lập trình', 'Python', 'Toán học', 'Lịch sử', 'Việt Nam', 'Kinh tế', 'Tâm lý', 'Khoa học',
+         'Dữ liệu', 'Văn học', 'Thiếu nhi', 'Kỹ năng', 'Đắc nhân tâm', 'Nghệ thuật', 'Triết học', 'Y học']
+AUTHORS = ['Nguyễn Nhật Ánh', 'Tô Hoài', 'Nam Cao', 'Dale Carnegie', 'Yuval Harari', 'Trần Văn B']
+PASSWORD = '123'
+BATCH = 2000
+
+
+def _insert(model, rows):
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(insert(model), rows[i:i + BATCH])
+
+
+def seed(books=2000, categories=20, users=50, receipts=5000, lines_per_receipt=3, months=12, rnd=None):
+    """Tạo lại toàn bộ bảng và sinh dữ liệu giả lập (cùng seed -> cùng dữ liệu)"""
+    from bookapp import rollup, ledger
+    rnd = rnd or random.Random(42)
+    db.drop_all()
+    db.create_all()
+
+    password = hashlib.md5(PASSWORD.encode('utf-8')).hexdigest()
+    _insert(BookCategory, [{'name': f'Thể loại {i + 1}'} for i in range(categories)])
+    _insert(User, [{'name': 'Quản trị', 'username': 'bench-admin', 'password': password,
+                    'user_role': UserRole.ADMIN, 'active': True, 'joined_date': datetime.now()}] +
+            [{'name': f'Khách {i + 1}', 'username': f'bench-user-{i + 1}', 'password': password,
+              'user_role': UserRole.USER, 'active': True, 'joined_date': datetime.now()} for i in range(users)])
+    _insert(Book, [{
+        'name': f'{rnd.choice(WORDS)} {rnd.choice(WORDS)} {i + 1}',
+        'author': rnd.choice(AUTHORS),
+        'description': f'{rnd.choice(WORDS)} {rnd.choice(WORDS)}',
+        'price': rnd.randrange(20, 500) * 1000,
+        'image': None,
+        'active': True,
+        'created_date': datetime.now() - timedelta(days=rnd.randrange(365)),
+        'stock': 10 ** 6,  # Đủ lớn để các lượt thanh toán không bị từ chối
+        'category_id': rnd.randrange(categories) + 1
+    } for i in range(books)])
+    ledger.opening_balances()  # Hóa đơn giả lập bên dưới không trừ kho nên sổ chỉ có số dư đầu kỳ
+    db.session.commit()
+
+    prices = dict(db.session.query(Book.id, Book.price).all())
+    now = datetime.now()
+    receipt_rows, detail_rows = [], []
+    for receipt_id in range(1, receipts + 1):
+        receipt_rows.append({
+            'id': receipt_id,
+            'created_date': now - timedelta(days=rnd.randrange(months * 30), seconds=rnd.randrange(86400)),
+            'user_id': rnd.randrange(users) + 2,
+            'delivery_method': rnd.choice(list(DeliveryMethod)),
+            'payment_method': rnd.choice(list(PaymentMethod)),
+            'phone': '0900000000'
+        })
+        for book_id in rnd.sample(range(1, books + 1), min(books, rnd.randint(1, lines_per_receipt))):
+            detail_rows.append({'receipt_id': receipt_id, 'product_id': book_id,
+                                'quantity': rnd.randint(1, 3), 'unit_price': prices[book_id]})
+    _insert(Receipt, receipt_rows)
+    _insert(ReceiptDetail, detail_rows)
+    db.session.commit()
+    rollup.rebuild()
+    return {'books': books, 'categories': categories, 'users': users,
+            'receipts': receipts, 'receipt_lines': len(detail_rows)}
+
+
+def _login(client, username):
+    client.post('/user-login', data={'username': username, 'password': PASSWORD})
+    return client
+
+
+def _percentiles(values):
+    from bookapp.profiling import percentile
+    values = sorted(values)
+    return {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99), 'max': values[-1] if values else 0}
+
+
+def scenarios(books, users):
+    """Tên kịch bản -> (tài khoản, hàm(client, rnd) trả về response được đo)"""
+    now = datetime.now()
+    keywords = [w.split()[0] for w in WORDS]
+
+    def pay(client, rnd):
+        for _ in range(rnd.randint(1, 3)):
+            client.post('/api/add-cart', json={'id': rnd.randrange(books) + 1})
+        return client.post('/api/pay', json={'delivery_method': 'home', 'payment_method': 'cod',
+                                             'phone': '0900000000', 'email': 'bench@example.com'})
+
+    def update_cart(client, rnd):
+        book_id = rnd.randrange(books) + 1
+        client.post('/api/add-cart', json={'id': book_id})
+        return client.post('/api/update-cart', json={'id': book_id, 'change': -1})
+
+    return {
+        'home': ('user', lambda c, r: c.get('/')),
+        'product_list': ('user', lambda c, r: c.get(f'/product-list?page={r.randint(1, 5)}')),
+        'search': ('user', lambda c, r: c.get(f'/search?kw={r.choice(keywords)}')),
+        'add_cart': ('user', lambda c, r: c.post('/api/add-cart', json={'id': r.randrange(books) + 1})),
+        'update_cart': ('user', update_cart),
+        'cart': ('user', lambda c, r: c.get('/cart')),
+        'pay': ('user', pay),
+        'stats': ('admin', lambda c, r: c.get(f'/admin/statsview/?month={now.month}&year={now.year}')),
+        'export_stats': ('admin', lambda c, r: c.get(f'/export-stats/{now.month}/{now.year}')),
+    }
+
+
+def run_scenario(name, role, action, requests, concurrency, users, seed_value=0):
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index, count):
+        rnd = random.Random(seed_value * 1000 + index)
+        client = app.test_client()
+        _login(client, 'bench-admin' if role == 'admin' else f'bench-user-{index % users + 1}')
+        for _ in range(count):
+            started = time.perf_counter()
+            response = action(client, rnd)
+            elapsed = time.perf_counter() - started
+            response.get_data()  # Đọc hết body (phản hồi dạng stream)
+            with lock:
+                latencies.append(elapsed * 1000)
+                if response.headers.get('X-Query-Count'):
+                    queries.append(int(response.headers['X-Query-Count']))
+                if response.status_code >= 400 or (response.is_json and response.json.get('code', 200) >= 400):
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_worker) if n]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration else 0,
+        'latency_ms': {k: round(v, 2) for k, v in _percentiles(latencies).items()},
+        'queries': _percentiles(queries) if queries else None
+    }
+
+
+def compare(baseline, report):
+    """So sánh với báo cáo của một commit trước: chênh lệch p95 (%) và số câu SQL p95"""
+    result = {}
+    for name, current in report['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        old_p95, new_p95 = old['latency_ms']['p95'], current['latency_ms']['p95']
+        result[name] = {
+            'p95_ms': [old_p95, new_p95],
+            'p95_change_pct': round((new_p95 - old_p95) * 100 / old_p95, 1) if old_p95 else None,
+            'queries_p95': [(old.get('queries') or {}).get('p95'), (current.get('queries') or {}).get('p95')]
+        }
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_app():
+    # Template/static nằm trong thư mục bookapp; session trong bộ nhớ; luôn bật đo số câu SQL
+    app.root_path = os.path.dirname(os.path.abspath(__file__))
+    app.config['PROFILING'] = True
+    from bookapp.profiling import profiler
+    from bookapp.session_store import ServerSessionInterface, MemorySessionStore
+    from bookapp import index, admin  # Đăng ký route và các view quản trị
+    profiler.init_app(app)
+    app.session_interface = ServerSessionInterface(MemorySessionStore(), sweep_interval=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Đo hiệu năng các trang chính trên CSDL SQLite giả lập')
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--receipts', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help='Số request cho mỗi kịch bản')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', nargs='*', help='Chỉ chạy các kịch bản này')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Ghi báo cáo JSON ra file (mặc định in ra màn hình)')
+    parser.add_argument('--compare', help='File báo cáo JSON của lần chạy trước để so sánh')
+    args = parser.parse_args(argv)
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not uri.startswith('sqlite'):
+        sys.exit('Benchmark xóa và tạo lại toàn bộ bảng: hãy đặt BOOKAPP_DATABASE_URI trỏ tới một file SQLite, ví dụ\n'
+                 'BOOKAPP_DATABASE_URI=sqlite:////tmp/bookapp-bench.db python -m bookapp.benchmark')
+
+    prepare_app()
+    with app.app_context():
+        started = time.perf_counter()
+        dataset = seed(args.books, args.categories, args.users, args.receipts, rnd=random.Random(args.seed))
+        dataset['seed_s'] = round(time.perf_counter() - started, 2)
+
+    results = {}
+    for name, (role, action) in scenarios(args.books, args.users).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run_scenario(name, role, action, args.requests, args.concurrency, args.users, args.seed)
+        print(f'{name}: {results[name]["throughput_rps"]} req/s, p95 {results[name]["latency_ms"]["p95"]} ms',
+              file=sys.stderr)
+
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': uri.split('://')[0],
+        'dataset': dataset,
+        'requests_per_scenario': args.requests,
+        'concurrency': args.concurrency,
+        'scenarios': results
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['baseline_revision'] = baseline.get('revision')
+        report['comparison'] = compare(baseline, report)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == '__main__':
+    main()
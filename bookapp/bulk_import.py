@@ -0,0 +1,241 @@
+import csv
+import io
+import os
+from datetime import datetime
+from sqlalchemy import insert, update, bindparam
+from bookapp import db, ledger
+from bookapp.models import Book, BookCategory, ImportEntry
+from bookapp.regulations import regulation_engine
+from bookapp.search import fold
+
+BATCH_SIZE = 500
+IN_CHUNK = 500  # Số tên tối đa trong một mệnh đề IN
+
+# Tên cột chấp nhận được (đã bỏ dấu, chữ thường) -> trường
+HEADERS = {
+    'ten sach': 'book_name', 'book_name': 'book_name', 'name': 'book_name',
+    'the loai': 'category_name', 'category_name': 'category_name', 'category': 'category_name',
+    'so luong': 'quantity', 'quantity': 'quantity',
+    'don gia': 'unit_price', 'don gia (vnd)': 'unit_price', 'unit_price': 'unit_price', 'price': 'unit_price',
+    'ngay nhap': 'import_date', 'import_date': 'import_date', 'date': 'import_date',
+}
+REQUIRED = {'book_name': 'Tên sách', 'category_name': 'Thể loại', 'quantity': 'Số lượng', 'unit_price': 'Đơn giá'}
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S')
+
+
+class ImportReport:
+    def __init__(self):
+        self.total = 0
+        self.imported = 0
+        self.created_books = 0
+        self.created_categories = 0
+        self.errors = []  # [(dòng, thông báo)]
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'imported': self.imported,
+            'created_books': self.created_books,
+            'created_categories': self.created_categories,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors]
+        }
+
+
+def read_rows(filename, stream):
+    """Đọc từng dòng của file CSV/XLSX, trả về (số dòng, dict theo tên trường); không nạp hết file"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        wb = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            yield from _map_rows(rows)
+        finally:
+            wb.close()
+    elif ext == '.csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        yield from _map_rows(csv.reader(text))
+    else:
+        raise ValueError('Chỉ hỗ trợ file .csv hoặc .xlsx!')
+
+
+def _map_rows(rows):
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = [HEADERS.get(fold(str(h)).strip()) if h is not None else None for h in header]
+    missing = [label for f, label in REQUIRED.items() if f not in fields]
+    if missing:
+        raise ValueError(f'Thiếu cột: {", ".join(missing)}')
+
+    for line, values in enumerate(rows, 2):
+        if not any(v not in (None, '') for v in values):
+            continue  # Bỏ qua dòng trống
+        yield line, {f: v for f, v in zip(fields, values) if f}
+
+
+def _parse(row):
+    book_name = str(row.get('book_name') or '').strip()
+    category_name = str(row.get('category_name') or '').strip()
+    if not book_name or not category_name:
+        raise ValueError('Thiếu tên sách hoặc thể loại')
+
+    try:
+        quantity = float(row.get('quantity'))
+        unit_price = float(row.get('unit_price'))
+    except (TypeError, ValueError):
+        raise ValueError('Số lượng/đơn giá không hợp lệ')
+    if quantity != int(quantity) or quantity <= 0 or unit_price < 0:
+        raise ValueError('Số lượng/đơn giá không hợp lệ')
+
+    value = row.get('import_date')
+    if isinstance(value, datetime):
+        import_date = value
+    elif value in (None, ''):
+        import_date = datetime.now()
+    else:
+        for fmt in DATE_FORMATS:
+            try:
+                import_date = datetime.strptime(str(value).strip(), fmt)
+                break
+            except ValueError:
+                pass
+        else:
+            raise ValueError(f'Ngày nhập không hợp lệ: {value}')
+
+    return book_name, category_name, int(quantity), unit_price, import_date
+
+
+def _chunks(values, size=IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class BulkImporter:
+    """Nhập sách hàng loạt: tra cứu sách/danh mục bằng IN theo lô, kiểm tra quy định trong bộ nhớ,
+    chèn ImportEntry hàng loạt và commit một lần ở cuối"""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self.rules = regulation_engine.snapshot()  # Cả file dùng chung một phiên bản quy định
+        self.books = {}  # tên sách -> id hoặc None nếu sách mới
+        self.stocks = {}  # tên sách -> tồn kho dự kiến sau các dòng đã nhận
+        self.categories = {}  # tên danh mục -> id hoặc None nếu danh mục mới
+
+    def _lookup(self, parsed):
+        book_names = {p[0] for _, p in parsed} - self.books.keys()
+        for names in _chunks(book_names):
+            for book_id, name, stock in db.session.query(Book.id, Book.name, Book.stock) \
+                    .filter(Book.name.in_(names)).order_by(Book.id):
+                if name not in self.books:  # Trùng tên: lấy sách đầu tiên như trước
+                    self.books[name] = book_id
+                    self.stocks[name] = stock or 0
+
+        category_names = {p[1] for _, p in parsed} - self.categories.keys()
+        for names in _chunks(category_names):
+            for category_id, name in db.session.query(BookCategory.id, BookCategory.name) \
+                    .filter(BookCategory.name.in_(names)).order_by(BookCategory.id):
+                self.categories.setdefault(name, category_id)
+
+    def _process(self, batch):
+        parsed = []
+        for line, row in batch:
+            try:
+                parsed.append((line, _parse(row)))
+            except ValueError as e:
+                self.report.error(line, str(e))
+        self._lookup(parsed)
+
+        # Kiểm tra quy định cho cả lô trong một lần gọi, tồn kho được cộng dồn theo thứ tự dòng
+        errors = self.rules.check_imports([(line, p[0], p[2]) for line, p in parsed], self.stocks)
+        for line, message in errors.items():
+            self.report.error(line, message)
+
+        accepted = []
+        new_books = {}  # tên sách -> (tên danh mục, đơn giá, ngày nhập) của dòng đầu tiên
+        for line, (book_name, category_name, quantity, unit_price, import_date) in parsed:
+            if line in errors:
+                continue
+            if book_name not in self.books:
+                self.books[book_name] = None
+                new_books[book_name] = (category_name, unit_price, import_date)
+                self.categories.setdefault(category_name, None)
+            accepted.append((book_name, quantity, unit_price, import_date))
+
+        if accepted:
+            self._write(accepted, new_books)
+
+    def _write(self, accepted, new_books):
+        new_categories = [name for name, category_id in self.categories.items() if category_id is None]
+        if new_categories:
+            db.session.execute(insert(BookCategory), [{'name': name} for name in new_categories])
+            for names in _chunks(new_categories):
+                for category_id, name in db.session.query(BookCategory.id, BookCategory.name) \
+                        .filter(BookCategory.name.in_(names)):
+                    self.categories[name] = category_id
+            self.report.created_categories += len(new_categories)
+
+        if new_books:
+            books = [Book(name=name, author=None, description=None, price=unit_price, stock=0,
+                          category_id=self.categories[category_name], created_date=import_date)
+                     for name, (category_name, unit_price, import_date) in new_books.items()]
+            db.session.add_all(books)
+            db.session.flush()
+            for book in books:
+                self.books[book.name] = book.id
+            self.report.created_books += len(books)
+
+        # Cộng tồn kho: một câu UPDATE executemany cho cả lô
+        added = {}
+        for book_name, quantity, _, _ in accepted:
+            book_id = self.books[book_name]
+            added[book_id] = added.get(book_id, 0) + quantity
+        book_table = Book.__table__
+        db.session.execute(update(book_table)
+                           .where(book_table.c.id == bindparam('b_id'))
+                           .values(stock=book_table.c.stock + bindparam('b_qty')),
+                           [{'b_id': book_id, 'b_qty': qty} for book_id, qty in added.items()])
+
+        # Mỗi phiếu nhập ghi phiên bản quy định đã áp dụng, không cần đọc lại id nên chèn bằng executemany
+        db.session.execute(insert(ImportEntry), [{
+            'book_id': self.books[book_name],
+            'book_name': book_name,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'import_date': import_date,
+            'regulation_version_id': self.rules.version
+        } for book_name, quantity, unit_price, import_date in accepted])
+        ledger.record(ledger.IMPORT, [(self.books[book_name], quantity) for book_name, quantity, _, _ in accepted],
+                      note='Nhập từ file')
+        self.report.imported += len(accepted)
+
+    def run(self, rows, dry_run=False):
+        batch = []
+        try:
+            for item in rows:
+                self.report.total += 1
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._process(batch)
+                    batch = []
+            if batch:
+                self._process(batch)
+            self.report.errors.sort()
+
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return self.report
+
+
+def import_file(filename, stream, dry_run=False, batch_size=BATCH_SIZE):
+    return BulkImporter(batch_size=batch_size).run(read_rows(filename, stream), dry_run=dry_run)
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bộ nhớ đệm LRU có giới hạn số phần tử, dung lượng (byte) và thời gian sống"""
+
+    def __init__(self, max_size=1024, ttl=None, max_bytes=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (giá trị, hết hạn lúc, kích thước)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, size=0):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # Quá lớn, không lưu
+            self._items[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._items) > self.max_size or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                old_key = next(iter(self._items))
+                self._pop(old_key)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key) is not None
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+        return item
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def sweep(self):
+        """Xóa các phần tử đã hết hạn, trả về số phần tử bị xóa"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (value, expires_at, size) in self._items.items()
+                       if expires_at is not None and expires_at <= now]
+            for key in expired:
+                self._pop(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            return item is not None and (item[1] is None or item[1] > time.monotonic())
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
@@ -0,0 +1,190 @@
+import threading
+from bookapp import db
+from bookapp.models import Book
+from bookapp.catalog import on_books_committed
+
+PACK_VERSION = 1
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class BookInfoCache:
+    """Tên/giá sách dùng để hiển thị giỏ hàng, tra cứu hàng loạt bằng một câu IN"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = {}  # book_id -> (tên, giá)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, book_ids):
+        found = {}
+        missing = []
+        for book_id in book_ids:
+            info = self._items.get(book_id)
+            if info is None:
+                missing.append(book_id)
+            else:
+                found[book_id] = info
+        self.hits += len(found)
+        if missing:
+            self.misses += len(missing)
+            rows = db.session.query(Book.id, Book.name, Book.price).filter(Book.id.in_(missing)).all()
+            with self._lock:
+                if len(self._items) + len(rows) > self.max_size:
+                    self._items.clear()
+                for book_id, name, price in rows:
+                    info = (name, float(price or 0))
+                    self._items[book_id] = info
+                    found[book_id] = info
+        return found
+
+    def get(self, book_id):
+        return self.get_many([book_id]).get(book_id)
+
+    def put(self, book_id, name, price):
+        with self._lock:
+            self._items[book_id] = (name, float(price or 0))
+
+    def discard(self, book_ids):
+        with self._lock:
+            for book_id in book_ids:
+                self._items.pop(book_id, None)
+
+    def stats(self):
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+book_info = BookInfoCache()
+
+
+@on_books_committed
+def _apply_book_changes(changes):
+    book_info.discard(changes)
+
+
+class Cart:
+    """Giỏ hàng chỉ lưu {book_id: số lượng}; tổng tiền được lưu kèm để hiển thị trên header
+    và tính lại theo giá hiện tại (tra hàng loạt qua book_info) mỗi khi giỏ thay đổi"""
+
+    def __init__(self, items=None, total_amount=None):
+        self.items = dict(items or {})
+        self.total_quantity = sum(self.items.values())
+        if total_amount is None:
+            total_amount = self._amount(self.items)
+        self.total_amount = total_amount
+
+    @staticmethod
+    def _amount(items):
+        prices = book_info.get_many(list(items))
+        return sum(qty * prices[book_id][1] for book_id, qty in items.items() if book_id in prices)
+
+    @classmethod
+    def load(cls, raw):
+        """Đọc giỏ hàng từ session: dạng nén (bytes) hoặc dạng dict cũ"""
+        if not raw:
+            return cls()
+        if isinstance(raw, (bytes, bytearray)):
+            return cls.unpack(raw)
+        if isinstance(raw, dict):
+            # Định dạng cũ: {id: {'id', 'name', 'price', 'quantity'}}
+            items = {}
+            for c in raw.values():
+                items[int(c['id'])] = items.get(int(c['id']), 0) + int(c['quantity'])
+            return cls(items)
+        return cls()
+
+    def pack(self):
+        # [phiên bản][tổng tiền (xu)] rồi từng cặp (chênh lệch id, số lượng) dạng varint
+        out = bytearray()
+        _write_varint(out, PACK_VERSION)
+        _write_varint(out, max(0, round(self.total_amount * 100)))
+        previous = 0
+        for book_id in sorted(self.items):
+            _write_varint(out, book_id - previous)
+            _write_varint(out, self.items[book_id])
+            previous = book_id
+        return bytes(out)
+
+    @classmethod
+    def unpack(cls, data):
+        try:
+            version, pos = _read_varint(data, 0)
+            if version != PACK_VERSION:
+                return cls()
+            cents, pos = _read_varint(data, pos)
+            items = {}
+            book_id = 0
+            while pos < len(data):
+                delta, pos = _read_varint(data, pos)
+                qty, pos = _read_varint(data, pos)
+                book_id += delta
+                items[book_id] = qty
+        except IndexError:
+            return cls()
+        return cls(items, total_amount=cents / 100)
+
+    def dump(self):
+        return self.pack()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def quantity(self, book_id):
+        return self.items.get(int(book_id), 0)
+
+    def set(self, book_id, quantity):
+        book_id = int(book_id)
+        old = self.items.get(book_id, 0)
+        if quantity > 0:
+            self.items[book_id] = quantity
+        else:
+            self.items.pop(book_id, None)
+            quantity = 0
+        self.total_quantity += quantity - old
+        # Không cộng/trừ dần theo giá lúc thêm: giá có thể đã đổi, tổng sẽ lệch (thậm chí âm)
+        self.total_amount = self._amount(self.items)
+
+    def add(self, book_id, quantity):
+        self.set(book_id, self.quantity(book_id) + quantity)
+
+    def remove(self, book_id):
+        book_id = int(book_id)
+        if book_id in self.items:
+            self.set(book_id, 0)
+
+    def lines(self):
+        """Các dòng hiển thị của giỏ, tính lại tổng tiền theo giá hiện tại"""
+        prices = book_info.get_many(list(self.items))
+        lines = []
+        for book_id, qty in self.items.items():
+            name, price = prices.get(book_id, ('', 0))
+            lines.append({'id': book_id, 'name': name, 'price': price, 'quantity': qty})
+        self.total_amount = sum(line['price'] * line['quantity'] for line in lines)
+        return lines
+
+    def stats(self):
+        return {
+            'total_quantity': self.total_quantity,
+            'total_amount': self.total_amount
+        }
@@ -0,0 +1,144 @@
+import threading
+import time
+from sqlalchemy import func, event, inspect
+from bookapp import db
+from bookapp.models import BookCategory, Book
+
+
+class CategoryCount:
+    # Bản ghi nhẹ thay cho đối tượng ORM để có thể dùng lại giữa các request
+    __slots__ = ('id', 'name', 'product_count')
+
+    def __init__(self, id, name, product_count):
+        self.id = id
+        self.name = name
+        self.product_count = product_count
+
+    def __str__(self):
+        return self.name
+
+
+class CategoryCatalog:
+    """Ảnh chụp danh mục sách + số lượng sách, lưu trong bộ nhớ tiến trình"""
+
+    def __init__(self, ttl=300, max_counts=1024):
+        self.ttl = ttl
+        self.max_counts = max_counts
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._counts = {}
+        self._loaded_at = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def load(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        generation = self._generation
+        snapshot = self._fetch()
+        with self._lock:
+            # Chỉ lưu nếu không có thay đổi nào xảy ra trong lúc đang truy vấn
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return snapshot
+
+    def _fetch(self):
+        # Một câu GROUP BY duy nhất thay cho một câu COUNT cho mỗi danh mục
+        rows = db.session.query(BookCategory.id, BookCategory.name, func.count(Book.id)) \
+            .outerjoin(Book, Book.category_id == BookCategory.id) \
+            .group_by(BookCategory.id, BookCategory.name) \
+            .order_by(BookCategory.id) \
+            .all()
+        return tuple(CategoryCount(id, name, count) for id, name, count in rows)
+
+    def count(self, key, loader):
+        """Tổng số bản ghi của một bộ lọc (dùng cho phân trang), lưu đệm theo key"""
+        cached = self._counts.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        generation = self._generation
+        total = loader()
+        with self._lock:
+            if generation == self._generation:
+                if len(self._counts) >= self.max_counts:
+                    self._counts.clear()
+                self._counts[key] = (total, time.monotonic())
+        return total
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+            self._counts.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / total, 4) if total else 0,
+            'size': len(self._snapshot) if self._snapshot is not None else 0,
+            'cached_counts': len(self._counts)
+        }
+
+
+category_catalog = CategoryCatalog()
+
+
+# --- Theo dõi thay đổi của bảng book để cập nhật các chỉ mục trong bộ nhớ ---
+
+TRACKED_FIELDS = ('name', 'author', 'description', 'price', 'image', 'active')
+_book_listeners = []
+
+
+def on_books_committed(listener):
+    """Đăng ký hàm nhận {book_id: {trường: giá trị mới} hoặc None nếu bị xóa}
+    sau mỗi lần commit có thay đổi sách"""
+    _book_listeners.append(listener)
+    return listener
+
+
+def _snapshot(book):
+    return {field: getattr(book, field) for field in TRACKED_FIELDS}
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_book_changes(session, flush_context):
+    pending = session.info.setdefault('book_changes', {})
+    for obj in session.new:
+        if isinstance(obj, Book):
+            pending[obj.id] = _snapshot(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Book):
+            state = inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in TRACKED_FIELDS):
+                pending[obj.id] = _snapshot(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Book):
+            pending[obj.id] = None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_book_changes(session):
+    changes = session.info.pop('book_changes', None)
+    if not changes:
+        return
+    for listener in _book_listeners:
+        listener(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_book_changes(session):
+    session.info.pop('book_changes', None)
@@ -0,0 +1,154 @@
+from datetime import datetime
+from sqlalchemy import insert, update
+from bookapp import db, rollup, ledger
+from bookapp.regulations import regulation_engine
+from bookapp.analytics import sales_analytics
+from bookapp.suggest import suggester
+from bookapp.models import Book, Receipt, ReceiptDetail, DeliveryMethod, PaymentMethod
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def place_order(quantities, user, delivery_method, payment_method, phone, email, delivery_address=None):
+    """Tạo hóa đơn và trừ tồn kho trong MỘT giao dịch:
+    - một câu SELECT ... WHERE id IN (...) FOR UPDATE để kiểm tra tồn kho,
+    - UPDATE có điều kiện stock >= số lượng cho từng dòng (không thể bán âm kho),
+    - chèn toàn bộ ReceiptDetail và các dòng sổ tồn kho bằng executemany, commit một lần."""
+    quantities = {book_id: qty for book_id, qty in quantities.items() if qty > 0}
+    if not quantities:
+        raise CheckoutError('Giỏ hàng trống!')
+
+    errors = regulation_engine.snapshot().check_cart(quantities)
+    if errors:
+        raise CheckoutError(next(iter(errors.values())))
+
+    try:
+        # Khóa các dòng sách trong giỏ (MySQL); SQLite bỏ qua FOR UPDATE nhưng
+        # UPDATE có điều kiện bên dưới vẫn đảm bảo không bán vượt tồn kho
+        books = {b.id: b for b in Book.query.filter(Book.id.in_(list(quantities)))
+                                            .order_by(Book.id)
+                                            .with_for_update()
+                                            .all()}
+        for book_id, qty in quantities.items():
+            book = books.get(book_id)
+            if not book:
+                raise CheckoutError(f'Sản phẩm mã {book_id} không tồn tại!')
+            if book.stock < qty:
+                raise CheckoutError(f'Sản phẩm {book.name} chỉ còn {book.stock} trong kho!')
+
+        receipt = Receipt(
+            created_date=datetime.now(),
+            user_id=user.id,
+            delivery_method=DeliveryMethod[delivery_method.upper()],
+            payment_method=PaymentMethod[payment_method.upper()],
+            delivery_address=delivery_address,
+            phone=phone,
+            email=email
+        )
+        db.session.add(receipt)
+        db.session.flush()
+
+        # Trừ kho theo thứ tự id để hai giao dịch đồng thời không khóa chéo nhau
+        for book_id in sorted(quantities):
+            qty = quantities[book_id]
+            result = db.session.execute(
+                update(Book)
+                .where(Book.id == book_id, Book.stock >= qty)
+                .values(stock=Book.stock - qty)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                raise CheckoutError(f'Sản phẩm {books[book_id].name} không đủ số lượng trong kho!')
+
+        db.session.execute(insert(ReceiptDetail), [{
+            'receipt_id': receipt.id,
+            'product_id': book_id,
+            'quantity': qty,
+            'unit_price': books[book_id].price
+        } for book_id, qty in quantities.items()])
+
+        # Cộng dồn vào bảng tổng hợp doanh số trong cùng giao dịch
+        rollup.record_sale(receipt.created_date, [
+            (book_id, books[book_id].category_id, qty, books[book_id].price)
+            for book_id, qty in quantities.items()
+        ])
+        ledger.record(ledger.SALE, [(book_id, -qty) for book_id, qty in quantities.items()],
+                      ref_id=receipt.id, user_id=user.id)
+
+        db.session.commit()
+        sales_analytics.sales_changed()
+        suggester.sold(quantities)  # Sách bán chạy lên đầu gợi ý ngay, không chờ dựng lại
+        return receipt
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def stress_test(threads=8, orders_per_thread=25, stock=100, quantity=1):
+    """Nhiều luồng cùng thanh toán một cuốn sách, kiểm tra không bị bán vượt tồn kho"""
+    import threading
+    import uuid
+    from bookapp import app
+    from bookapp.models import User, BookCategory
+
+    with app.app_context():
+        db.create_all()
+        tag = uuid.uuid4().hex[:8]
+        user = User(name='stress', username=f'stress-{tag}', password='x')
+        category = BookCategory(name=f'stress-{tag}')
+        db.session.add_all([user, category])
+        db.session.flush()
+        book = Book(name=f'stress-{tag}', price=1000, stock=stock, category_id=category.id)
+        db.session.add(book)
+        db.session.flush()
+        ledger.record(ledger.ADJUST, [(book.id, stock)], note=ledger.OPENING_NOTE)
+        db.session.commit()
+        user_id, book_id = user.id, book.id
+
+    outcome = {'ok': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker():
+        with app.app_context():
+            buyer = db.session.get(User, user_id)
+            for _ in range(orders_per_thread):
+                try:
+                    place_order({book_id: quantity}, buyer, 'home', 'cod', '0900000000', None)
+                    key = 'ok'
+                except CheckoutError:
+                    key = 'rejected'
+                except Exception:
+                    key = 'errors'  # Ví dụ: SQLite báo "database is locked"
+                with lock:
+                    outcome[key] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    with app.app_context():
+        final_stock = db.session.get(Book, book_id).stock
+        sold = db.session.query(db.func.coalesce(db.func.sum(ReceiptDetail.quantity), 0)) \
+            .filter(ReceiptDetail.product_id == book_id).scalar()
+
+    outcome.update(initial_stock=stock, final_stock=final_stock, sold=int(sold))
+    outcome['consistent'] = final_stock >= 0 and stock - final_stock == sold \
+        and sold == outcome['ok'] * quantity
+    return outcome
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    # Chạy trên CSDL thử nghiệm, ví dụ:
+    # BOOKAPP_DATABASE_URI=sqlite:////tmp/bookapp-stress.db python -m bookapp.checkout
+    if not os.environ.get('BOOKAPP_DATABASE_URI'):
+        sys.exit('Hãy đặt BOOKAPP_DATABASE_URI trỏ tới CSDL thử nghiệm (SQLite hoặc MySQL cục bộ)')
+    result = stress_test()
+    print(result)
+    sys.exit(0 if result['consistent'] else 1)
@@ -0,0 +1,187 @@
+import os
+from contextlib import contextmanager
+from functools import wraps
+from sqlalchemy import Insert, Update, Delete, event
+from flask_sqlalchemy.session import Session
+from urllib.parse import quote
+
+REPLICA = 'replica'
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_URI = "mysql+pymysql://root:%s@localhost/bookstoredb?charset=utf8mb4" % quote('Admin@123')
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes', 'on') if value not in (None, '') else default
+
+
+def database_uri():
+    """BOOKAPP_DATABASE_URI nếu có; BOOKAPP_DB_BACKEND=sqlite để chạy cục bộ bằng file SQLite"""
+    uri = os.environ.get('BOOKAPP_DATABASE_URI')
+    if uri:
+        return uri
+    if os.environ.get('BOOKAPP_DB_BACKEND', 'mysql') == 'sqlite':
+        path = os.environ.get('BOOKAPP_SQLITE_PATH', os.path.join(BASE_DIR, 'bookstore.db'))
+        return f'sqlite:///{path}'
+    return DEFAULT_URI
+
+
+def engine_options(uri):
+    """Tùy chọn pool lấy từ biến môi trường (SQLite dùng pool mặc định của SQLAlchemy)"""
+    options = {'pool_pre_ping': _env_bool('BOOKAPP_DB_POOL_PRE_PING', True)}
+    if not uri.startswith('sqlite'):
+        options.update(
+            pool_size=_env_int('BOOKAPP_DB_POOL_SIZE', 10),
+            max_overflow=_env_int('BOOKAPP_DB_MAX_OVERFLOW', 20),
+            pool_timeout=_env_int('BOOKAPP_DB_POOL_TIMEOUT', 30),
+            # Nhỏ hơn wait_timeout của MySQL để không dùng lại kết nối đã bị server đóng
+            pool_recycle=_env_int('BOOKAPP_DB_POOL_RECYCLE', 1800),
+        )
+    return options
+
+
+def configure(app):
+    uri = database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    # Không cần tín hiệu models_committed, tắt để bớt chi phí theo dõi từng đối tượng khi flush
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = _env_bool('BOOKAPP_DB_ECHO', False)
+
+    replica_uri = os.environ.get('BOOKAPP_DATABASE_REPLICA_URI')
+    if replica_uri:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA] = dict(engine_options(replica_uri), url=replica_uri)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+
+class RoutingSession(Session):
+    """Session chọn engine theo ngữ cảnh: trong replica_reads() các câu SELECT chạy trên bản sao,
+    mọi câu ghi (và mọi truy vấn sau khi giao dịch đã ghi) chạy trên CSDL chính."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get(REPLICA) and not self._flushing \
+                and not self.info.get('wrote') and not isinstance(clause, (Insert, Update, Delete)):
+            replica = self._db.engines.get(REPLICA)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    # Đọc lại ngay dữ liệu vừa ghi: phần còn lại của giao dịch dùng CSDL chính
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def _mark_bulk_written(update_context):
+    update_context.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _reset_written(session, *args):
+    session.info.pop('wrote', None)
+
+
+@contextmanager
+def replica_reads(session=None):
+    """Chuyển các truy vấn chỉ đọc trong khối lệnh sang bản sao (nếu có cấu hình)"""
+    if session is None:
+        from bookapp import db
+        session = db.session
+    session = session()  # scoped_session -> Session của luồng hiện tại
+    previous = session.info.get(REPLICA)
+    session.info[REPLICA] = True
+    try:
+        yield session
+    finally:
+        if previous is None:
+            session.info.pop(REPLICA, None)
+        else:
+            session.info[REPLICA] = previous
+
+
+def read_only(func):
+    """Decorator cho các hàm chỉ đọc của cửa hàng/thống kê: chạy trên bản sao"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def check_routing(directory=None):
+    """Kiểm tra định tuyến bằng hai file SQLite thay cho CSDL chính và bản sao"""
+    import tempfile
+    from flask import Flask
+    from flask_sqlalchemy import SQLAlchemy
+    from sqlalchemy import Column, Integer, String, text
+
+    directory = directory or tempfile.mkdtemp(prefix='bookapp-routing-')
+    primary_uri = f'sqlite:///{os.path.join(directory, "primary.db")}'
+    replica_uri = f'sqlite:///{os.path.join(directory, "replica.db")}'
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = primary_uri
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA: replica_uri}
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+    class Item(db.Model):
+        id = Column(Integer, primary_key=True)
+        name = Column(String(50))
+
+    results = {}
+    with app.app_context():
+        for engine in (db.engines[None], db.engines[REPLICA]):
+            Item.__table__.drop(engine, checkfirst=True)
+            Item.__table__.create(engine)
+        # Dữ liệu khác nhau ở hai nơi để biết truy vấn chạy trên đâu
+        with db.engines[None].begin() as conn:
+            conn.execute(Item.__table__.insert(), [{'id': 1, 'name': 'primary'}])
+        with db.engines[REPLICA].begin() as conn:
+            conn.execute(Item.__table__.insert(), [{'id': 1, 'name': 'replica'}])
+
+        results['default_read'] = db.session.get(Item, 1).name
+        db.session.rollback()
+        db.session.expunge_all()
+
+        with replica_reads(db.session):
+            results['replica_read'] = db.session.get(Item, 1).name
+            db.session.expunge_all()
+
+            db.session.add(Item(id=2, name='written'))
+            db.session.flush()
+            results['read_after_write'] = db.session.execute(text('SELECT name FROM item WHERE id = 2')).scalar()
+            db.session.commit()
+
+            results['replica_after_commit'] = db.session.execute(
+                text('SELECT COUNT(*) FROM item')).scalar()
+        with db.engines[None].connect() as conn:
+            results['primary_rows'] = conn.execute(text('SELECT COUNT(*) FROM item')).scalar()
+
+    expected = {
+        'default_read': 'primary',
+        'replica_read': 'replica',
+        'read_after_write': 'written',
+        'replica_after_commit': 1,  # Bản sao (giả lập) không nhận được dòng mới
+        'primary_rows': 2
+    }
+    results['ok'] = results == expected
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python -m bookapp.database: kiểm tra định tuyến đọc/ghi trên hai file SQLite tạm
+    result = check_routing()
+    print(result)
+    sys.exit(0 if result['ok'] else 1)
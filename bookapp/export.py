@@ -0,0 +1,233 @@
+import csv
+import io
+import json
+import tempfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+from bookapp import db
+from bookapp.models import Book, BookCategory, Receipt, ReceiptDetail, ImportEntry
+
+CHUNK_SIZE = 64 * 1024
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Định dạng dùng chung, tạo một lần thay vì gán cho từng ô sau khi ghi
+TITLE_FONT = Font(bold=True, size=14)
+HEADER_FONT = Font(bold=True)
+HEADER_FILL = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
+CENTER = Alignment(horizontal='center')
+MONEY_FORMAT = '#,##0'
+RATIO_FORMAT = '0.00%'
+
+
+class Column:
+    def __init__(self, header, width, number_format=None, key=None):
+        self.header = header
+        self.width = width  # Độ rộng cố định, không cần duyệt lại dữ liệu để tính
+        self.number_format = number_format
+        self.key = key or header
+
+
+class Sheet:
+    def __init__(self, title, heading, columns, rows, footer=None):
+        self.title = title
+        self.heading = heading
+        self.columns = columns
+        self.rows = rows  # Có thể là generator: dữ liệu được ghi dần từng dòng
+        self.footer = footer
+
+
+def revenue_sheet(revenue_stats, month, year, total_revenue):
+    rows = ((i, stat[0], float(stat[1] or 0), stat[2], float(stat[3] or 0) / 100)
+            for i, stat in enumerate(revenue_stats, 1))
+    return Sheet("Báo cáo doanh thu",
+                 f"BÁO CÁO DOANH THU THEO THÁNG {month}/{year}",
+                 [Column('STT', 6, key='stt'),
+                  Column('Thể loại sách', 30, key='category'),
+                  Column('Doanh thu (VNĐ)', 20, MONEY_FORMAT, key='revenue'),
+                  Column('Số lượt bán', 14, key='sales'),
+                  Column('Tỷ lệ (%)', 12, RATIO_FORMAT, key='ratio')],
+                 rows,
+                 footer=(None, "Tổng doanh thu:", float(total_revenue or 0)))
+
+
+def frequency_sheet(book_stats, month, year):
+    rows = ((i, stat[0], stat[1], float(stat[2] or 0), float(stat[3] or 0) / 100)
+            for i, stat in enumerate(book_stats, 1))
+    return Sheet("Báo cáo tần suất",
+                 f"BÁO CÁO TẦN SUẤT SÁCH BÁN THÁNG {month}/{year}",
+                 [Column('STT', 6, key='stt'),
+                  Column('Tên sách', 40, key='book'),
+                  Column('Thể loại', 30, key='category'),
+                  Column('Số lượng', 12, key='quantity'),
+                  Column('Tỷ lệ (%)', 12, RATIO_FORMAT, key='ratio')],
+                 rows)
+
+
+def receipt_lines_sheet(start, end):
+    return Sheet("Chi tiết hóa đơn",
+                 f"CHI TIẾT HÓA ĐƠN TỪ {start:%d/%m/%Y} ĐẾN {end:%d/%m/%Y}",
+                 RECEIPT_COLUMNS,
+                 receipt_lines(start, end))
+
+
+RECEIPT_COLUMNS = [Column('Mã hóa đơn', 12, key='receipt_id'),
+                   Column('Ngày', 20, 'dd/mm/yyyy hh:mm', key='created_date'),
+                   Column('Tên sách', 40, key='book'),
+                   Column('Thể loại', 30, key='category'),
+                   Column('Số lượng', 10, key='quantity'),
+                   Column('Đơn giá', 16, MONEY_FORMAT, key='unit_price'),
+                   Column('Thành tiền', 18, MONEY_FORMAT, key='amount')]
+
+
+def receipt_lines(start, end, batch_size=2000):
+    """Duyệt chi tiết hóa đơn trong khoảng [start, end) theo từng lô, không nạp hết vào bộ nhớ"""
+    query = db.session.query(
+        Receipt.id,
+        Receipt.created_date,
+        Book.name,
+        BookCategory.name,
+        ReceiptDetail.quantity,
+        ReceiptDetail.unit_price
+    ).join(ReceiptDetail, ReceiptDetail.receipt_id == Receipt.id
+    ).join(Book, ReceiptDetail.product_id == Book.id
+    ).join(BookCategory, Book.category_id == BookCategory.id
+    ).filter(Receipt.created_date >= start, Receipt.created_date < end
+    ).order_by(Receipt.id
+    ).execution_options(yield_per=batch_size)
+    for receipt_id, created_date, book, category, quantity, unit_price in query:
+        yield receipt_id, created_date, book, category, quantity, unit_price, quantity * (unit_price or 0)
+
+
+IMPORT_COLUMNS = [Column('Mã phiếu', 10, key='id'),
+                  Column('Ngày nhập', 20, 'dd/mm/yyyy hh:mm', key='import_date'),
+                  Column('Mã sách', 10, key='book_id'),
+                  Column('Tên sách', 40, key='book'),
+                  Column('Số lượng', 10, key='quantity'),
+                  Column('Đơn giá', 16, MONEY_FORMAT, key='unit_price'),
+                  Column('Phiên bản quy định', 12, key='regulation_version_id')]
+
+
+def import_entries_sheet(filters):
+    return Sheet("Lịch sử nhập sách", "LỊCH SỬ NHẬP SÁCH", IMPORT_COLUMNS, import_entry_rows(filters))
+
+
+def import_entry_rows(filters, batch_size=2000):
+    """Duyệt phiếu nhập theo bộ lọc (xem utils.import_filters) theo từng lô, mới nhất trước"""
+    from bookapp.utils import filter_import_entries
+    query = db.session.query(
+        ImportEntry.id,
+        ImportEntry.import_date,
+        ImportEntry.book_id,
+        ImportEntry.book_name,
+        ImportEntry.quantity,
+        ImportEntry.unit_price,
+        ImportEntry.regulation_version_id
+    )
+    query = filter_import_entries(query, **filters) \
+        .order_by(ImportEntry.import_date.desc(), ImportEntry.id.desc()) \
+        .execution_options(yield_per=batch_size)
+    for row in query:
+        yield tuple(row)
+
+
+def _styled_row(ws, values, font=None, fill=None, columns=None):
+    row = []
+    for i, value in enumerate(values):
+        cell = WriteOnlyCell(ws, value=value)
+        if font:
+            cell.font = font
+        if fill:
+            cell.fill = fill
+        if columns and columns[i].number_format and value is not None:
+            cell.number_format = columns[i].number_format
+        row.append(cell)
+    return row
+
+
+def write_xlsx(sheets, fileobj):
+    """Ghi workbook ở chế độ write-only: mỗi dòng được ghi ra đĩa ngay sau khi append"""
+    wb = Workbook(write_only=True)
+    for spec in sheets:
+        ws = wb.create_sheet(spec.title)
+        for i, column in enumerate(spec.columns, 1):
+            ws.column_dimensions[get_column_letter(i)].width = column.width
+
+        title = WriteOnlyCell(ws, value=spec.heading)
+        title.font = TITLE_FONT
+        title.alignment = CENTER
+        ws.append([title])
+        ws.merged_cells.add(f'A1:{get_column_letter(len(spec.columns))}1')
+        ws.append([])
+        ws.append(_styled_row(ws, [c.header for c in spec.columns], font=HEADER_FONT, fill=HEADER_FILL))
+
+        for values in spec.rows:
+            ws.append(_styled_row(ws, values, columns=spec.columns))
+
+        if spec.footer:
+            ws.append(_styled_row(ws, spec.footer, font=HEADER_FONT, columns=spec.columns))
+    wb.save(fileobj)
+
+
+def xlsx_tempfile(sheets):
+    """Ghi workbook ra file tạm trên đĩa (lỗi, nếu có, xảy ra trước khi gửi phản hồi)"""
+    tmp = tempfile.TemporaryFile()
+    try:
+        write_xlsx(sheets, tmp)
+    except Exception:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp
+
+
+def iter_file(fileobj):
+    """Gửi file theo từng đoạn rồi đóng (file tạm sẽ tự bị xóa)"""
+    try:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def stream_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM để Excel nhận đúng tiếng Việt (UTF-8)
+    buffer.write('﻿')
+    writer.writerow([c.header for c in columns])
+    for values in rows:
+        writer.writerow(values)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_ndjson(columns, rows, extra=None):
+    for values in rows:
+        record = dict(extra or {})
+        record.update(zip((c.key for c in columns), values))
+        yield (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+
+def stream_json(columns, rows, extra=None):
+    """Một tài liệu JSON {"code": 200, ..., "data": [...]} được gửi dần theo từng đoạn"""
+    head = dict({'code': 200}, **(extra or {}))
+    yield (json.dumps(head, ensure_ascii=False)[:-1] + ', "data": [').encode('utf-8')
+    buffer = []
+    size = 0
+    for i, values in enumerate(rows):
+        item = json.dumps(dict(zip((c.key for c in columns), values)), ensure_ascii=False, default=str)
+        buffer.append(item if i == 0 else ',' + item)
+        size += len(item)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    buffer.append(']}')
+    yield ''.join(buffer).encode('utf-8')
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from flask import url_for, send_file, abort
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Chưa cài Pillow: phục vụ ảnh gốc, không thu nhỏ
+    Image = ImageOps = None
+
+# Kích thước hiển thị (rộng, cao tối đa): ảnh được thu nhỏ giữ nguyên tỉ lệ
+SIZES = {
+    'thumb': (120, 160),
+    'card': (360, 480),
+    'detail': (720, 960)
+}
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+DIGEST_RE = re.compile(r'^[0-9a-f]{24}$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class ImageService:
+    """Ảnh thu nhỏ tạo khi được yêu cầu lần đầu, lưu trên đĩa theo địa chỉ nội dung:
+    URL /img/<băm nội dung ảnh gốc>/<cỡ>.<định dạng> không bao giờ đổi nội dung nên được lưu đệm vĩnh viễn"""
+
+    def __init__(self, cache_dir=None, static_folder=None):
+        self.cache_dir = cache_dir
+        self.static_folder = static_folder
+        self._lock = threading.Lock()
+        self._sources = {}  # đường dẫn ảnh gốc -> (mtime, kích thước file, mã băm)
+        self._paths = {}  # mã băm -> đường dẫn ảnh gốc (bản đầy đủ nằm trong file .src của thư mục cache)
+        self.generated = 0
+        self.served = 0
+
+    def init_app(self, app):
+        self.cache_dir = app.config.get('IMAGE_CACHE_DIR', self.cache_dir)
+        self.static_folder = app.static_folder
+        app.jinja_env.globals.update(thumbnail_url=self.url, book_image=self.picture)
+
+    def source_path(self, image):
+        """Ảnh gốc trong thư mục static; None nếu là URL ngoài hoặc không tồn tại"""
+        if not image or '://' in image or image.startswith('//'):
+            return None
+        root = os.path.realpath(self.static_folder)
+        path = os.path.realpath(os.path.join(root, image.lstrip('/')))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def digest(self, path):
+        stat = os.stat(path)
+        cached = self._sources.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()[:24]
+        self._remember(digest, path)
+        with self._lock:
+            self._sources[path] = (stat.st_mtime, stat.st_size, digest)
+            self._paths[digest] = path
+        return digest
+
+    def source_record(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.src')
+
+    def _remember(self, digest, path):
+        # Ghi mã băm -> ảnh gốc (tương đối với static) cạnh ảnh thu nhỏ để tiến trình khác,
+        # hoặc tiến trình này sau khi khởi động lại, phục vụ được URL nó chưa từng render
+        record = self.source_record(digest)
+        if os.path.exists(record):
+            return
+        os.makedirs(os.path.dirname(record), exist_ok=True)
+        tmp = f'{record}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(os.path.relpath(path, os.path.realpath(self.static_folder)))
+        os.replace(tmp, record)
+
+    def _lookup(self, digest):
+        source = self._paths.get(digest)
+        if source is not None:
+            return source
+        try:
+            with open(self.source_record(digest), encoding='utf-8') as f:
+                return self.source_path(f.read().strip())
+        except OSError:
+            return None
+
+    def url(self, image, size='card', fmt='jpeg'):
+        path = self.source_path(image)
+        if path is None:
+            # URL ngoài (hoặc file không có trên máy): giữ nguyên như trước
+            return image if image and '://' in image else url_for('static', filename=image)
+        return url_for('thumbnail', digest=self.digest(path), size=size, fmt=fmt)
+
+    def picture(self, image, size='card', alt='', **attrs):
+        """<picture> với WebP cho trình duyệt hỗ trợ và JPEG dự phòng"""
+        # class_='...' -> class="...", data_id='...' -> data-id="..."
+        extra = ''.join(f' {name.rstrip("_").replace("_", "-")}="{escape(value)}"' for name, value in attrs.items())
+        img = f'<img src="{escape(self.url(image, size, "jpeg"))}" alt="{escape(alt)}" loading="lazy"{extra}>'
+        if self.source_path(image) is None:
+            return Markup(img)
+        return Markup(f'<picture><source type="image/webp" srcset="{escape(self.url(image, size, "webp"))}">'
+                      f'{img}</picture>')
+
+    def cache_path(self, digest, size, fmt):
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}-{size}.{fmt}')
+
+    def render(self, source, target, size, fmt):
+        """Thu nhỏ ảnh gốc rồi ghi ra file tạm và đổi tên (không bao giờ để lộ file ghi dở)"""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+        pil_format, _, options = FORMATS[fmt]
+        try:
+            with Image.open(source) as im:
+                im = ImageOps.exif_transpose(im)
+                if im.mode not in ('RGB', 'RGBA') or (fmt == 'jpeg' and im.mode == 'RGBA'):
+                    im = im.convert('RGB')
+                im.thumbnail(SIZES[size], Image.LANCZOS)
+                im.save(tmp, pil_format, **options)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.generated += 1
+
+    def serve(self, digest, size, fmt):
+        if not DIGEST_RE.match(digest) or size not in SIZES or fmt not in FORMATS:
+            abort(404)
+
+        target = self.cache_path(digest, size, fmt)
+        if not os.path.exists(target):
+            source = self._lookup(digest)
+            # Ảnh gốc đã bị thay (băm khác) thì URL cũ không còn phục vụ được
+            if source is None or not os.path.isfile(source) or self.digest(source) != digest:
+                abort(404)
+            if Image is None:
+                return self._send(source, None)
+            self.render(source, target, size, fmt)
+        self.served += 1
+        return self._send(target, FORMATS[fmt][1])
+
+    def _send(self, path, mimetype):
+        response = send_file(path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def stats(self):
+        return {'sources': len(self._paths), 'generated': self.generated, 'served': self.served}
+
+
+image_service = ImageService()
@@ -2,18 +2,23 @@ from functools import wraps
 
 from flask import render_template, Flask, flash
 from flask import request, redirect, url_for, session, jsonify
-from flask_login import login_user, logout_user, LoginManager, login_required
-import cloudinary.uploader
-from bookapp import app, utils,login
-from bookapp.models import UserRole,Book,BookCategory
-from math import ceil
+from flask_login import login_user, logout_user, LoginManager, login_required, current_user
+from bookapp import app, db, utils,login
+from bookapp.models import UserRole,Book,BookCategory,DeliveryMethod,PaymentMethod
+from bookapp.checkout import CheckoutError
+from bookapp.regulations import regulation_engine
+from bookapp.page_cache import cached_page, Deferred
+from bookapp.images import image_service
+from bookapp import uploads
 
 @app.route("/")
+@cached_page
 def index():
     if current_user.is_authenticated and current_user.user_role == UserRole.ADMIN:
         return redirect(url_for('user_signin'))  # Chuyển hướng đến trang đăng nhập người dùng nếu là admin
     kw = request.args.get('kw')
-    prods = utils.load_books(kw)
+    # Chỉ truy vấn khi fragment danh sách sách chưa có trong bộ nhớ đệm
+    prods = Deferred(lambda: utils.load_books(kw))
     return render_template('index.html', products=prods)
 
 
@@ -30,7 +35,7 @@ def contact():
 
 @login_manager.user_loader
 def user_load(user_id):
-    return utils.get_user_by_id(user_id=user_id)# Decorator để kiể
+    return utils.load_user_principal(user_id)
 
 
 @app.route("/register", methods=['GET', 'POST'])
@@ -42,14 +47,13 @@ def user_register():
         email = request.form.get('email')
         password = request.form.get('password')
         confirm = request.form.get('confirm')
-        avatar_path = None
         try:
             if password.strip() == confirm.strip():
+                user = utils.add_user(name=name, username=username, password=password, email=email)
                 avatar = request.files.get('avatar')
-                if avatar:
-                    res = cloudinary.uploader.upload(avatar)
-                    avatar_path = res['secure_url']
-                utils.add_user(name=name, username=username, password=password, email=email, avatar=avatar_path)
+                if avatar and avatar.filename:
+                    # Ảnh đại diện được tải lên trong hàng đợi nền, gán vào tài khoản khi xong
+                    uploads.enqueue_avatar(user.id, avatar)
                 return redirect(url_for('user_signin'))
             else:
                 err_msg = 'Passwords do not match'
@@ -105,56 +109,71 @@ def user_signout():
 
 @login.user_loader
 def user_load(user_id):
-    return utils.get_user_by_id(user_id=user_id)
+    return utils.load_user_principal(user_id)
 
 @app.route('/search', methods=['GET'])
 def search():
     kw = request.args.get('kw', '')
     category_id = request.args.get('category_id', None)
 
-    # Tìm kiếm theo tên sản phẩm hoặc danh mục
-    products = Book.query
-
-    # Tìm kiếm theo từ khóa tên sản phẩm
-    if kw:
-        products = products.filter(Book.name.ilike(f'%{kw}%'))
+    # Tìm kiếm theo từ khóa (tên, tác giả, mô tả), lọc thêm theo danh mục nếu có
+    if kw.strip():
+        products = utils.search_books(kw, category_id=category_id)
+    else:
+        products = Book.query
+        if category_id:
+            products = products.filter(Book.category_id == category_id)
+        products = products.all()
 
-    # Tìm kiếm theo danh mục nếu có
-    if category_id:
-        products = products.filter(Book.category_id == category_id)
+    # Danh sách danh mục được cung cấp sẵn bởi common_response (đã lưu đệm)
+    return render_template('product_list.html', products=products, kw=kw)
 
-    # Chuyển sang danh sách
-    products = products.all()
+@app.route('/img/<digest>/<size>.<fmt>')
+def thumbnail(digest, size, fmt):
+    # URL chứa mã băm ảnh gốc: nội dung không đổi, trình duyệt/CDN lưu đệm vĩnh viễn
+    return image_service.serve(digest, size, fmt)
 
-    # Lấy danh sách các danh mục để hiển thị
-    categories = utils.load_book_categories()
+@app.route('/api/suggest')
+def suggest():
+    kw = request.args.get('kw', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+    return jsonify({
+        'code': 200,
+        'data': utils.suggest_books(kw, limit=limit)
+    })
 
-    return render_template('product_list.html', products=products, categories=categories, kw=kw)
+@app.route('/api/stock')
+def api_stock():
+    # ?ids=1,2,3: tồn kho hiện tại cho các thẻ sách trên trang đã lưu đệm
+    ids = [int(i) for i in request.args.get('ids', '').split(',')[:100] if i.isdigit()]
+    response = jsonify({'code': 200, 'data': utils.load_stock(ids)})
+    response.cache_control.no_store = True
+    return response
 
 @app.route('/category/<int:category_id>')
+@cached_page
 def filter_by_category(category_id):
     page = request.args.get('page', 1, type=int)
     per_page = 6
+    sort = request.args.get('sort', 'id')
+    direction = request.args.get('direction', 'asc')
 
-    # Đếm tổng số sản phẩm trong category
-    total_products = Book.query.filter(Book.category_id == category_id).count()
-
-    # Truy vấn sản phẩm theo category với phân trang
-    products = Book.query.filter(Book.category_id == category_id) \
-        .offset((page - 1) * per_page) \
-        .limit(per_page) \
-        .all()
-
-    # Tính tổng số trang
-    total_pages = max(1, ceil(total_products / per_page))
+    # Phân trang keyset theo (cột sắp xếp, id), tổng số sách lấy từ bộ nhớ đệm
+    pagination = utils.paginate_books(category_id=category_id,
+                                      sort=sort,
+                                      direction=direction,
+                                      cursor=request.args.get('cursor'),
+                                      page=page,
+                                      per_page=per_page)
 
     # Luôn hiển thị phân trang nếu tổng số sản phẩm > 6
     return render_template('product_list.html',
-                           products=products,
+                           products=pagination.items,
                            category_id=category_id,
-                           categories=utils.load_book_categories(),
-                           current_page=page if total_products > per_page else None,
-                           total_pages=total_pages if total_products > per_page else None)
+                           pagination=pagination if pagination.total > per_page else None,
+                           endpoint='filter_by_category',
+                           url_args={'category_id': category_id, 'sort': sort, 'direction': direction},
+                           sort_options=utils.BOOK_SORT_OPTIONS)
 
 
 
@@ -162,8 +181,22 @@ def filter_by_category(category_id):
 def cart():
     if current_user.is_authenticated and current_user.user_role == UserRole.ADMIN:
         return redirect(url_for('user_signin'))  # Chuyển hướng đến trang đăng nhập người dùng nếu là admin
-    cart = session.get('cart', {})
-    return render_template('cart.html', cart=cart, stats=utils.count_cart(cart))
+    cart = utils.load_cart(session.get('cart'))
+    total_amount = cart.total_amount
+    lines = cart.lines()  # Tên/giá lấy hàng loạt từ bộ nhớ đệm
+    if round(cart.total_amount, 2) != round(total_amount, 2):
+        # Giá đã đổi từ lần cập nhật giỏ trước: lưu lại tổng mới cho header
+        session['cart'] = cart.dump()
+    return render_template('cart.html', lines=lines, stats=cart.stats())
+
+
+def find_book_for_cart(book_id):
+    # Chỉ lấy các cột cần thiết; tồn kho luôn đọc mới từ CSDL
+    try:
+        book_id = int(book_id)
+    except (TypeError, ValueError):
+        return None
+    return db.session.query(Book.id, Book.name, Book.price, Book.stock).filter(Book.id == book_id).first()
 
 
 @app.route('/api/add-cart', methods=['post'])
@@ -175,65 +208,58 @@ def add_to_cart():
         })
 
     data = request.json
-    id = str(data.get('id'))
-    name = data.get('name')
-    price = float(data.get('price'))
 
     # Kiểm tra số lượng trong kho
-    book = Book.query.get(id)
+    book = find_book_for_cart(data.get('id'))
     if not book:
         return jsonify({
             'code': 404,
             'message': 'Sản phẩm không tồn tại!'
         })
 
-    cart = session.get('cart', {})
-
-    # Tính tổng số lượng hiện có trong giỏ
-    current_quantity = cart[id]['quantity'] if id in cart else 0
+    cart = utils.load_cart(session.get('cart'))
 
     # Kiểm tra nếu thêm 1 sản phẩm nữa có vượt quá số lượng trong kho không
-    if current_quantity + 1 > book.stock:
+    if cart.quantity(book.id) + 1 > book.stock:
         return jsonify({
             'code': 400,
             'message': 'Số lượng sản phẩm trong kho không đủ!'
         })
 
-    if id in cart:
-        cart[id]['quantity'] += 1
-    else:
-        cart[id] = {
-            'id': id,
-            'name': name,
-            'price': price,
-            'quantity': 1
-        }
-
-    session['cart'] = cart
+    # Quy định số lượng tối đa của một sản phẩm trong giỏ
+    errors = regulation_engine.snapshot().check_cart({book.id: cart.quantity(book.id) + 1})
+    if errors:
+        return jsonify({
+            'code': 400,
+            'message': errors[book.id]
+        })
+
+    cart.add(book.id, 1)
+    session['cart'] = cart.dump()
     return jsonify({
         'code': 200,
-        'data': utils.count_cart(cart)
+        'data': cart.stats()
     })
 
 
 @app.route('/api/update-cart', methods=['POST'])
 def update_cart():
     data = request.json
-    product_id = str(data.get('id'))
     change = data.get('change')
 
-    cart = session.get('cart', {})
+    cart = utils.load_cart(session.get('cart'))
 
     # Kiểm tra số lượng trong kho
-    book = Book.query.get(product_id)
+    book = find_book_for_cart(data.get('id'))
     if not book:
         return jsonify({
             'code': 404,
             'message': 'Sản phẩm không tồn tại!'
         })
 
-    if product_id in cart:
-        new_quantity = cart[product_id]['quantity'] + change
+    current_quantity = cart.quantity(book.id)
+    if current_quantity:
+        new_quantity = current_quantity + change
 
         # Kiểm tra nếu số lượng mới vượt quá stock
         if new_quantity > book.stock:
@@ -241,22 +267,28 @@ def update_cart():
                 'code': 400,
                 'message': 'Số lượng sản phẩm trong kho không đủ!',
                 'available_stock': book.stock,
-                'current_quantity': cart[product_id]['quantity']
+                'current_quantity': current_quantity
             })
 
-        if new_quantity > 0:
-            cart[product_id]['quantity'] = new_quantity
-        else:
-            del cart[product_id]
+        errors = regulation_engine.snapshot().check_cart({book.id: new_quantity})
+        if errors:
+            return jsonify({
+                'code': 400,
+                'message': errors[book.id],
+                'available_stock': book.stock,
+                'current_quantity': current_quantity
+            })
+
+        cart.set(book.id, new_quantity)
 
-    session['cart'] = cart
-    cart_stats = utils.count_cart(cart)
-    updated_total = cart[product_id]['quantity'] * cart[product_id]['price'] if product_id in cart else 0
+    session['cart'] = cart.dump()
+    cart_stats = cart.stats()
+    updated_quantity = cart.quantity(book.id)
 
     return jsonify({
         'code': 200,
-        'updated_quantity': cart[product_id]['quantity'] if product_id in cart else 0,
-        'updated_total': updated_total,
+        'updated_quantity': updated_quantity,
+        'updated_total': updated_quantity * book.price,
         'cart_total_quantity': cart_stats['total_quantity'],
         'cart_total_price': cart_stats['total_amount']
     })
@@ -264,20 +296,17 @@ def update_cart():
 @app.route('/api/delete-cart', methods=['POST'])
 def delete_cart():
     data = request.json
-    product_id = str(data.get('id'))
-
-    # Lấy giỏ hàng từ session
-    cart = session.get('cart', {})
-
-    # Xóa sản phẩm khỏi giỏ hàng
-    if product_id in cart:
-        del cart[product_id]
 
-    # Lưu lại giỏ hàng đã cập nhật
-    session['cart'] = cart
+    # Lấy giỏ hàng từ session và xóa sản phẩm
+    cart = utils.load_cart(session.get('cart'))
+    try:
+        cart.remove(int(data.get('id')))
+    except (TypeError, ValueError):
+        pass
 
-    # Tính lại tổng tiền và số lượng
-    cart_stats = utils.count_cart(cart)
+    # Lưu lại giỏ hàng đã cập nhật, tổng tiền và số lượng đã được cập nhật theo
+    session['cart'] = cart.dump()
+    cart_stats = cart.stats()
 
     return jsonify({
         'cart_total_quantity': cart_stats['total_quantity'],
@@ -288,23 +317,17 @@ def delete_cart():
 @app.route('/api/pay', methods=['post'])
 def pay():
     try:
-        cart = session.get('cart')
+        cart = utils.load_cart(session.get('cart'))
         if not cart:
             return jsonify({'code': 400, 'error': 'Giỏ hàng trống!'})
 
-        # Kiểm tra số lượng trong kho trước khi thanh toán
-        for item in cart.values():
-            book = Book.query.get(item['id'])
-            if not book:
-                return jsonify({'code': 400, 'error': f'Sản phẩm {item["name"]} không tồn tại!'})
-
-            if book.stock < item['quantity']:
-                return jsonify({
-                    'code': 400,
-                    'error': f'Sản phẩm {item["name"]} chỉ còn {book.stock} trong kho!'
-                })
+        data = request.json or {}
+        if (data.get('delivery_method') or '').upper() not in DeliveryMethod.__members__:
+            return jsonify({'code': 400, 'error': 'Vui lòng chọn phương thức giao hàng!'})
+        if (data.get('payment_method') or '').upper() not in PaymentMethod.__members__:
+            return jsonify({'code': 400, 'error': 'Vui lòng chọn phương thức thanh toán!'})
 
-        data = request.json
+        # Kiểm tra tồn kho, lập hóa đơn và trừ kho trong một giao dịch duy nhất
         utils.add_receipt(
             cart=cart,
             delivery_method=data.get('delivery_method'),
@@ -314,53 +337,77 @@ def pay():
             email=data.get('email')
         )
 
-        # Cập nhật số lượng trong kho
-        for item in cart.values():
-            book = Book.query.get(item['id'])
-            book.stock -= item['quantity']
-
-        db.session.commit()
         del session['cart']
         return jsonify({'code': 200})
 
+    except CheckoutError as e:
+        # Hết hàng, vượt quy định...: lỗi nghiệp vụ, chỉ báo lại cho người mua
+        db.session.rollback()
+        return jsonify({'code': 400, 'error': str(e)})
     except Exception as e:
         db.session.rollback()
-        print(str(e))
+        app.logger.exception('Thanh toán thất bại')
         return jsonify({'code': 400, 'error': str(e)})
 
 @app.route('/product-list')
+@cached_page
 def product_list():
-    page = request.args.get('page', 1, type=int)  # Lấy số trang từ query string
+    page = request.args.get('page', 1, type=int)  # Lấy số trang từ query string (liên kết cũ)
     per_page = 6  # Số sản phẩm mỗi trang
     kw = request.args.get('kw', '').strip()  # Tìm kiếm theo từ khóa
     category_id = request.args.get('category_id', type=int)  # Lọc theo danh mục
+    sort = request.args.get('sort', 'id')  # Sắp xếp: id, name, price, created_date
+    direction = request.args.get('direction', 'asc')
+
+    pagination = utils.paginate_books(kw=kw,
+                                      category_id=category_id,
+                                      sort=sort,
+                                      direction=direction,
+                                      cursor=request.args.get('cursor'),
+                                      page=page,
+                                      per_page=per_page)
+
+    url_args = {'kw': kw, 'category_id': category_id, 'sort': sort, 'direction': direction}
+    return render_template(
+        'product_list.html',
+        products=pagination.items,
+        pagination=pagination,
+        endpoint='product_list',
+        url_args={k: v for k, v in url_args.items() if v},
+        sort_options=utils.BOOK_SORT_OPTIONS
+    )
 
-    query = Book.query
 
-    if kw:
-        query = query.filter(Book.name.ilike(f"%{kw}%"))  # Tìm kiếm tên sách
+@app.route('/product/<int:book_id>')
+@cached_page
+def product_detail(book_id):
+    book = utils.get_book_by_id(book_id)
+    if book is None:
+        return redirect(url_for('product_list'))
+    return render_template('product_detail.html',
+                           book=book,
+                           recommendations=utils.load_recommendations(book_id))
 
-    if category_id:
-        query = query.filter(Book.category_id == category_id)  # Lọc danh mục
 
-    total = query.count()  # Tổng số sản phẩm
-    products = query.offset((page - 1) * per_page).limit(per_page).all()  # Phân trang
-    total_pages = max(1, ceil(total / per_page))  # Tính tổng số trang (ít nhất là 1)
-
-    return render_template(
-        'product_list.html',
-        products=products,
-        current_page=page,
-        total_pages=total_pages,  # Truyền `total_pages` tới template
-        categories=utils.load_book_categories()
-    )
+@app.route('/api/recommendations/<int:book_id>')
+def api_recommendations(book_id):
+    limit = min(max(request.args.get('limit', 6, type=int), 1), 20)
+    return jsonify({'code': 200, 'data': [{
+        'id': book.id,
+        'name': book.name,
+        'price': book.price,
+        'stock': book.stock,
+        'image': image_service.url(book.image or book.name, 'thumb'),
+        'url': url_for('product_detail', book_id=book.id),
+        'score': score
+    } for book, score in utils.load_recommendations(book_id, limit)]})
 
 
 @app.context_processor
 def common_response():
     return {
         'categories': utils.load_book_categories(),
-        'cart_stats': utils.count_cart(session.get('cart',{}))
+        'cart_stats': utils.count_cart(session.get('cart'))
     }
 
 @app.route('/submit_contact_form', methods=['POST'])
@@ -383,14 +430,40 @@ def submit_contact_form():
         return jsonify({'error': 'Đã xảy ra lỗi khi gửi biểu mẫu. Vui lòng thử lại sau.'}), 500
 
 
-from flask import send_file
-import io
+import os
+import mimetypes
+from flask import Response, stream_with_context, send_file
+from datetime import datetime, timedelta
+from bookapp import export, jobs
+
+
+def can_export():
+    return current_user.is_authenticated and current_user.user_role in [UserRole.ADMIN, UserRole.QLKHO]
+
+
+def stream_export(fmt, sheets, filename):
+    """Trả về báo cáo dạng xlsx (mặc định), csv hoặc ndjson, gửi theo từng đoạn"""
+    if fmt == 'csv':
+        sheet = sheets[0]
+        body = export.stream_csv(sheet.columns, sheet.rows)
+        mimetype, filename = 'text/csv; charset=utf-8', f'{filename}.csv'
+    elif fmt == 'ndjson':
+        body = (chunk for sheet in sheets
+                for chunk in export.stream_ndjson(sheet.columns, sheet.rows, extra={'report': sheet.title}))
+        mimetype, filename = 'application/x-ndjson', f'{filename}.ndjson'
+    else:
+        body = export.iter_file(export.xlsx_tempfile(sheets))
+        mimetype, filename = export.XLSX_MIMETYPE, f'{filename}.xlsx'
+
+    return Response(stream_with_context(body),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 @app.route('/export-stats/<int:month>/<int:year>')
 @login_required
 def export_stats(month, year):
-    if not current_user.is_authenticated or current_user.user_role not in [UserRole.ADMIN, UserRole.QLKHO]:
+    if not can_export():
         flash('Bạn không có quyền truy cập chức năng này!', 'error')
         return redirect(url_for('index'))
 
@@ -400,28 +473,110 @@ def export_stats(month, year):
         book_stats = utils.stats_book_sold(month, year)
         total_revenue = sum(stat[1] for stat in revenue_stats) if revenue_stats else 0
 
-        # Tạo file Excel
-        wb = utils.export_stats_to_excel(revenue_stats, book_stats, month, year, total_revenue)
+        # ?format=csv&report=books chỉ xuất báo cáo tần suất
+        sheets = [export.revenue_sheet(revenue_stats, month, year, total_revenue),
+                  export.frequency_sheet(book_stats, month, year)]
+        if request.args.get('report') == 'books':
+            sheets.reverse()
 
-        # Lưu file vào buffer
-        excel_file = io.BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
+        return stream_export(request.args.get('format', 'xlsx'), sheets,
+                             f"bao-cao-thang-{month}-nam-{year}")
 
-        # Tạo tên file
-        filename = f"bao-cao-thang-{month}-nam-{year}.xlsx"
+    except Exception as e:
+        flash(f'Lỗi khi xuất báo cáo: {str(e)}', 'error')
+        return redirect(url_for('admin.index'))
 
-        return send_file(
-            excel_file,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
+
+@app.route('/export-receipts')
+@login_required
+def export_receipts():
+    if not can_export():
+        flash('Bạn không có quyền truy cập chức năng này!', 'error')
+        return redirect(url_for('index'))
+
+    try:
+        # Khoảng ngày [from, to], mặc định 30 ngày gần nhất; phù hợp cho khoảng thời gian dài
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') if request.args.get('to') else datetime.now()
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from') \
+            else end - timedelta(days=30)
+        end = end.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+        return stream_export(request.args.get('format', 'csv'), [export.receipt_lines_sheet(start, end)],
+                             f"chi-tiet-hoa-don-{start:%Y%m%d}-{end:%Y%m%d}")
 
     except Exception as e:
         flash(f'Lỗi khi xuất báo cáo: {str(e)}', 'error')
         return redirect(url_for('admin.index'))
 
+
+@app.route('/api/import-entries')
+@login_required
+def api_import_entries():
+    if not can_export():
+        return jsonify({'code': 403, 'message': 'Bạn không có quyền truy cập chức năng này!'})
+
+    # Lọc như trang quy định (book_id, kw, from, to); dòng được đọc theo lô và gửi dần
+    filters = utils.import_filters(request.args)
+    fmt = request.args.get('format', 'json')
+    if fmt != 'json':
+        return stream_export(fmt, [export.import_entries_sheet(filters)], 'lich-su-nhap-sach')
+    return Response(stream_with_context(export.stream_json(export.IMPORT_COLUMNS,
+                                                           export.import_entry_rows(filters))),
+                    mimetype='application/json')
+
+
+@app.route('/api/jobs/export-stats', methods=['POST'])
+@login_required
+def submit_export_job():
+    if not can_export():
+        return jsonify({'code': 403, 'message': 'Bạn không có quyền truy cập chức năng này!'})
+
+    data = request.json or {}
+    try:
+        month, year = int(data.get('month')), int(data.get('year'))
+    except (TypeError, ValueError):
+        return jsonify({'code': 400, 'message': 'Tháng/năm không hợp lệ!'})
+    if not 1 <= month <= 12:
+        return jsonify({'code': 400, 'message': 'Tháng/năm không hợp lệ!'})
+
+    job = jobs.get_queue().submit('export-stats', {'month': month, 'year': year}, user_id=current_user.id)
+    return jsonify({'code': 200, 'job': jobs.to_json(job),
+                    'status_url': url_for('job_status', job_id=job['id'])})
+
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    if not can_export():
+        return jsonify({'code': 403, 'message': 'Bạn không có quyền truy cập chức năng này!'})
+
+    job = jobs.get_queue().get(job_id)
+    if not job:
+        return jsonify({'code': 404, 'message': 'Không tìm thấy công việc!'})
+
+    result = {'code': 200, 'job': jobs.to_json(job)}
+    if job['status'] == jobs.DONE and job['artifact']:
+        result['download_url'] = url_for('job_download', job_id=job_id)
+    return jsonify(result)
+
+
+@app.route('/api/jobs/<job_id>/download')
+@login_required
+def job_download(job_id):
+    if not can_export():
+        flash('Bạn không có quyền truy cập chức năng này!', 'error')
+        return redirect(url_for('index'))
+
+    job = jobs.get_queue().get(job_id)
+    if not job or job['status'] != jobs.DONE or not job['artifact'] or not os.path.exists(job['artifact']):
+        flash('Báo cáo chưa sẵn sàng hoặc đã được thay bằng bản mới!', 'error')
+        return redirect(url_for('statsview.index'))
+
+    mimetype = mimetypes.guess_type(job['filename'])[0] or export.XLSX_MIMETYPE
+    return send_file(job['artifact'], mimetype=mimetype,
+                     as_attachment=True, download_name=job['filename'])
+
+
 if __name__ == '__main__':
     from bookapp.admin import *
     app.run(debug=True)
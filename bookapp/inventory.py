@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func, type_coerce, String
+from bookapp import db
+from bookapp.models import Book, BookCategory, Receipt, ReceiptDetail, ImportEntry
+from bookapp.regulations import regulation_engine, MIN_IMPORT, MAX_STOCK
+
+LOOKBACK_DAYS = 90  # Số ngày bán hàng dùng để ước lượng tốc độ bán
+HALF_LIFE_DAYS = 14  # Doanh số cách đây HALF_LIFE_DAYS ngày có trọng số bằng một nửa hôm nay
+REVIEW_DAYS = 7  # Khoảng giữa hai lần xem kế hoạch: lượng nhập phải đủ bán thêm ngần ấy ngày
+SERVICE_Z = 1.65  # Hệ số tồn kho an toàn (~95% không hết hàng trong thời gian chờ nhập)
+DEFAULT_LEAD_DAYS = 7  # Khi chưa có lịch sử nhập
+MAX_LEAD_DAYS = 60
+WATCH_DAYS = 30  # Đủ bán ít hơn ngần ấy ngày thì đưa vào danh sách theo dõi
+
+OUT, REORDER, BLOCKED, WATCH, OK = 'out', 'reorder', 'blocked', 'watch', 'ok'
+STATUSES = {
+    OUT: 'Hết hàng',
+    REORDER: 'Cần nhập',
+    BLOCKED: 'Vướng tồn tối đa',
+    WATCH: 'Theo dõi',
+    OK: 'Đủ hàng'
+}
+
+
+def daily_sales(book_ids, start, days):
+    """Ma trận (sách × ngày) số lượng bán, gom trong SQL theo (sách, ngày) rồi rải vào mảng NumPy"""
+    rows = db.session.query(ReceiptDetail.product_id,
+                            type_coerce(func.date(Receipt.created_date), String),
+                            func.sum(ReceiptDetail.quantity)) \
+        .join(Receipt, ReceiptDetail.receipt_id == Receipt.id) \
+        .filter(Receipt.created_date >= start, Receipt.created_date < start + timedelta(days=days)) \
+        .group_by(ReceiptDetail.product_id, func.date(Receipt.created_date)) \
+        .all()
+    sales = np.zeros((len(book_ids), days))
+    if rows:
+        product_id, day, quantity = zip(*rows)
+        product_id = np.array(product_id, dtype=np.int64)
+        day = (np.array(day, dtype='datetime64[D]') - np.datetime64(start.date(), 'D')).astype(np.int64)
+        row = np.searchsorted(book_ids, product_id)
+        known = (row < len(book_ids)) & (book_ids[np.minimum(row, len(book_ids) - 1)] == product_id) \
+            & (day >= 0) & (day < days)
+        np.add.at(sales, (row[known], day[known]), np.array(quantity, dtype=np.float64)[known])
+    return sales
+
+
+def demand(sales, half_life=HALF_LIFE_DAYS):
+    """Tốc độ bán mỗi ngày (trung bình có trọng số giảm dần theo tuổi) và độ lệch chuẩn theo ngày"""
+    days = sales.shape[1]
+    weights = 0.5 ** (np.arange(days)[::-1] / half_life)  # Cột cuối là hôm qua
+    weights /= weights.sum()
+    velocity = sales @ weights
+    variance = np.maximum((sales ** 2) @ weights - velocity ** 2, 0)
+    return velocity, np.sqrt(variance)
+
+
+def lead_times(book_ids, since, default=DEFAULT_LEAD_DAYS):
+    """Thời gian chờ nhập ước lượng bằng trung vị khoảng cách giữa hai lần nhập liên tiếp của từng sách;
+    sách chưa đủ lịch sử dùng trung vị của cả danh mục. Kèm đơn giá nhập gần nhất."""
+    rows = db.session.query(ImportEntry.book_id,
+                            type_coerce(func.date(ImportEntry.import_date), String),
+                            ImportEntry.unit_price) \
+        .filter(ImportEntry.import_date >= since) \
+        .order_by(ImportEntry.book_id, ImportEntry.import_date, ImportEntry.id) \
+        .all()
+    lead = np.full(len(book_ids), np.nan)
+    last_price = np.full(len(book_ids), np.nan)
+    if rows:
+        book_id, day, price = zip(*rows)
+        book_id = np.array(book_id, dtype=np.int64)
+        day = np.array(day, dtype='datetime64[D]').astype(np.int64)
+        row = np.searchsorted(book_ids, book_id)
+        known = (row < len(book_ids)) & (book_ids[np.minimum(row, len(book_ids) - 1)] == book_id)
+        row, day, price = row[known], day[known], np.array(price, dtype=np.float64)[known]
+        # Dòng cuối của mỗi sách (đã sắp theo sách, ngày) là lần nhập gần nhất
+        last = np.r_[row[1:] != row[:-1], True] if len(row) else np.zeros(0, dtype=bool)
+        last_price[row[last]] = price[last]
+
+        # Khoảng cách giữa hai lần nhập liên tiếp của cùng một sách (bỏ các lần nhập cùng ngày)
+        gap = day[1:] - day[:-1]
+        valid = (row[1:] == row[:-1]) & (gap > 0)
+        gap_row, gap = row[1:][valid], np.clip(gap[valid], 1, MAX_LEAD_DAYS)
+        if len(gap):
+            # Trung vị theo nhóm: sắp theo (sách, khoảng cách), lấy phần tử giữa của mỗi nhóm
+            order = np.lexsort((gap, gap_row))
+            gap_row, gap = gap_row[order], gap[order]
+            groups, starts, counts = np.unique(gap_row, return_index=True, return_counts=True)
+            lead[groups] = (gap[starts + (counts - 1) // 2] + gap[starts + counts // 2]) / 2
+    fallback = float(np.nanmedian(lead)) if np.isfinite(lead).any() else default
+    return np.where(np.isnan(lead), fallback, lead), last_price
+
+
+def propose(stock, velocity, sigma, lead, min_import=None, max_stock=None,
+            review_days=REVIEW_DAYS, z=SERVICE_Z, watch_days=WATCH_DAYS):
+    """Điểm đặt hàng, số ngày đủ bán và lượng nhập đề xuất cho cả danh mục cùng lúc.
+    Lượng nhập không nhỏ hơn "Số lượng nhập tối thiểu" và không làm tồn vượt "Số lượng tồn tối đa"."""
+    stock = np.asarray(stock, dtype=np.float64)
+    safety = z * sigma * np.sqrt(lead)
+    reorder_point = velocity * lead + safety
+    target = velocity * (lead + review_days) + safety
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(velocity > 0, stock / velocity, np.inf)
+
+    # Hết hàng mà không bán được gì (có thể chính vì hết hàng) vẫn đề xuất nhập tối thiểu
+    due = (stock <= 0) | ((velocity > 0) & (stock <= reorder_point))
+    quantity = np.where(due, np.maximum(np.ceil(target - stock), 1), 0)
+    if min_import is not None:
+        quantity = np.where(due, np.maximum(quantity, min_import), 0)
+    blocked = np.zeros(len(stock), dtype=bool)
+    if max_stock is not None:
+        quantity = np.where(due, np.minimum(quantity, max_stock - stock), 0)
+        blocked = due & (quantity < max(min_import or 1, 1))
+        quantity = np.where(blocked, 0, quantity)
+
+    status = np.full(len(stock), OK, dtype=object)
+    status[cover <= watch_days] = WATCH
+    status[due] = REORDER
+    status[blocked] = BLOCKED
+    status[stock <= 0] = OUT
+    return {
+        'reorder_point': reorder_point,
+        'cover': cover,
+        'quantity': quantity.astype(np.int64),
+        'status': status
+    }
+
+
+def _number(value, digits=2):
+    return None if not np.isfinite(value) else round(float(value), digits)
+
+
+def build_plan(today=None, lookback_days=LOOKBACK_DAYS):
+    """Kế hoạch nhập hàng cho toàn bộ sách đang bán: một lần đọc doanh số, một lần đọc phiếu nhập,
+    tính toán trên mảng. Chỉ giữ các sách cần nhập hoặc sắp hết (đủ bán ít hơn WATCH_DAYS ngày)."""
+    started = time.perf_counter()
+    today = today or datetime.combine(datetime.now().date(), datetime.min.time())
+    rules = regulation_engine.snapshot()
+
+    catalog = db.session.query(Book.id, Book.name, Book.stock, BookCategory.name) \
+        .join(BookCategory, Book.category_id == BookCategory.id) \
+        .filter(Book.active.isnot(False)) \
+        .order_by(Book.id).all()
+    book_ids = np.array([row[0] for row in catalog], dtype=np.int64)
+    stock = np.array([row[2] or 0 for row in catalog], dtype=np.float64)
+
+    sales = daily_sales(book_ids, today - timedelta(days=lookback_days), lookback_days)
+    velocity, sigma = demand(sales)
+    lead, last_price = lead_times(book_ids, today - timedelta(days=365))
+    result = propose(stock, velocity, sigma, lead, rules.value(MIN_IMPORT), rules.value(MAX_STOCK))
+
+    keep = np.flatnonzero(result['status'] != OK)
+    books = [{
+        'id': int(book_ids[i]),
+        'name': catalog[i][1],
+        'category': catalog[i][3],
+        'stock': int(stock[i]),
+        'velocity': round(float(velocity[i]), 3),
+        'sigma': round(float(sigma[i]), 3),
+        'lead_days': round(float(lead[i]), 1),
+        'sold': int(sales[i].sum()),
+        'last_unit_price': _number(last_price[i]),
+        'reorder_point': _number(result['reorder_point'][i], 1),
+        'days_of_cover': _number(result['cover'][i], 1),
+        'quantity': int(result['quantity'][i]),
+        'status': result['status'][i]
+    } for i in keep]
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'lookback_days': lookback_days,
+        'regulation_version': rules.version,
+        'catalog_size': len(catalog),
+        'seconds': round(time.perf_counter() - started, 3),
+        'books': books
+    }
+
+
+def refresh(plan):
+    """Tính lại trạng thái/lượng nhập của kế hoạch với tồn kho và quy định hiện tại
+    (sau khi đã lập phiếu nhập không cần chờ lần chạy nền tiếp theo)"""
+    books = plan['books']
+    if not books:
+        return books
+    current = dict(db.session.query(Book.id, Book.stock).filter(Book.id.in_([b['id'] for b in books])).all())
+    rules = regulation_engine.snapshot()
+    stock = np.array([current.get(b['id'], 0) or 0 for b in books], dtype=np.float64)
+    result = propose(stock,
+                     np.array([b['velocity'] for b in books]),
+                     np.array([b['sigma'] for b in books]),
+                     np.array([b['lead_days'] for b in books]),
+                     rules.value(MIN_IMPORT), rules.value(MAX_STOCK))
+    return [dict(b, stock=int(stock[i]),
+                 days_of_cover=_number(result['cover'][i], 1),
+                 quantity=int(result['quantity'][i]),
+                 status=result['status'][i]) for i, b in enumerate(books)]
+
+
+def plan_fingerprint(params):
+    """Đổi khi có hóa đơn/phiếu nhập mới, quy định mới hoặc sang ngày mới"""
+    last_receipt = db.session.query(func.max(Receipt.id)).scalar()
+    last_import = db.session.query(func.max(ImportEntry.id)).scalar()
+    return f'{datetime.now().date()}:{last_receipt or 0}:{last_import or 0}:{regulation_engine.snapshot().version}'
+
+
+def inventory_plan_job(params, path):
+    plan = build_plan(lookback_days=params.get('lookback_days', LOOKBACK_DAYS))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False)
+    return f'ke-hoach-nhap-hang-{datetime.now():%Y%m%d}.json'
+
+
+class InventoryPlanner:
+    """Gửi job lập kế hoạch nhập hàng vào hàng đợi nền theo chu kỳ; đọc kết quả mới nhất cho trang quản trị"""
+
+    def __init__(self, interval=3600, lookback_days=LOOKBACK_DAYS):
+        self.interval = interval
+        self.lookback_days = lookback_days
+        self.app = None
+        self._scheduler = None
+        self._lock = threading.Lock()
+        self._plan = None  # (mã job, kế hoạch đã đọc từ file)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('INVENTORY_PLAN_INTERVAL', self.interval)
+        self.lookback_days = app.config.get('INVENTORY_LOOKBACK_DAYS', self.lookback_days)
+        app.before_request(self._start_scheduler)
+
+    @property
+    def params(self):
+        return {'lookback_days': self.lookback_days}
+
+    def submit(self, user_id=None):
+        from bookapp import jobs
+        return jobs.get_queue().submit('inventory-plan', self.params, user_id=user_id)
+
+    def _start_scheduler(self):
+        if self._scheduler is not None or not self.interval:
+            return
+        with self._lock:
+            if self._scheduler is not None:
+                return
+
+            def run():
+                # Lần đầu chạy sau tối đa một phút kể từ request đầu tiên, sau đó theo chu kỳ
+                time.sleep(min(self.interval, 60))
+                while True:
+                    try:
+                        with self.app.app_context():
+                            self.submit()  # Dữ liệu không đổi (cùng fingerprint) thì hàng đợi dùng lại kết quả cũ
+                    except Exception:
+                        self.app.logger.exception('Gửi việc lập kế hoạch nhập hàng thất bại')
+                    time.sleep(self.interval)
+
+            self._scheduler = threading.Thread(target=run, name='inventory-planner', daemon=True)
+            self._scheduler.start()
+
+    def latest(self):
+        """(job, kế hoạch) mới nhất đã xong, (None, None) nếu chưa chạy lần nào"""
+        from bookapp import jobs
+        job = jobs.get_queue().latest('inventory-plan', self.params)
+        if job is None or not os.path.exists(job['artifact']):
+            return None, None
+        cached = self._plan
+        if cached is None or cached[0] != job['id']:
+            with open(job['artifact'], encoding='utf-8') as f:
+                cached = (job['id'], json.load(f))
+            self._plan = cached
+        return job, cached[1]
+
+
+inventory_planner = InventoryPlanner()
+
+
+if __name__ == '__main__':
+    import sys
+    from bookapp import app
+
+    # python -m bookapp.inventory: lập kế hoạch nhập hàng ngay trên CSDL hiện tại và in kết quả
+    with app.app_context():
+        plan = build_plan()
+    counts = {}
+    for book in plan['books']:
+        counts[book['status']] = counts.get(book['status'], 0) + 1
+    print(f"{plan['catalog_size']} sách, {plan['seconds']} giây: "
+          + ', '.join(f'{STATUSES[s]} {n}' for s, n in counts.items()), file=sys.stderr)
+    print(json.dumps(plan, ensure_ascii=False, indent=2))
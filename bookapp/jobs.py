@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func
+from bookapp import app, db
+from bookapp.models import Receipt
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobQueue:
+    """Hàng đợi công việc chạy nền: bảng job trong SQLite, file kết quả nằm trong thư mục artifact.
+    Hai yêu cầu giống nhau (cùng key) dùng chung một job; file đã xong được dùng lại
+    cho tới khi dấu vân tay dữ liệu (fingerprint) thay đổi."""
+
+    def __init__(self, path, artifact_dir, max_workers=2, stale_after=3600, keep_for=86400):
+        self.artifact_dir = artifact_dir
+        self.stale_after = stale_after  # Job đang chạy quá lâu coi như đã chết (tiến trình bị tắt)
+        self.keep_for = keep_for  # Job đã kết thúc mà không có file kết quả được giữ lại bấy lâu rồi xóa
+        self._purged_at = 0
+        os.makedirs(artifact_dir, exist_ok=True)
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-job')
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                           'id TEXT PRIMARY KEY, kind TEXT NOT NULL, key TEXT NOT NULL, params TEXT NOT NULL, '
+                           'fingerprint TEXT, status TEXT NOT NULL, artifact TEXT, filename TEXT, error TEXT, '
+                           'user_id INTEGER, created_at REAL NOT NULL, started_at REAL, finished_at REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_key ON jobs (key, created_at)')
+
+    def register(self, kind, run, fingerprint=None):
+        """run(params, path) ghi file kết quả và trả về tên file tải xuống (None: không có file kết quả);
+        fingerprint(params) trả về chuỗi đại diện cho dữ liệu nguồn"""
+        self._tasks[kind] = (run, fingerprint)
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args)
+
+    def _row(self, sql, args=()):
+        with self._lock:
+            row = self._conn.execute(sql, args).fetchone()
+        return dict(row) if row else None
+
+    def get(self, job_id):
+        return self._row('SELECT * FROM jobs WHERE id = ?', (job_id,))
+
+    @staticmethod
+    def _key(kind, params):
+        return f'{kind}:{json.dumps(params, sort_keys=True)}'
+
+    def latest(self, kind, params):
+        """Job đã xong gần nhất (còn file kết quả) của một loại công việc với đúng tham số này"""
+        return self._row('SELECT * FROM jobs WHERE key = ? AND status = ? AND artifact IS NOT NULL '
+                         'ORDER BY finished_at DESC LIMIT 1', (self._key(kind, params), DONE))
+
+    def submit(self, kind, params, user_id=None):
+        run, fingerprint = self._tasks[kind]
+        key = self._key(kind, params)
+        current = fingerprint(params) if fingerprint else None
+
+        with self._lock:
+            # Đang có job giống hệt chờ/chạy: trả về job đó
+            row = self._conn.execute('SELECT * FROM jobs WHERE key = ? AND status IN (?, ?) AND created_at > ? '
+                                     'ORDER BY created_at DESC LIMIT 1',
+                                     (key, QUEUED, RUNNING, time.time() - self.stale_after)).fetchone()
+            if row is not None and row['fingerprint'] == current:
+                return dict(row)
+
+            # Đã có file kết quả cho đúng dữ liệu hiện tại: dùng lại
+            row = self._conn.execute('SELECT * FROM jobs WHERE key = ? AND status = ? '
+                                     'ORDER BY finished_at DESC LIMIT 1', (key, DONE)).fetchone()
+            if row is not None and row['fingerprint'] == current and row['artifact'] \
+                    and os.path.exists(row['artifact']):
+                return dict(row)
+
+            job_id = uuid.uuid4().hex
+            self._conn.execute('INSERT INTO jobs (id, kind, key, params, fingerprint, status, user_id, created_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (job_id, kind, key, json.dumps(params), current, QUEUED, user_id, time.time()))
+
+        self._executor.submit(self._run, job_id, run, params, key)
+        return self.get(job_id)
+
+    def _run(self, job_id, run, params, key):
+        self._execute('UPDATE jobs SET status = ?, started_at = ? WHERE id = ?', (RUNNING, time.time(), job_id))
+        path = os.path.join(self.artifact_dir, job_id)
+        tmp_path = path + '.tmp'
+        try:
+            with app.app_context():
+                filename = run(params, tmp_path)
+            if filename is None:
+                path = None
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self._execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                          (FAILED, str(e), time.time(), job_id))
+            self._purge()
+            return
+
+        self._execute('UPDATE jobs SET status = ?, artifact = ?, filename = ?, finished_at = ? WHERE id = ?',
+                      (DONE, path, filename, time.time(), job_id))
+        if path is not None:
+            self._discard_older(key, job_id)
+        self._purge()
+
+    def _purge(self):
+        """Xóa các job đã kết thúc, không còn file kết quả (tải ảnh, báo cáo đã có bản mới...) quá keep_for giây;
+        chạy nhiều nhất mỗi giờ một lần"""
+        now = time.time()
+        if now - self._purged_at < 3600:
+            return
+        self._purged_at = now
+        self._execute('DELETE FROM jobs WHERE status IN (?, ?) AND artifact IS NULL AND finished_at < ?',
+                      (DONE, FAILED, now - self.keep_for))
+
+    def _discard_older(self, key, job_id):
+        """Xóa file kết quả cũ của cùng loại báo cáo khi đã có bản mới"""
+        with self._lock:
+            rows = self._conn.execute('SELECT id, artifact FROM jobs WHERE key = ? AND id != ? AND artifact IS NOT NULL',
+                                      (key, job_id)).fetchall()
+            self._conn.execute('UPDATE jobs SET artifact = NULL WHERE key = ? AND id != ?', (key, job_id))
+        for row in rows:
+            try:
+                os.remove(row['artifact'])
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+
+def month_fingerprint(month, year):
+    """Số hóa đơn và mã hóa đơn lớn nhất trong tháng: đổi khi có hóa đơn mới"""
+    from bookapp.rollup import month_range
+    start, end = month_range(month, year)
+    count, last_id = db.session.query(func.count(Receipt.id), func.max(Receipt.id)) \
+        .filter(Receipt.created_date >= start, Receipt.created_date < end).one()
+    return f'{count}:{last_id or 0}'
+
+
+def export_stats_job(params, path):
+    from bookapp import utils, export
+    month, year = params['month'], params['year']
+    revenue_stats = utils.stats_by_category(month, year)
+    book_stats = utils.stats_book_sold(month, year)
+    total_revenue = sum(stat[1] for stat in revenue_stats) if revenue_stats else 0
+    with open(path, 'wb') as f:
+        export.write_xlsx([export.revenue_sheet(revenue_stats, month, year, total_revenue),
+                           export.frequency_sheet(book_stats, month, year)], f)
+    return f'bao-cao-thang-{month}-nam-{year}.xlsx'
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Khởi tạo hàng đợi khi cần lần đầu (không tạo luồng/file khi app không dùng tới)"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                queue = JobQueue(app.config['JOB_DB_PATH'], app.config['JOB_ARTIFACT_DIR'],
+                                 max_workers=app.config.get('JOB_WORKERS', 2))
+                queue.register('export-stats', export_stats_job,
+                               fingerprint=lambda p: month_fingerprint(p['month'], p['year']))
+                from bookapp.uploads import upload_avatar_job
+                queue.register('upload-avatar', upload_avatar_job)
+                from bookapp.inventory import inventory_plan_job, plan_fingerprint
+                queue.register('inventory-plan', inventory_plan_job, fingerprint=plan_fingerprint)
+                _queue = queue
+    return _queue
+
+
+def to_json(job):
+    """Thông tin job trả về cho client (không lộ đường dẫn trên server)"""
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'params': json.loads(job['params']),
+        'status': job['status'],
+        'error': job['error'],
+        'filename': job['filename'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at']
+    }
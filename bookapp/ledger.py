@@ -0,0 +1,271 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, func, and_, literal, DateTime, String
+from bookapp import db
+from bookapp.models import Book, StockMovement, StockSnapshot
+
+IMPORT, SALE, ADJUST = 'import', 'sale', 'adjust'
+OPENING_NOTE = 'Số dư đầu kỳ'
+RECONCILE_NOTE = 'Đối soát'
+# Bản chụp chỉ gồm biến động ghi sổ trước (lúc chụp - SNAPSHOT_LAG): giao dịch ghi sổ trước mốc đó
+# nhưng commit sau sẽ bị bỏ sót, nên khoảng này phải dài hơn giao dịch lâu nhất
+SNAPSHOT_LAG = timedelta(minutes=5)
+
+
+def record(kind, lines, ref_id=None, user_id=None, note=None):
+    """Ghi biến động tồn kho vào giao dịch hiện tại bằng một lệnh executemany,
+    gọi TRƯỚC khi commit cùng với thay đổi Book.stock. lines: [(book_id, số lượng có dấu)]"""
+    # Luôn ghi theo giờ ghi sổ (không theo ngày trên chứng từ) để không lọt vào trước một bản chụp đã có
+    now = datetime.now()
+    rows = [{'book_id': book_id,
+             'created_date': now,
+             'kind': kind,
+             'quantity': quantity,
+             'ref_id': ref_id,
+             'user_id': user_id,
+             'note': note} for book_id, quantity in lines if quantity]
+    if rows:
+        db.session.execute(insert(StockMovement), rows)
+
+
+def adjust(book_id, delta, user_id=None, note=None, kind=ADJUST, ref_id=None):
+    """Điều chỉnh tồn kho ±delta bằng một câu UPDATE nguyên tử (không đọc rồi ghi lại số cũ) và ghi sổ
+    (mặc định loại 'adjust', nhập kho dùng kind=IMPORT) trong cùng giao dịch; người gọi commit.
+    False nếu không có sách hoặc tồn kho sẽ bị âm."""
+    result = db.session.execute(
+        update(Book)
+        .where(Book.id == book_id, Book.stock + delta >= 0)
+        .values(stock=Book.stock + delta)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    record(kind, [(book_id, delta)], ref_id=ref_id, user_id=user_id, note=note)
+    return True
+
+
+def opening_balances(bind=None):
+    """Ghi số dư đầu kỳ (một dòng 'adjust') cho các sách có tồn kho mà chưa có dòng nào trong sổ"""
+    has_movement = select(StockMovement.id).where(StockMovement.book_id == Book.id).exists()
+    stmt = insert(StockMovement).from_select(
+        ['book_id', 'created_date', 'kind', 'quantity', 'note'],
+        select(Book.id, literal(datetime.now(), DateTime), literal(ADJUST, String),
+               Book.stock, literal(OPENING_NOTE, String))
+        .where(Book.stock != 0, ~has_movement))
+    return (bind or db.session).execute(stmt).rowcount
+
+
+def _empty():
+    return {'stock': 0, 'imported': 0, 'sold': 0, 'adjusted': 0}
+
+
+def _apply(balance, kind, quantity):
+    balance['stock'] += quantity
+    if kind == IMPORT:
+        balance['imported'] += quantity
+    elif kind == SALE:
+        balance['sold'] -= quantity
+    else:
+        balance['adjusted'] += quantity
+
+
+def _balances(until=None, book_ids=None):
+    """(bản chụp, biến động): bản chụp gần nhất trước until của từng sách và tổng biến động theo (sách, loại)
+    ghi sổ sau lần chụp chung gần nhất. Mỗi lần chụp gồm mọi sách có biến động kể từ lần trước nên phần
+    biến động chỉ là một đoạn ngắn của chỉ mục created_date."""
+    newest = select(func.max(StockSnapshot.taken_at))
+    if until is not None:
+        newest = newest.where(StockSnapshot.taken_at <= until)
+    taken_at = db.session.execute(newest).scalar()
+
+    snapshots = {}
+    if taken_at is not None:
+        latest = select(StockSnapshot.book_id, func.max(StockSnapshot.taken_at).label('taken_at')) \
+            .where(StockSnapshot.taken_at <= taken_at)
+        if book_ids is not None:
+            latest = latest.where(StockSnapshot.book_id.in_(book_ids))
+        latest = latest.group_by(StockSnapshot.book_id).subquery()
+        for book_id, stock, imported, sold, adjusted in db.session.execute(
+                select(StockSnapshot.book_id, StockSnapshot.stock, StockSnapshot.imported,
+                       StockSnapshot.sold, StockSnapshot.adjusted)
+                .join(latest, and_(StockSnapshot.book_id == latest.c.book_id,
+                                   StockSnapshot.taken_at == latest.c.taken_at))):
+            snapshots[book_id] = {'stock': stock, 'imported': imported, 'sold': sold, 'adjusted': adjusted}
+
+    stmt = select(StockMovement.book_id, StockMovement.kind, func.sum(StockMovement.quantity))
+    if taken_at is not None:
+        stmt = stmt.where(StockMovement.created_date >= taken_at)
+    if until is not None:
+        stmt = stmt.where(StockMovement.created_date < until)
+    if book_ids is not None:
+        stmt = stmt.where(StockMovement.book_id.in_(book_ids))
+    deltas = {}
+    # Gom theo (loại, sách): gom theo book_id trước thì SQLite chọn quét cả chỉ mục (book_id, created_date)
+    for book_id, kind, quantity in db.session.execute(stmt.group_by(StockMovement.kind, StockMovement.book_id)):
+        deltas.setdefault(book_id, {})[kind] = int(quantity)
+    return snapshots, deltas
+
+
+def balances(until=None, book_ids=None):
+    """{book_id: {'stock', 'imported', 'sold', 'adjusted'}} gồm các biến động ghi sổ trước until
+    (None: đến hiện tại); sách chưa có dòng nào trong sổ không có trong kết quả"""
+    snapshots, deltas = _balances(until, book_ids)
+    result = {}
+    for book_id, snapshot in snapshots.items():
+        result[book_id] = dict(snapshot)
+    for book_id, kinds in deltas.items():
+        balance = result.setdefault(book_id, _empty())
+        for kind, quantity in kinds.items():
+            _apply(balance, kind, quantity)
+    return result
+
+
+def stock_at(when, book_ids=None):
+    """{book_id: tồn kho} ngay trước thời điểm when"""
+    return {book_id: balance['stock'] for book_id, balance in balances(when, book_ids).items()}
+
+
+def take_snapshot(now=None, lag=SNAPSHOT_LAG):
+    """Chụp số dư tại mốc (now - lag) cho các sách có biến động kể từ bản chụp trước, gọi rồi commit.
+    Trả về số sách đã chụp."""
+    cutoff = (now or datetime.now()) - lag
+    snapshots, deltas = _balances(until=cutoff)
+    rows = []
+    for book_id, kinds in deltas.items():
+        balance = dict(snapshots.get(book_id) or _empty())
+        for kind, quantity in kinds.items():
+            _apply(balance, kind, quantity)
+        rows.append(dict(balance, book_id=book_id, taken_at=cutoff))
+    if rows:
+        db.session.execute(insert(StockSnapshot), rows)
+    return len(rows)
+
+
+def reconcile(fix=False, user_id=None):
+    """Đối chiếu Book.stock với sổ cho toàn bộ danh mục trong một lượt (vài câu gom nhóm trong cùng giao dịch).
+    fix=True: ghi thêm dòng 'adjust' cho phần chênh lệch rồi commit."""
+    started = time.perf_counter()
+    ledger = balances()
+    books = db.session.query(Book.id, Book.name, Book.stock).order_by(Book.id).all()
+
+    totals = _empty()
+    for balance in ledger.values():
+        for name in totals:
+            totals[name] += balance[name]
+    mismatches = []
+    for book_id, name, stock in books:
+        expected = ledger[book_id]['stock'] if book_id in ledger else 0
+        if (stock or 0) != expected:
+            mismatches.append({'book_id': book_id, 'name': name, 'stock': stock or 0, 'ledger': expected})
+
+    if fix and mismatches:
+        record(ADJUST, [(m['book_id'], m['stock'] - m['ledger']) for m in mismatches],
+               user_id=user_id, note=RECONCILE_NOTE)
+        db.session.commit()
+    return {
+        'checked_at': datetime.now().isoformat(timespec='seconds'),
+        'books': len(books),
+        'ledger': totals,
+        'mismatches': mismatches,
+        'fixed': bool(fix and mismatches),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+class StockLedger:
+    """Chụp số dư tồn kho theo chu kỳ ở luồng nền để truy vấn tồn kho theo ngày chỉ đọc một đoạn biến động ngắn"""
+
+    def __init__(self, interval=86400):
+        self.interval = interval
+        self.app = None
+        self._scheduler = None
+        self._lock = threading.Lock()
+        self.snapshots = 0
+        self.last_run = None
+        self.last_error = None  # (thời điểm, mô tả lỗi) của lần chạy lịch thất bại gần nhất
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('STOCK_SNAPSHOT_INTERVAL', self.interval)
+        app.before_request(self._start_scheduler)
+
+    def snapshot_if_due(self):
+        # Nhiều tiến trình cùng chạy lịch: bỏ qua nếu tiến trình khác vừa chụp
+        newest = db.session.query(func.max(StockSnapshot.taken_at)).scalar()
+        if newest is not None and datetime.now() - newest < timedelta(seconds=self.interval / 2):
+            return 0
+        try:
+            count = take_snapshot()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.snapshots += 1
+        return count
+
+    def _start_scheduler(self):
+        if self._scheduler is not None or not self.interval:
+            return
+        with self._lock:
+            if self._scheduler is not None:
+                return
+
+            def run():
+                time.sleep(min(self.interval, 60))
+                while True:
+                    try:
+                        with self.app.app_context():
+                            self.snapshot_if_due()
+                        self.last_run = datetime.now()
+                    except Exception as ex:
+                        # Không chụp được thì tồn kho theo ngày phải quét lại toàn bộ biến động: phải thấy được lỗi
+                        self.last_error = (datetime.now(), repr(ex))
+                        self.app.logger.exception('Chụp số dư tồn kho thất bại')
+                    time.sleep(self.interval)
+
+            self._scheduler = threading.Thread(target=run, name='stock-snapshot', daemon=True)
+            self._scheduler.start()
+
+    def stats(self):
+        error_at, error = self.last_error or (None, None)
+        return {
+            'interval': self.interval,
+            'running': self._scheduler is not None and self._scheduler.is_alive(),
+            'snapshots': self.snapshots,
+            'last_run': self.last_run.isoformat(timespec='seconds') if self.last_run else None,
+            'last_error': error,
+            'last_error_at': error_at.isoformat(timespec='seconds') if error_at else None
+        }
+
+
+stock_ledger = StockLedger()
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from bookapp import app
+
+    # python -m bookapp.ledger reconcile [--fix] | snapshot | at YYYY-MM-DD [book_id ...]
+    args = sys.argv[1:] or ['reconcile']
+    command = args[0]
+    with app.app_context():
+        if command == 'reconcile':
+            report = reconcile(fix='--fix' in args)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            if report['mismatches'] and not report['fixed']:
+                sys.exit(1)
+        elif command == 'snapshot':
+            count = take_snapshot()
+            db.session.commit()
+            print(f'Đã chụp số dư cho {count} sách')
+        elif command == 'at' and len(args) > 1:
+            # Tồn kho cuối ngày: các biến động ghi sổ trước 0 giờ ngày hôm sau
+            when = datetime.strptime(args[1], '%Y-%m-%d') + timedelta(days=1)
+            started = time.perf_counter()
+            stocks = stock_at(when, [int(book_id) for book_id in args[2:]] or None)
+            print(f'{len(stocks)} sách, {time.perf_counter() - started:.3f} giây', file=sys.stderr)
+            print(json.dumps(stocks, indent=2))
+        else:
+            sys.exit('Dùng: python -m bookapp.ledger reconcile [--fix] | snapshot | at YYYY-MM-DD [book_id ...]')
@@ -0,0 +1,209 @@
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, select, text, insert
+from bookapp import db
+from bookapp.models import Book, Receipt, ReceiptDetail, ImportEntry, User, Regulation, StockMovement, StockSnapshot
+
+# Bảng ghi lại các migration đã chạy (không nằm trong db.metadata nên create_all không đụng tới)
+migration_metadata = MetaData()
+schema_migrations = Table('schema_migrations', migration_metadata,
+                          Column('version', Integer, primary_key=True, autoincrement=False),
+                          Column('name', String(100), nullable=False),
+                          Column('applied_at', DateTime, nullable=False))
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Đăng ký một bước nâng cấp; mỗi bước phải chạy lại được an toàn trên CSDL đã có sẵn thay đổi đó"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _columns(conn, table):
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+@migration(1, 'create_new_tables')
+def create_new_tables(conn):
+    # sales_rollup, regulation_version, ... (bảng đã có thì bỏ qua)
+    db.metadata.create_all(bind=conn, checkfirst=True)
+
+
+@migration(2, 'regulation_code_and_version')
+def regulation_code_and_version(conn):
+    if 'code' not in _columns(conn, 'regulations'):
+        conn.execute(text('ALTER TABLE regulations ADD COLUMN code VARCHAR(50)'))
+        conn.execute(text('CREATE UNIQUE INDEX ix_regulations_code ON regulations (code)'))
+    if 'regulation_version_id' not in _columns(conn, 'import_entries'):
+        conn.execute(text('ALTER TABLE import_entries ADD COLUMN regulation_version_id INTEGER '
+                          'REFERENCES regulation_version (id)'))
+
+
+# Chỉ mục cho các truy vấn nóng, khai báo trong models.py (__table_args__)
+HOT_PATH_INDEXES = [index for model in (Book, Receipt, ReceiptDetail, ImportEntry)
+                    for index in model.__table__.indexes if index.name.startswith('ix_')]
+
+
+@migration(3, 'hot_path_indexes')
+def hot_path_indexes(conn):
+    for index in HOT_PATH_INDEXES:
+        index.create(bind=conn, checkfirst=True)
+
+
+@migration(4, 'widen_user_avatar')
+def widen_user_avatar(conn):
+    # URL ảnh đại diện dài hơn 50 ký tự; SQLite không giới hạn độ dài VARCHAR
+    if conn.dialect.name == 'mysql':
+        conn.execute(text('ALTER TABLE user MODIFY avatar VARCHAR(255)'))
+
+
+@migration(5, 'stock_ledger')
+def stock_ledger(conn):
+    # Sổ biến động tồn kho (xem ledger.py); tồn kho hiện có được ghi thành số dư đầu kỳ
+    from bookapp import ledger
+    for model in (StockMovement, StockSnapshot):
+        model.__table__.create(bind=conn, checkfirst=True)
+    ledger.opening_balances(conn)
+
+
+@migration(6, 'backfill_sales_rollup')
+def backfill_sales_rollup(conn):
+    # sales_rollup chỉ được cộng dồn từ lúc có bảng; tính lại từ ReceiptDetail để tháng triển khai
+    # (và các tháng trước) không thiếu hóa đơn cũ
+    from bookapp import rollup
+    rollup.rebuild(bind=conn)
+
+
+def applied_versions(conn):
+    migration_metadata.create_all(bind=conn, checkfirst=True)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(engine=None, target=None):
+    """Chạy các migration chưa áp dụng theo thứ tự, mỗi bước trong một giao dịch riêng"""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, name, func in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        with engine.begin() as conn:
+            func(conn)
+            conn.execute(insert(schema_migrations).values(version=version, name=name, applied_at=datetime.now()))
+        applied.append((version, name))
+    return applied
+
+
+def status(engine=None):
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+
+
+def hot_queries():
+    """Các truy vấn nóng (giống điều kiện lọc trong utils/admin/rollup) và bảng phải dùng chỉ mục"""
+    from sqlalchemy import func
+    start, end = datetime(2024, 1, 1), datetime(2024, 2, 1)
+    return [
+        ('sách theo danh mục', 'book',
+         select(Book.id).where(Book.category_id == 1, Book.active.is_(True))),
+        ('đếm sách theo danh mục', 'book',
+         select(Book.category_id, func.count(Book.id)).group_by(Book.category_id)),
+        ('tìm sách theo tên khi nhập', 'book',
+         select(Book.id, Book.stock).where(Book.name == 'Đắc Nhân Tâm')),
+        ('hóa đơn trong tháng', 'receipt',
+         select(Receipt.id).where(Receipt.created_date >= start, Receipt.created_date < end)),
+        ('lịch sử mua hàng', 'receipt',
+         select(Receipt.id).where(Receipt.user_id == 1).order_by(Receipt.created_date.desc())),
+        ('thống kê theo tháng', 'receipt_detail',
+         select(ReceiptDetail.product_id, func.sum(ReceiptDetail.quantity))
+         .join(Receipt, ReceiptDetail.receipt_id == Receipt.id)
+         .where(Receipt.created_date >= start, Receipt.created_date < end)
+         .group_by(ReceiptDetail.product_id)),
+        ('số lượng đã bán của một sách', 'receipt_detail',
+         select(func.sum(ReceiptDetail.quantity)).where(ReceiptDetail.product_id == 1)),
+        ('phiếu nhập của một sách', 'import_entries',
+         select(ImportEntry.id).where(ImportEntry.book_id == 1).order_by(ImportEntry.import_date)),
+        ('phiếu nhập theo khoảng ngày', 'import_entries',
+         select(ImportEntry.id).where(ImportEntry.import_date >= start, ImportEntry.import_date < end)),
+        ('đăng nhập', 'user',
+         select(User.id).where(User.username == 'admin', User.password == 'x')),
+        ('quy định theo mã', 'regulations',
+         select(Regulation.id).where(Regulation.code == 'MAX_STOCK')),
+        ('lần chụp tồn kho gần nhất', 'stock_snapshot',
+         select(func.max(StockSnapshot.taken_at)).where(StockSnapshot.taken_at <= end)),
+        ('biến động tồn kho sau lần chụp', 'stock_movement',
+         select(StockMovement.book_id, StockMovement.kind, func.sum(StockMovement.quantity))
+         .where(StockMovement.created_date >= start)
+         .group_by(StockMovement.kind, StockMovement.book_id)),
+    ]
+
+
+def explain(conn, statement):
+    """EXPLAIN QUERY PLAN của SQLite cho một câu SQLAlchemy, trả về danh sách dòng mô tả"""
+    compiled = statement.compile(dialect=conn.dialect)
+    params = tuple(str(v) if isinstance(v, datetime) else v
+                   for v in (compiled.params[name] for name in compiled.positiontup or ()))
+    return [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)]
+
+
+def uses_index(plan, table):
+    """Mọi bước đụng tới bảng đều phải dùng chỉ mục (SEARCH/SCAN ... USING ... INDEX/PRIMARY KEY)"""
+    steps = [step for step in plan if f' {table} ' in f' {step} ' or step.split()[1:2] == [table]]
+    return bool(steps) and all('USING' in step for step in steps)
+
+
+def explain_check(path=None):
+    """Tạo CSDL SQLite tạm theo lược đồ CŨ (không có chỉ mục mới), chạy migration
+    rồi kiểm tra kế hoạch thực thi của từng truy vấn nóng"""
+    import os
+    import tempfile
+    from sqlalchemy import create_engine
+
+    path = path or os.path.join(tempfile.mkdtemp(prefix='bookapp-explain-'), 'explain.db')
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for index in HOT_PATH_INDEXES:
+            index.drop(bind=conn)
+
+    results = []
+    with engine.connect() as conn:
+        before = {name: uses_index(explain(conn, stmt), table) for name, table, stmt in hot_queries()}
+
+    applied = upgrade(engine)
+    with engine.connect() as conn:
+        for name, table, stmt in hot_queries():
+            plan = explain(conn, stmt)
+            results.append({'query': name, 'table': table, 'indexed_before': before[name],
+                            'indexed': uses_index(plan, table), 'plan': plan})
+    engine.dispose()
+    return {'applied': applied, 'results': results, 'ok': all(r['indexed'] for r in results)}
+
+
+if __name__ == '__main__':
+    import sys
+    from bookapp import app
+
+    # python -m bookapp.migrations [upgrade|status|check]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    if command == 'check':
+        report = explain_check()
+        for r in report['results']:
+            mark = 'OK ' if r['indexed'] else 'LỖI'
+            print(f"{mark} {r['query']} ({r['table']}): {' | '.join(r['plan'])}")
+        sys.exit(0 if report['ok'] else 1)
+
+    with app.app_context():
+        if command == 'status':
+            for version, name, done in status():
+                print(f"{version:04d} {name}: {'đã chạy' if done else 'chưa chạy'}")
+        else:
+            for version, name in upgrade():
+                print(f'Đã chạy migration {version:04d} {name}')
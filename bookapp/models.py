@@ -1,6 +1,6 @@
 from sqlalchemy.orm import relationship
 from bookapp import db, app
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Enum
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Enum, Text, Index
 from datetime import datetime
 from enum import Enum as UserEnum
 from flask_login import UserMixin
@@ -22,10 +22,10 @@ class User(BaseModel, UserMixin):
     name = Column(String(50), nullable=False)
     username = Column(String(50), nullable=False, unique=True)
     password = Column(String(50), nullable=False)
-    avatar = Column(String(50))
+    avatar = Column(String(255))  # URL ảnh (Cloudinary hoặc /static/uploads/...)
     email = Column(String(50))
     active = Column(Boolean, default=True)
-    joined_date = Column(DateTime, default=datetime.now())
+    joined_date = Column(DateTime, default=datetime.now)
     user_role = Column(Enum(UserRole), default=UserRole.USER)
     receipts = relationship('Receipt', backref='user', lazy=True)
 
@@ -42,13 +42,18 @@ class BookCategory(BaseModel):
 
 
 class Book(BaseModel):
+    # Chỉ mục cho lọc theo danh mục, tra cứu theo tên (phiếu nhập) và sắp xếp theo tên
+    __table_args__ = (
+        Index('ix_book_category_id_active', 'category_id', 'active'),
+        Index('ix_book_name', 'name'),
+    )
     name = Column(String(50), nullable=False)
     author = Column(String(50), nullable=True)
     description = Column(String(250), nullable=True)
     price = Column(Float, default=0)
     image = Column(String(250), nullable=True)
     active = Column(Boolean, default=True)
-    created_date = Column(DateTime, default=datetime.now())
+    created_date = Column(DateTime, default=datetime.now)
     stock = Column(Integer, default=0)
     category_id = Column(Integer, ForeignKey(BookCategory.id), nullable=False)
     receipt_details = relationship('ReceiptDetail', backref='book', lazy=True)
@@ -65,7 +70,12 @@ class PaymentMethod(UserEnum):
     ONLINE = "online"
 
 class Receipt(BaseModel):
-    created_date = Column(DateTime, default=datetime.now())
+    # Thống kê lọc theo khoảng created_date; lịch sử mua hàng lọc theo user_id rồi sắp theo ngày
+    __table_args__ = (
+        Index('ix_receipt_created_date', 'created_date'),
+        Index('ix_receipt_user_id_created_date', 'user_id', 'created_date'),
+    )
+    created_date = Column(DateTime, default=datetime.now)
     user_id = Column(Integer, ForeignKey(User.id), nullable=False)
     delivery_method = Column(Enum(DeliveryMethod), nullable=False)  # Phương thức nhận hàng
     payment_method = Column(Enum(PaymentMethod), nullable=False)  # Phương thức thanh toán
@@ -80,14 +90,32 @@ class Receipt(BaseModel):
 
 
 class ReceiptDetail(db.Model):
+    # Khóa chính bắt đầu bằng receipt_id nên cần thêm chỉ mục cho truy vấn theo sách
+    __table_args__ = (
+        Index('ix_receipt_detail_product_id', 'product_id'),
+    )
     receipt_id = Column(Integer, ForeignKey(Receipt.id), nullable=False, primary_key=True)
     product_id = Column(Integer, ForeignKey(Book.id), nullable=False, primary_key=True)
     quantity = Column(Integer, default=0)
     unit_price = Column(Float, default=0)
 
 
+class SalesRollup(db.Model):
+    # Tổng hợp doanh số theo tháng, cập nhật cùng giao dịch với hóa đơn
+    __tablename__ = 'sales_rollup'
+    year = Column(Integer, primary_key=True, autoincrement=False)
+    month = Column(Integer, primary_key=True, autoincrement=False)
+    # Thể loại lúc ghi dòng; báo cáo luôn gom theo thể loại hiện tại của sách (Book.category_id)
+    category_id = Column(Integer, ForeignKey(BookCategory.id), primary_key=True, autoincrement=False)
+    book_id = Column(Integer, ForeignKey(Book.id), primary_key=True, autoincrement=False)
+    quantity = Column(Integer, nullable=False, default=0)  # Tổng số lượng bán
+    revenue = Column(Float, nullable=False, default=0)  # Tổng doanh thu
+    line_count = Column(Integer, nullable=False, default=0)  # Số lượt bán (số dòng chi tiết hóa đơn)
+
+
 class RegulationImport(BaseModel):
     __tablename__ = 'regulation_import'
+    id = None  # Bảng liên kết: khóa chính là (regulation_id, import_entry_id), không dùng cột id của BaseModel
 
     regulation_id = Column(Integer, ForeignKey('regulations.id'), primary_key=True)
     import_entry_id = Column(Integer, ForeignKey('import_entries.id'), primary_key=True)
@@ -95,6 +123,7 @@ class RegulationImport(BaseModel):
 
 class Regulation(BaseModel):
     __tablename__ = 'regulations'
+    code = Column(String(50), unique=True)  # Mã ổn định (MIN_IMPORT, MAX_STOCK, ...), không phụ thuộc tên hiển thị
     name = Column(String(100), nullable=False)
     value = Column(Float, nullable=False)
     is_active = Column(Boolean, default=True)
@@ -103,14 +132,58 @@ class Regulation(BaseModel):
                                   backref='regulations')
 
 
+class RegulationVersion(BaseModel):
+    __tablename__ = 'regulation_version'
+    created_date = Column(DateTime, default=datetime.now)
+    rules = Column(Text, nullable=False)  # JSON {mã quy định: giá trị} tại thời điểm tạo phiên bản
+
+
 class ImportEntry(BaseModel):
     __tablename__ = 'import_entries'
+    __table_args__ = (
+        Index('ix_import_entries_book_id_import_date', 'book_id', 'import_date'),
+        Index('ix_import_entries_import_date', 'import_date'),
+    )
     book_id = Column(Integer, ForeignKey('book.id'), nullable=False)
     book_name = Column(String(255), nullable=False)
     quantity = Column(Integer, nullable=False)
     unit_price = Column(Float, nullable=False)
     import_date = Column(DateTime, default=datetime.now)
+    # Phiên bản quy định áp dụng cho phiếu nhập (thay cho một dòng RegulationImport cho mỗi quy định)
+    regulation_version_id = Column(Integer, ForeignKey('regulation_version.id'))
     book = relationship('Book', backref='import_entries')
+    regulation_version = relationship('RegulationVersion')
+
+
+class StockMovement(BaseModel):
+    # Sổ biến động tồn kho (chỉ thêm, không sửa/xóa): nhập hàng, bán hàng, điều chỉnh tay
+    __tablename__ = 'stock_movement'
+    __table_args__ = (
+        Index('ix_stock_movement_book_id_created_date', 'book_id', 'created_date'),
+        Index('ix_stock_movement_created_date', 'created_date'),
+    )
+    book_id = Column(Integer, ForeignKey('book.id'), nullable=False)
+    created_date = Column(DateTime, nullable=False, default=datetime.now)  # Lúc ghi sổ, không phải ngày trên chứng từ
+    kind = Column(String(10), nullable=False)  # 'import', 'sale', 'adjust' (xem bookapp/ledger.py)
+    quantity = Column(Integer, nullable=False)  # Có dấu: nhập > 0, bán < 0
+    ref_id = Column(Integer)  # Mã hóa đơn (sale) hoặc phiếu nhập (import) nếu có
+    user_id = Column(Integer, ForeignKey(User.id))
+    note = Column(String(100))
+
+
+class StockSnapshot(db.Model):
+    # Số dư tồn kho của một cuốn sách tính đến taken_at (gồm các biến động có created_date < taken_at)
+    __tablename__ = 'stock_snapshot'
+    __table_args__ = (
+        Index('ix_stock_snapshot_taken_at', 'taken_at'),
+    )
+    book_id = Column(Integer, ForeignKey(Book.id), primary_key=True, autoincrement=False)
+    taken_at = Column(DateTime, primary_key=True)
+    stock = Column(Integer, nullable=False)
+    imported = Column(Integer, nullable=False, default=0)  # Lũy kế từ đầu sổ
+    sold = Column(Integer, nullable=False, default=0)
+    adjusted = Column(Integer, nullable=False, default=0)
+
 
 if __name__ == '__main__':
     with app.app_context():
@@ -0,0 +1,156 @@
+import hashlib
+import threading
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, session, make_response
+from flask_login import current_user
+from markupsafe import Markup
+from bookapp.cache import LRUCache
+from bookapp.catalog import on_books_committed
+
+
+class CatalogVersion:
+    """Bộ đếm phiên bản sách/danh mục: mỗi lần ghi sách hoặc danh mục tăng lên 1"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+        self.changed_at = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+            self.changed_at = datetime.now(timezone.utc).replace(microsecond=0)
+            return self.value
+
+
+class PageEntry:
+    __slots__ = ('body', 'mimetype', 'etag', 'last_modified')
+
+    def __init__(self, body, mimetype, version, last_modified):
+        self.body = body
+        self.mimetype = mimetype
+        # Phiên bản + băm nội dung: tiến trình khác (chưa biết thay đổi) không thể trả 304 sai
+        self.etag = f'{version}-{hashlib.sha1(body).hexdigest()[:16]}'
+        self.last_modified = last_modified
+
+
+class Deferred:
+    """Danh sách chỉ được nạp khi template thực sự duyệt tới (fragment chưa có trong bộ nhớ đệm)"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._items = None
+
+    def _load(self):
+        if self._items is None:
+            self._items = list(self._loader())
+        return self._items
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+
+class PageCache:
+    """Bộ nhớ đệm trang đầy đủ (khách chưa đăng nhập, giỏ trống) và fragment Jinja (mọi người dùng).
+    Khóa luôn kèm phiên bản danh mục nên mọi thay đổi sách/danh mục làm các bản cũ hết hiệu lực."""
+
+    def __init__(self, max_size=512, ttl=60, max_bytes=32 * 1024 * 1024):
+        self.version = CatalogVersion()
+        self.pages = LRUCache(max_size=max_size, ttl=ttl, max_bytes=max_bytes)
+        self.fragments = LRUCache(max_size=max_size * 4, ttl=ttl, max_bytes=max_bytes // 2)
+        self.enabled = True
+        self.not_modified = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PAGE_CACHE', self.enabled)
+        max_size = app.config.get('PAGE_CACHE_SIZE', self.pages.max_size)
+        ttl = app.config.get('PAGE_CACHE_TTL', self.pages.ttl)
+        max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES', self.pages.max_bytes)
+        self.pages = LRUCache(max_size=max_size, ttl=ttl, max_bytes=max_bytes)
+        self.fragments = LRUCache(max_size=max_size * 4, ttl=ttl, max_bytes=max_bytes // 2)
+        app.jinja_env.globals.update(cached_fragment=self.fragment, page_key=page_key)
+
+    def bump(self):
+        """Gọi sau khi commit thay đổi sách/danh mục (kể cả tồn kho)"""
+        self.version.bump()
+        self.pages.clear()
+        self.fragments.clear()
+
+    def fragment(self, *key, caller):
+        # {% call cached_fragment('category-menu') %}...{% endcall %}
+        if not self.enabled:
+            return caller()
+        full_key = (self.version.value,) + key
+        html = self.fragments.get(full_key)
+        if html is None:
+            html = Markup(caller())
+            self.fragments.set(full_key, html, size=len(html))
+        return html
+
+    def cacheable(self):
+        # Trang giống nhau cho mọi khách: chưa đăng nhập, giỏ trống, không có thông báo flash
+        return self.enabled and request.method == 'GET' and not current_user.is_authenticated \
+            and not session.get('cart') and not session.get('_flashes')
+
+    def respond(self, entry):
+        response = make_response(entry.body)
+        response.mimetype = entry.mimetype
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        response.cache_control.no_cache = True  # Trình duyệt luôn hỏi lại bằng If-None-Match
+        response.make_conditional(request)
+        if response.status_code == 304:
+            self.not_modified += 1
+        return response
+
+    def stats(self):
+        return {
+            'version': self.version.value,
+            'changed_at': self.version.changed_at.isoformat(),
+            'pages': self.pages.stats(),
+            'fragments': self.fragments.stats(),
+            'not_modified': self.not_modified
+        }
+
+
+def page_key():
+    """(route, tham số đường dẫn, query string đã sắp xếp): kw, category_id, page, cursor, sort..."""
+    return (request.endpoint,
+            tuple(sorted((request.view_args or {}).items())),
+            tuple(sorted(request.args.items(multi=True))))
+
+
+page_cache = PageCache()
+
+
+def cached_page(view):
+    """Lưu đệm toàn bộ trang cho khách, trả 304 khi ETag/Last-Modified của trình duyệt còn đúng"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not page_cache.cacheable():
+            return view(*args, **kwargs)
+
+        version = page_cache.version.value
+        key = (version,) + page_key()
+        entry = page_cache.pages.get(key)
+        if entry is None:
+            last_modified = page_cache.version.changed_at
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = PageEntry(response.get_data(), response.mimetype, version, last_modified)
+            page_cache.pages.set(key, entry, size=len(entry.body))
+        return page_cache.respond(entry)
+    return wrapper
+
+
+@on_books_committed
+def _bump_on_book_changes(changes):
+    page_cache.bump()
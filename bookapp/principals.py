@@ -0,0 +1,172 @@
+import threading
+from flask_login import UserMixin, user_logged_in, user_logged_out
+from sqlalchemy import event
+from bookapp import db
+from bookapp.cache import LRUCache
+from bookapp.models import User
+
+PRINCIPAL_COLUMNS = (User.id, User.name, User.username, User.user_role, User.active, User.avatar)
+
+
+class UserPrincipal(UserMixin):
+    """Thông tin đăng nhập tối thiểu của người dùng (không phải đối tượng ORM):
+    dùng chung giữa các request, không gắn với session SQLAlchemy nào"""
+    __slots__ = ('id', 'name', 'username', 'user_role', 'active', 'avatar')
+
+    def __init__(self, id, name, username, user_role, active, avatar):
+        self.id = id
+        self.name = name
+        self.username = username
+        self.user_role = user_role
+        self.active = active
+        self.avatar = avatar
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(*(getattr(user, column.key) for column in PRINCIPAL_COLUMNS))
+
+    def __str__(self):
+        return self.name
+
+
+class PrincipalCache:
+    """Bộ nhớ đệm LRU có thời gian sống cho user_loader của Flask-Login: request của người đã đăng nhập
+    không cần SELECT bảng user. Bị xóa khi dòng user thay đổi (commit) hoặc khi đăng xuất."""
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+        self.enabled = True
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PRINCIPAL_CACHE', self.enabled)
+        self.cache = LRUCache(max_size=app.config.get('PRINCIPAL_CACHE_SIZE', self.cache.max_size),
+                              ttl=app.config.get('PRINCIPAL_CACHE_TTL', self.cache.ttl))
+        user_logged_in.connect(self._logged_in, app)
+        user_logged_out.connect(self._logged_out, app)
+
+    def load(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        if self.enabled:
+            principal = self.cache.get(user_id)
+            if principal is not None:
+                return principal
+
+        generation = self._generation
+        row = db.session.query(*PRINCIPAL_COLUMNS).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        principal = UserPrincipal(*row)
+        self._store(principal, generation)
+        return principal
+
+    def _store(self, principal, generation):
+        with self._lock:
+            # Không lưu bản đọc trước một lần xóa đệm xảy ra trong lúc đang truy vấn
+            if self.enabled and generation == self._generation:
+                self.cache.set(principal.id, principal)
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self.cache.delete(int(user_id))
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.cache.clear()
+            self.invalidations += 1
+
+    def _logged_in(self, sender, user, **extra):
+        # Vừa đăng nhập: đã có sẵn đối tượng User, request tiếp theo không cần truy vấn
+        self._store(UserPrincipal.from_user(user), self._generation)
+
+    def _logged_out(self, sender, user, **extra):
+        if user is not None and getattr(user, 'id', None) is not None:
+            self.invalidate(user.id)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['invalidations'] = self.invalidations
+        stats['enabled'] = self.enabled
+        return stats
+
+
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_user_changes(session, flush_context):
+    changed = session.info.setdefault('user_changes', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_users(session):
+    changed = session.info.pop('user_changes', None)
+    if changed:
+        principal_cache.invalidate(*changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_user_changes(session):
+    session.info.pop('user_changes', None)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def _invalidate_on_bulk(update_context):
+    # UPDATE/DELETE hàng loạt trên bảng user: không biết dòng nào bị ảnh hưởng
+    if update_context.mapper is not None and update_context.mapper.class_ is User:
+        principal_cache.clear()
+
+
+def benchmark_cart(requests=200, concurrency=4, users=20, books=200):
+    """Chạy các kịch bản giỏ hàng của benchmark khi tắt rồi bật bộ nhớ đệm,
+    trả về số câu SQL và độ trễ của mỗi lần chạy"""
+    from bookapp import app, benchmark
+    from bookapp.principals import principal_cache  # Bản mà app dùng (kể cả khi chạy bằng python -m)
+    benchmark.prepare_app()
+    with app.app_context():
+        benchmark.seed(books=books, categories=10, users=users, receipts=100)
+
+    cart_scenarios = {name: spec for name, spec in benchmark.scenarios(books, users).items()
+                      if name in ('add_cart', 'update_cart', 'cart')}
+    enabled = principal_cache.enabled
+    results = {}
+    try:
+        for label, cached in (('uncached', False), ('cached', True)):
+            principal_cache.enabled = cached
+            principal_cache.clear()
+            results[label] = {name: benchmark.run_scenario(name, role, action, requests, concurrency, users)
+                              for name, (role, action) in cart_scenarios.items()}
+    finally:
+        principal_cache.enabled = enabled
+    results['principal_cache'] = principal_cache.stats()
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from bookapp import app
+
+    # python -m bookapp.principals: so sánh số câu SQL/request của API giỏ hàng khi có và không có bộ nhớ đệm
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        sys.exit('Hãy đặt BOOKAPP_DATABASE_URI trỏ tới một file SQLite, ví dụ\n'
+                 'BOOKAPP_DATABASE_URI=sqlite:////tmp/bookapp-bench.db python -m bookapp.principals')
+    report = benchmark_cart()
+    for name in report['cached']:
+        before, after = report['uncached'][name], report['cached'][name]
+        print(f"{name}: câu SQL p50 {before['queries']['p50']} -> {after['queries']['p50']}, "
+              f"độ trễ p50 {before['latency_ms']['p50']} -> {after['latency_ms']['p50']} ms", file=sys.stderr)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque, Counter
+from flask import g, request, has_app_context, request_started, request_finished, \
+    before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS = ('latency', 'sql_time', 'template_time', 'queries')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RouteStats:
+    """Số liệu của một route: cửa sổ các mẫu gần nhất để tính phân vị, kèm tổng tích lũy"""
+
+    def __init__(self, window):
+        self.samples = {name: deque(maxlen=window) for name in METRICS}
+        self.totals = dict.fromkeys(METRICS, 0)
+        self.count = 0
+        self.over_budget = 0
+        self.repeated = None  # (số lần, câu SQL) lặp nhiều nhất trong một request: dấu hiệu N+1
+
+    def add(self, sample, budget):
+        self.count += 1
+        for name in METRICS:
+            self.samples[name].append(sample[name])
+            self.totals[name] += sample[name]
+        if budget is not None and sample['queries'] > budget:
+            self.over_budget += 1
+        if sample['repeated'] and (self.repeated is None or sample['repeated'][0] >= self.repeated[0]):
+            self.repeated = sample['repeated']
+
+    def summary(self):
+        result = {'count': self.count, 'over_budget': self.over_budget, 'repeated': self.repeated}
+        for name in METRICS:
+            values = sorted(self.samples[name])
+            result[name] = {f'p{int(q * 100)}': percentile(values, q) for q in QUANTILES}
+            result[name]['max'] = values[-1] if values else 0
+            result[name]['sum'] = self.totals[name]
+        return result
+
+
+class Profiler:
+    """Đo số câu SQL, thời gian SQL, thời gian render template và tổng thời gian cho từng route.
+    Chỉ hoạt động khi bật PROFILING (mặc định tắt)."""
+
+    def __init__(self, window=1000, query_budget=20, route_budgets=None, repeat_threshold=5):
+        self.window = window
+        self.query_budget = query_budget
+        self.route_budgets = route_budgets or {}
+        self.repeat_threshold = repeat_threshold
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def budget(self, route):
+        return self.route_budgets.get(route, self.query_budget)
+
+    # --- Sự kiện SQLAlchemy ---
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._perf_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_perf_start', None)
+        state = g.get('_perf') if has_app_context() else None
+        if state is None or started is None:
+            return  # Ngoài request (job nền, lệnh quản trị)
+        state['queries'] += 1
+        state['sql_time'] += time.perf_counter() - started
+        state['statements'][statement] += 1
+
+    # --- Tín hiệu Flask ---
+    def _request_started(self, sender, **extra):
+        g._perf = {'start': time.perf_counter(), 'queries': 0, 'sql_time': 0.0,
+                   'template_time': 0.0, 'template_start': [], 'statements': Counter()}
+
+    def _before_render_template(self, sender, template, context, **extra):
+        state = g.get('_perf')
+        if state is not None:
+            state['template_start'].append(time.perf_counter())
+
+    def _template_rendered(self, sender, template, context, **extra):
+        state = g.get('_perf')
+        if state is not None and state['template_start']:
+            # Thời gian render gồm cả các câu SQL chạy lười bên trong template
+            state['template_time'] += time.perf_counter() - state['template_start'].pop()
+
+    def _request_finished(self, sender, response, **extra):
+        state = g.pop('_perf', None)
+        if state is None:
+            return
+        latency = time.perf_counter() - state['start']
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        key = f'{request.method} {route}'
+
+        repeated = None
+        if state['statements']:
+            statement, times = state['statements'].most_common(1)[0]
+            if times >= self.repeat_threshold:
+                repeated = (times, ' '.join(statement.split())[:300])
+
+        sample = {'latency': latency, 'sql_time': state['sql_time'], 'template_time': state['template_time'],
+                  'queries': state['queries'], 'repeated': repeated}
+        budget = self.budget(route)
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = RouteStats(self.window)
+            stats.add(sample, budget)
+
+        response.headers['X-Query-Count'] = str(state['queries'])
+        response.headers['Server-Timing'] = f"sql;dur={state['sql_time'] * 1000:.1f}, " \
+                                            f"tpl;dur={state['template_time'] * 1000:.1f}, " \
+                                            f"total;dur={latency * 1000:.1f}"
+        if budget is not None and state['queries'] > budget:
+            sender.logger.warning('%s chạy %d câu SQL (vượt ngân sách %d)', key, state['queries'], budget)
+
+    def init_app(self, app):
+        self.window = app.config.get('PROFILING_WINDOW', self.window)
+        self.query_budget = app.config.get('PROFILING_QUERY_BUDGET', self.query_budget)
+        self.route_budgets = app.config.get('PROFILING_ROUTE_BUDGETS', self.route_budgets)
+        if not app.config.get('PROFILING') or self.enabled:
+            return
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        request_started.connect(self._request_started, app)
+        before_render_template.connect(self._before_render_template, app)
+        template_rendered.connect(self._template_rendered, app)
+        request_finished.connect(self._request_finished, app)
+        self.enabled = True
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def report(self):
+        with self._lock:
+            items = [(key, stats.summary()) for key, stats in self._routes.items()]
+        report = []
+        for key, summary in sorted(items):
+            method, route = key.split(' ', 1)
+            summary.update(method=method, route=route, budget=self.budget(route))
+            report.append(summary)
+        return report
+
+    def prometheus(self):
+        """Số liệu ở định dạng văn bản của Prometheus (kiểu summary)"""
+        metrics = [
+            ('latency', 'bookapp_request_latency_seconds', 'Tổng thời gian xử lý request'),
+            ('sql_time', 'bookapp_request_sql_seconds', 'Thời gian chạy SQL trong một request'),
+            ('template_time', 'bookapp_request_template_seconds', 'Thời gian render template trong một request'),
+            ('queries', 'bookapp_request_queries', 'Số câu SQL trong một request'),
+        ]
+        report = self.report()
+        lines = []
+        for field, name, help_text in metrics:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} summary')
+            for item in report:
+                labels = f'method="{item["method"]}",route="{_escape(item["route"])}"'
+                for q in QUANTILES:
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {item[field][f"p{int(q * 100)}"]}')
+                lines.append(f'{name}_sum{{{labels}}} {item[field]["sum"]}')
+                lines.append(f'{name}_count{{{labels}}} {item["count"]}')
+        lines.append('# HELP bookapp_query_budget_exceeded_total Số request vượt ngân sách câu SQL')
+        lines.append('# TYPE bookapp_query_budget_exceeded_total counter')
+        for item in report:
+            labels = f'method="{item["method"]}",route="{_escape(item["route"])}"'
+            lines.append(f'bookapp_query_budget_exceeded_total{{{labels}}} {item["over_budget"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+profiler = Profiler()
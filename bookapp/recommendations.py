@@ -0,0 +1,288 @@
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+from bookapp import db
+from bookapp.database import replica_reads
+from bookapp.models import ReceiptDetail
+
+CURRENT = 'CURRENT'  # File chứa tên bản chỉ mục đang dùng, được thay nguyên tử
+
+
+class RecommendationIndex:
+    """Chỉ mục top-k láng giềng đọc từ các file .npy bằng memory-map:
+    books[i] là mã sách của dòng i, neighbors[i]/scores[i] là k sách mua cùng nhiều nhất (-1 = trống)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.books = np.load(os.path.join(path, 'books.npy'), mmap_mode='r')
+        self.neighbors = np.load(os.path.join(path, 'neighbors.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode='r')
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def last_receipt_id(self):
+        return self.meta['last_receipt_id']
+
+    def row(self, book_id):
+        # books đã sắp xếp tăng dần: tìm nhị phân thay cho dict book_id -> dòng
+        i = int(np.searchsorted(self.books, book_id))
+        if i == len(self.books) or self.books[i] != book_id:
+            return {}
+        neighbors, scores = self.neighbors[i], self.scores[i]
+        filled = neighbors >= 0
+        return dict(zip(neighbors[filled].tolist(), scores[filled].tolist()))
+
+
+def fetch_pairs(after=0, chunk_size=50000):
+    """(receipt_id, product_id) của các hóa đơn có mã > after, đọc theo từng khối vào mảng NumPy"""
+    stmt = select(ReceiptDetail.receipt_id, ReceiptDetail.product_id) \
+        .where(ReceiptDetail.receipt_id > after) \
+        .order_by(ReceiptDetail.receipt_id) \
+        .execution_options(yield_per=chunk_size)
+    chunks = [np.array(rows, dtype=np.int64) for rows in db.session.execute(stmt).partitions()]
+    if not chunks:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def top_neighbors(pairs, k):
+    """Ma trận đồng xuất hiện thưa C = XᵀX (X: hóa đơn × sách, 0/1) rồi lấy k láng giềng lớn nhất mỗi dòng.
+    Trả về (books, neighbors, scores); điểm là số hóa đơn có cả hai sách."""
+    receipts, receipt_idx = np.unique(pairs[:, 0], return_inverse=True)
+    # Hóa đơn chỉ có một cuốn không góp cặp nào
+    multi = np.bincount(receipt_idx)[receipt_idx] > 1
+    pairs = pairs[multi]
+    books, book_idx = np.unique(pairs[:, 1], return_inverse=True)
+    receipts, receipt_idx = np.unique(pairs[:, 0], return_inverse=True)
+
+    n = len(books)
+    incidence = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (receipt_idx, book_idx)),
+                                  shape=(len(receipts), n))
+    incidence.data[:] = 1  # Khóa chính (receipt_id, product_id) đã loại trùng, đặt lại cho chắc
+    cooc = (incidence.T @ incidence).tocsr()
+    cooc.setdiag(0)
+    cooc.eliminate_zeros()
+
+    # Sắp toàn bộ phần tử khác 0 theo (dòng, điểm giảm dần, mã sách) rồi giữ k phần tử đầu mỗi dòng
+    rows = np.repeat(np.arange(n), np.diff(cooc.indptr))
+    order = np.lexsort((cooc.indices, -cooc.data, rows))
+    rank = np.arange(len(order)) - cooc.indptr[rows[order]]
+    keep = rank < k
+    order, rank = order[keep], rank[keep]
+
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.int32)
+    neighbors[rows[order], rank] = books[cooc.indices[order]]
+    scores[rows[order], rank] = cooc.data[order]
+    return books.astype(np.int32), neighbors, scores
+
+
+def build(directory, k=20):
+    """Dựng lại toàn bộ chỉ mục từ ReceiptDetail, ghi vào thư mục mới rồi đổi file CURRENT (không để lộ bản ghi dở)"""
+    started = time.perf_counter()
+    with replica_reads():
+        pairs = fetch_pairs()
+    last_receipt_id = int(pairs[:, 0].max()) if len(pairs) else 0
+    books, neighbors, scores = top_neighbors(pairs, k)
+
+    name = f'{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}'
+    path = os.path.join(directory, name)
+    os.makedirs(path)  # Tạo luôn thư mục gốc nếu chưa có
+    np.save(os.path.join(path, 'books.npy'), books)
+    np.save(os.path.join(path, 'neighbors.npy'), neighbors)
+    np.save(os.path.join(path, 'scores.npy'), scores)
+    meta = {
+        'k': k,
+        'books': len(books),
+        'pairs': int(len(pairs)),
+        'last_receipt_id': last_receipt_id,
+        'built_at': datetime.now().isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    tmp = os.path.join(directory, f'{CURRENT}.{uuid.uuid4().hex}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(tmp, os.path.join(directory, CURRENT))
+    return path
+
+
+def prune(directory, keep, min_age=3600):
+    """Xóa các bản chỉ mục cũ (tiến trình khác đang mmap vẫn đọc được trên Linux);
+    bỏ qua bản mới tạo vì tiến trình khác có thể đang ghi dở"""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name not in keep and os.path.isdir(path) and time.time() - os.path.getmtime(path) > min_age:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class Recommender:
+    """"Khách hàng cũng mua": chỉ mục top-k dựng sẵn (memory-map) cộng với phần chênh lệch trong bộ nhớ
+    từ các hóa đơn mới hơn chỉ mục. Đủ nhiều hóa đơn mới thì dựng lại chỉ mục ở luồng nền."""
+
+    def __init__(self, directory=None, top_k=20, rebuild_after=500, reload_interval=30):
+        self.directory = directory
+        self.top_k = top_k
+        self.rebuild_after = rebuild_after
+        self.reload_interval = reload_interval
+        self.app = None
+        self._lock = threading.Lock()
+        self._index = None
+        self._recent = {}  # receipt_id -> mã các sách, chỉ gồm hóa đơn mới hơn chỉ mục
+        self._delta = {}  # book_id -> {book_id khác: số hóa đơn mua cùng}
+        self._caught_up = False
+        self._checked_at = 0
+        self._builder = None
+        self.builds = 0
+        self.requests = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('RECOMMENDATION_DIR', self.directory)
+        self.top_k = app.config.get('RECOMMENDATION_TOP_K', self.top_k)
+        self.rebuild_after = app.config.get('RECOMMENDATION_REBUILD_AFTER', self.rebuild_after)
+        # Chỉ mở file đã có trên đĩa; hóa đơn mới hơn chỉ mục được đọc bù ở lần gợi ý đầu tiên
+        self.load()
+
+    def load(self):
+        """Mở (memory-map) bản chỉ mục trong CURRENT nếu khác bản đang dùng"""
+        self._checked_at = time.monotonic()
+        try:
+            with open(os.path.join(self.directory, CURRENT), encoding='utf-8') as f:
+                name = f.read().strip()
+        except (OSError, TypeError):
+            return self._index
+        if self._index is not None and self._index.name == name:
+            return self._index
+        try:
+            index = RecommendationIndex(os.path.join(self.directory, name))
+        except (OSError, ValueError, KeyError):
+            return self._index
+        self._swap(index)
+        return index
+
+    def _swap(self, index):
+        with self._lock:
+            self._index = index
+            # Bỏ các hóa đơn chỉ mục mới đã bao gồm, tính lại phần chênh lệch từ phần còn lại
+            self._recent = {receipt_id: books for receipt_id, books in self._recent.items()
+                            if receipt_id > index.last_receipt_id}
+            self._delta = {}
+            for books in self._recent.values():
+                self._add_pairs(books)
+
+    def _add_pairs(self, books):
+        for a in books:
+            row = self._delta.setdefault(a, {})
+            for b in books:
+                if a != b:
+                    row[b] = row.get(b, 0) + 1
+
+    def record(self, receipt_id, book_ids):
+        """Gọi sau khi commit hóa đơn: cộng các cặp sách vào phần chênh lệch"""
+        books = sorted(set(book_ids))
+        index = self._index
+        if len(books) < 2 or (index is not None and receipt_id <= index.last_receipt_id):
+            return
+        with self._lock:
+            if receipt_id in self._recent:
+                return
+            self._recent[receipt_id] = books
+            self._add_pairs(books)
+            pending = len(self._recent)
+        if pending >= self.rebuild_after:
+            self.rebuild_async()
+
+    def _catch_up(self):
+        # Lần đầu trong tiến trình: đọc bù các hóa đơn mới hơn chỉ mục trên đĩa (hoặc dựng mới nếu chưa có)
+        self._caught_up = True
+        index = self._index
+        if index is None:
+            self.rebuild_async()
+            return
+        with replica_reads():
+            pairs = fetch_pairs(after=index.last_receipt_id)
+        if len(pairs):
+            receipt_ids, starts = np.unique(pairs[:, 0], return_index=True)
+            for receipt_id, books in zip(receipt_ids.tolist(), np.split(pairs[:, 1], starts[1:])):
+                self.record(receipt_id, books.tolist())
+
+    def recommend(self, book_id, limit=6):
+        """[(book_id, số hóa đơn mua cùng)] giảm dần theo điểm"""
+        self.requests += 1
+        if time.monotonic() - self._checked_at > self.reload_interval:
+            self.load()  # Tiến trình khác có thể đã dựng bản mới
+        if not self._caught_up:
+            self._catch_up()
+
+        index = self._index
+        scores = index.row(book_id) if index is not None else {}
+        with self._lock:
+            delta = dict(self._delta.get(book_id, ()))
+        for other, count in delta.items():
+            scores[other] = scores.get(other, 0) + count
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def rebuild(self):
+        index = RecommendationIndex(build(self.directory, self.top_k))
+        self._swap(index)
+        self.builds += 1
+        prune(self.directory, keep={index.name})
+        return index
+
+    def rebuild_async(self):
+        if self.app is None or (self._builder is not None and self._builder.is_alive()):
+            return
+
+        def run():
+            try:
+                with self.app.app_context():
+                    self.rebuild()
+            except Exception:
+                self.app.logger.exception('Dựng lại chỉ mục gợi ý thất bại')
+
+        self._builder = threading.Thread(target=run, name='recommendation-builder', daemon=True)
+        self._builder.start()
+
+    def stats(self):
+        index = self._index
+        return {
+            'index': index.meta if index is not None else None,
+            'pending_receipts': len(self._recent),
+            'builds': self.builds,
+            'building': self._builder is not None and self._builder.is_alive(),
+            'requests': self.requests
+        }
+
+
+recommender = Recommender()
+
+
+if __name__ == '__main__':
+    import sys
+    from bookapp import app
+    from bookapp.recommendations import recommender  # Bản mà app dùng (kể cả khi chạy bằng python -m)
+
+    # python -m bookapp.recommendations [build|status]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command not in ('build', 'status'):
+        sys.exit('Dùng: python -m bookapp.recommendations [build|status]')
+    with app.app_context():
+        if command == 'build':
+            recommender.rebuild()
+    print(json.dumps(recommender.stats(), ensure_ascii=False, indent=2))
@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from bookapp import db
+from bookapp.models import Regulation, RegulationVersion
+from bookapp.search import fold
+
+# Mã ổn định của các quy định mà hệ thống hiểu được
+MIN_IMPORT = 'MIN_IMPORT'
+MAX_STOCK = 'MAX_STOCK'
+MAX_CART_QTY = 'MAX_CART_QTY'
+
+RULE_CODES = {
+    MIN_IMPORT: 'Số lượng nhập tối thiểu',
+    MAX_STOCK: 'Số lượng tồn tối đa',
+    MAX_CART_QTY: 'Số lượng tối đa của một sản phẩm trong giỏ hàng',
+}
+
+# Quy định cũ chưa có mã: nhận diện theo tên (đã bỏ dấu)
+LEGACY_NAMES = {fold(name): code for code, name in RULE_CODES.items()}
+LEGACY_NAMES[fold('Số lượng tối đa trong giỏ')] = MAX_CART_QTY
+
+
+def rule_code(regulation):
+    return regulation.code or LEGACY_NAMES.get(fold(regulation.name).strip())
+
+
+class RuleSet:
+    """Bản chụp bất biến của các quy định đang hoạt động, có số phiên bản"""
+
+    def __init__(self, version, values):
+        self.version = version
+        self.values = values  # mã -> giá trị
+
+    def value(self, code, default=None):
+        return self.values.get(code, default)
+
+    def check_imports(self, items, stocks):
+        """Kiểm tra cả lô phiếu nhập theo thứ tự.
+        items: [(khóa dòng, khóa sách, số lượng)], stocks: {khóa sách: tồn kho hiện tại} (được cộng dồn).
+        Trả về {khóa dòng: thông báo lỗi}; dòng hợp lệ được cộng vào stocks."""
+        min_import = self.value(MIN_IMPORT)
+        max_stock = self.value(MAX_STOCK)
+        errors = {}
+        for key, book_key, quantity in items:
+            if min_import is not None and quantity < min_import:
+                errors[key] = f'Số lượng nhập phải lớn hơn hoặc bằng {min_import:g}!'
+                continue
+            current_stock = stocks.get(book_key, 0)
+            if max_stock is not None and current_stock + quantity > max_stock:
+                allowed = max_stock - current_stock
+                if allowed <= 0:
+                    errors[key] = f'Không thể nhập thêm sách vì đã đạt số lượng tồn tối đa ({max_stock:g})!'
+                else:
+                    errors[key] = f'Số lượng nhập vượt quá quy định! Bạn chỉ được phép nhập thêm {allowed:g} cuốn.'
+                continue
+            stocks[book_key] = current_stock + quantity
+        return errors
+
+    def check_cart(self, quantities):
+        """{mã sách: số lượng} -> {mã sách: thông báo lỗi} cho các dòng vượt số lượng tối đa"""
+        max_quantity = self.value(MAX_CART_QTY)
+        if max_quantity is None:
+            return {}
+        return {book_id: f'Mỗi sản phẩm chỉ được mua tối đa {max_quantity:g} cuốn!'
+                for book_id, qty in quantities.items() if qty > max_quantity}
+
+
+def _active_values():
+    values = {}
+    for regulation in Regulation.query.filter_by(is_active=True).order_by(Regulation.id):
+        code = rule_code(regulation)
+        if code and code not in values:
+            values[code] = float(regulation.value)
+    return values
+
+
+def _latest_version():
+    return db.session.query(RegulationVersion.id, RegulationVersion.rules) \
+        .order_by(RegulationVersion.id.desc()).first()
+
+
+def _save_version(values):
+    # Ghi bằng kết nối riêng để không commit giao dịch đang dở của request (ví dụ lúc thanh toán)
+    rules = json.dumps(values, sort_keys=True)
+    with db.engine.begin() as conn:
+        result = conn.execute(insert(RegulationVersion.__table__).values(created_date=datetime.now(), rules=rules))
+    return result.inserted_primary_key[0], rules
+
+
+class RegulationEngine:
+    """Giữ bản chụp quy định trong bộ nhớ. Mỗi lần quy định thay đổi (publish) một phiên bản mới
+    được lưu vào bảng regulation_version; tiến trình khác nhận ra phiên bản mới sau tối đa ttl giây."""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+            return snapshot
+
+        with self._lock:
+            latest = _latest_version()
+            if latest is None:
+                latest = _save_version(_active_values())
+            if self._snapshot is None or self._snapshot.version != latest[0]:
+                self._snapshot = RuleSet(latest[0], json.loads(latest[1]))
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def publish(self):
+        """Gọi sau khi thêm/sửa/xóa quy định đã commit: tạo phiên bản mới nếu tập quy định thay đổi"""
+        values = _active_values()
+        with self._lock:
+            latest = _latest_version()
+            if latest is None or json.loads(latest[1]) != values:
+                latest = _save_version(values)
+            self._snapshot = RuleSet(latest[0], json.loads(latest[1]))
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+
+regulation_engine = RegulationEngine()
+
+
+def snapshot():
+    return regulation_engine.snapshot()
+
+
+def ensure_schema():
+    """Nâng cấp CSDL đã có sẵn (xem migrations.py) rồi gán mã cho các quy định cũ"""
+    from bookapp import migrations
+
+    migrations.upgrade()
+
+    # Gán mã cho các quy định cũ nhận diện được theo tên
+    for regulation in Regulation.query.filter(Regulation.code.is_(None)).all():
+        code = LEGACY_NAMES.get(fold(regulation.name).strip())
+        if code and not Regulation.query.filter_by(code=code).first():
+            regulation.code = code
+            db.session.flush()
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    from bookapp import app
+
+    # python -m bookapp.regulations: cập nhật CSDL cũ và tạo phiên bản quy định đầu tiên
+    with app.app_context():
+        ensure_schema()
+        rules = regulation_engine.publish()
+        print(f'Phiên bản quy định {rules.version}: {rules.values}')
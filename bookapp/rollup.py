@@ -0,0 +1,171 @@
+from datetime import datetime
+from sqlalchemy import func, select, update, insert, delete
+from sqlalchemy.exc import SQLAlchemyError
+from bookapp import db
+from bookapp.models import Book, BookCategory, Receipt, ReceiptDetail, SalesRollup
+
+
+def month_range(month, year):
+    """[đầu tháng, đầu tháng sau) để lọc theo created_date mà vẫn dùng được chỉ mục"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def _upsert_statement(dialect):
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(SalesRollup)
+        return stmt.on_duplicate_key_update(quantity=SalesRollup.quantity + stmt.inserted.quantity,
+                                            revenue=SalesRollup.revenue + stmt.inserted.revenue,
+                                            line_count=SalesRollup.line_count + stmt.inserted.line_count)
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(SalesRollup)
+        return stmt.on_conflict_do_update(
+            index_elements=['year', 'month', 'category_id', 'book_id'],
+            set_={'quantity': SalesRollup.quantity + stmt.excluded.quantity,
+                  'revenue': SalesRollup.revenue + stmt.excluded.revenue,
+                  'line_count': SalesRollup.line_count + stmt.excluded.line_count})
+    return None
+
+
+def record_sale(created_date, lines):
+    """Cộng dồn một hóa đơn vào bảng tổng hợp, gọi TRƯỚC khi commit hóa đơn.
+    lines: [(book_id, category_id, số lượng, đơn giá)]. category_id chỉ là thể loại lúc bán (phần khóa của dòng),
+    thống kê luôn tính theo thể loại hiện tại của sách như rebuild và truy vấn trực tiếp."""
+    rows = [{'year': created_date.year,
+             'month': created_date.month,
+             'category_id': category_id,
+             'book_id': book_id,
+             'quantity': qty,
+             'revenue': qty * (unit_price or 0),
+             'line_count': 1} for book_id, category_id, qty, unit_price in lines]
+    if not rows:
+        return
+
+    stmt = _upsert_statement(db.session.get_bind().dialect.name)
+    if stmt is not None:
+        db.session.execute(stmt, rows)
+        return
+
+    # CSDL khác: cập nhật trước, dòng nào chưa có thì thêm mới
+    for row in rows:
+        result = db.session.execute(
+            update(SalesRollup)
+            .where(SalesRollup.year == row['year'],
+                   SalesRollup.month == row['month'],
+                   SalesRollup.category_id == row['category_id'],
+                   SalesRollup.book_id == row['book_id'])
+            .values(quantity=SalesRollup.quantity + row['quantity'],
+                    revenue=SalesRollup.revenue + row['revenue'],
+                    line_count=SalesRollup.line_count + 1)
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(SalesRollup), [row])
+
+
+def _rebuild(bind, year=None, month=None):
+    # Xóa rồi tính lại trên bind (session hoặc connection của migration), không commit
+    year_expr = func.extract('year', Receipt.created_date)
+    month_expr = func.extract('month', Receipt.created_date)
+    query = select(
+        year_expr,
+        month_expr,
+        Book.category_id,
+        ReceiptDetail.product_id,
+        func.sum(ReceiptDetail.quantity),
+        func.sum(ReceiptDetail.quantity * ReceiptDetail.unit_price),
+        func.count(ReceiptDetail.product_id)
+    ).join(Receipt, ReceiptDetail.receipt_id == Receipt.id
+    ).join(Book, ReceiptDetail.product_id == Book.id)
+
+    stale = delete(SalesRollup).execution_options(synchronize_session=False)
+    if year and month:
+        start, end = month_range(month, year)
+        query = query.where(Receipt.created_date >= start, Receipt.created_date < end)
+        stale = stale.where(SalesRollup.year == year, SalesRollup.month == month)
+    elif year:
+        query = query.where(Receipt.created_date >= datetime(year, 1, 1),
+                            Receipt.created_date < datetime(year + 1, 1, 1))
+        stale = stale.where(SalesRollup.year == year)
+
+    rows = bind.execute(query.group_by(year_expr, month_expr, Book.category_id, ReceiptDetail.product_id)).all()
+    bind.execute(stale)
+    if rows:
+        bind.execute(insert(SalesRollup), [{
+            'year': int(y),
+            'month': int(m),
+            'category_id': category_id,
+            'book_id': book_id,
+            'quantity': int(qty or 0),
+            'revenue': float(revenue or 0),
+            'line_count': int(count)
+        } for y, m, category_id, book_id, qty, revenue, count in rows])
+    return len(rows)
+
+
+def rebuild(year=None, month=None, bind=None):
+    """Tính lại bảng tổng hợp từ ReceiptDetail (toàn bộ, một năm hoặc một tháng);
+    bind: connection của migration, khi đó người gọi commit"""
+    if bind is not None:
+        return _rebuild(bind, year, month)
+    try:
+        count = _rebuild(db.session, year, month)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
+
+
+def stats_by_category(month, year):
+    """Doanh thu theo thể loại đọc từ bảng tổng hợp, None nếu tháng chưa có dữ liệu.
+    Gom theo thể loại hiện tại của sách (không theo SalesRollup.category_id lúc bán): sách đổi thể loại
+    thì cả doanh số cũ đi theo, giống kết quả của rebuild()."""
+    revenue = func.sum(SalesRollup.revenue)
+    try:
+        rows = db.session.query(
+            BookCategory.name,
+            revenue,
+            func.sum(SalesRollup.line_count),
+            func.round(revenue * 100.0 / func.sum(revenue).over(), 2)
+        ).join(Book, SalesRollup.book_id == Book.id
+        ).join(BookCategory, Book.category_id == BookCategory.id
+        ).filter(SalesRollup.year == year, SalesRollup.month == month
+        ).group_by(BookCategory.name).all()
+    except SQLAlchemyError:
+        db.session.rollback()  # Bảng chưa được tạo: dùng truy vấn trực tiếp
+        return None
+    return rows or None
+
+
+def stats_book_sold(month, year):
+    """Tần suất bán theo sách đọc từ bảng tổng hợp, None nếu tháng chưa có dữ liệu"""
+    quantity = func.sum(SalesRollup.quantity)
+    try:
+        rows = db.session.query(
+            Book.name,
+            BookCategory.name,
+            quantity,
+            func.round(quantity * 100.0 / func.sum(quantity).over(), 2)
+        ).join(Book, SalesRollup.book_id == Book.id
+        ).join(BookCategory, Book.category_id == BookCategory.id
+        ).filter(SalesRollup.year == year, SalesRollup.month == month
+        ).group_by(Book.name, BookCategory.name).all()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return None
+    return rows or None
+
+
+if __name__ == '__main__':
+    import sys
+    from bookapp import app
+
+    # python -m bookapp.rollup [năm [tháng]]
+    args = [int(a) for a in sys.argv[1:3]]
+    with app.app_context():
+        SalesRollup.__table__.create(bind=db.engine, checkfirst=True)
+        count = rebuild(*args)
+        print(f'Đã tổng hợp lại {count} dòng')
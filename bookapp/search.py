@@ -0,0 +1,234 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from sqlalchemy import text, desc, bindparam, or_, false
+from bookapp import app, db
+from bookapp.models import Book
+from bookapp.catalog import on_books_committed
+
+# Trọng số của từng trường khi chấm điểm kết quả
+FIELD_WEIGHTS = (('name', 3.0), ('author', 2.0), ('description', 1.0))
+PREFIX_FACTOR = 0.5  # Khớp tiền tố được tính điểm thấp hơn khớp nguyên từ
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Từ khóa rộng khớp rất nhiều sách: danh sách id được tách thành nhiều IN (...) ngắn,
+# tránh lỗi "too many SQL variables" của SQLite (~32k tham số)
+IN_CHUNK = 500
+
+
+def fold(value):
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường: 'Đắc Nhân Tâm' -> 'dac nhan tam'"""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFD', value.lower()).replace('đ', 'd')
+    return ''.join(ch for ch in value if not unicodedata.combining(ch))
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(fold(value))
+
+
+class SearchIndex:
+    """Chỉ mục đảo (inverted index) trong bộ nhớ trên tên, tác giả, mô tả sách"""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._postings = {}  # token -> {book_id: trọng số}
+        self._docs = {}  # book_id -> các token của sách
+        self._vocab = []  # danh sách token đã sắp xếp, dùng bisect để tìm tiền tố
+        self._built_at = None
+
+    def _ensure(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+            self.rebuild()
+
+    def rebuild(self):
+        rows = db.session.query(Book.id, Book.name, Book.author, Book.description).all()
+        with self._lock:
+            self._postings = {}
+            self._docs = {}
+            for book_id, name, author, description in rows:
+                self._add(book_id, name, author, description)
+            self._vocab = sorted(self._postings)
+            self._built_at = time.monotonic()
+
+    def _add(self, book_id, name, author, description):
+        weights = {}
+        for (field, weight), value in zip(FIELD_WEIGHTS, (name, author, description)):
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0) + weight
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[book_id] = weight
+        self._docs[book_id] = tuple(weights)
+        return weights
+
+    def _remove(self, book_id):
+        for token in self._docs.pop(book_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[token]
+                i = bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+
+    def update(self, book_id, name, author, description):
+        with self._lock:
+            if self._built_at is None:
+                return  # Chưa xây chỉ mục, lần tìm kiếm đầu tiên sẽ đọc dữ liệu mới nhất
+            self._remove(book_id)
+            for token in self._add(book_id, name, author, description):
+                i = bisect_left(self._vocab, token)
+                if i == len(self._vocab) or self._vocab[i] != token:
+                    self._vocab.insert(i, token)
+
+    def remove(self, book_id):
+        with self._lock:
+            if self._built_at is not None:
+                self._remove(book_id)
+
+    def _match_term(self, term, prefix):
+        # Trả về {book_id: điểm} cho một từ khóa, gồm cả các token bắt đầu bằng từ khóa
+        total = len(self._docs) or 1
+        scores = {}
+        tokens = [(term, 1.0)] if term in self._postings else []
+        if prefix:
+            i = bisect_left(self._vocab, term)
+            while i < len(self._vocab) and self._vocab[i].startswith(term):
+                if self._vocab[i] != term:
+                    tokens.append((self._vocab[i], PREFIX_FACTOR))
+                i += 1
+        for token, factor in tokens:
+            postings = self._postings[token]
+            idf = math.log(1 + total / len(postings))
+            for book_id, weight in postings.items():
+                score = weight * idf * factor
+                if score > scores.get(book_id, 0):
+                    scores[book_id] = score
+        return scores
+
+    def search(self, kw, limit=None, prefix=True):
+        """Trả về danh sách (book_id, điểm) đã xếp hạng, mọi từ khóa đều phải khớp"""
+        terms = tokenize(kw)
+        if not terms:
+            return []
+        with self._lock:
+            self._ensure()
+            result = None
+            for term in dict.fromkeys(terms):
+                scores = self._match_term(term, prefix)
+                if result is None:
+                    result = scores
+                else:
+                    result = {book_id: result[book_id] + score
+                              for book_id, score in scores.items() if book_id in result}
+                if not result:
+                    return []
+        ranked = sorted(result.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+    def stats(self):
+        return {
+            'documents': len(self._docs),
+            'tokens': len(self._postings),
+            'built': self._built_at is not None
+        }
+
+
+search_index = SearchIndex()
+
+
+def get_backend():
+    backend = app.config.get('SEARCH_BACKEND', 'index')
+    # FULLTEXT chỉ có trên MySQL, các CSDL khác dùng chỉ mục trong bộ nhớ
+    if backend == 'fulltext' and db.engine.dialect.name != 'mysql':
+        return 'index'
+    return backend
+
+
+def _chunks(ids):
+    return [ids[start:start + IN_CHUNK] for start in range(0, len(ids), IN_CHUNK)]
+
+
+def _ids_clause(ids):
+    # Id là số nguyên do chỉ mục sinh ra nên được viết thẳng vào câu SQL (literal_execute), không tốn tham số
+    if not ids:
+        return false()
+    return or_(*[Book.id.in_(bindparam(f'search_ids_{i}', chunk, expanding=True, literal_execute=True))
+                 for i, chunk in enumerate(_chunks(ids))])
+
+
+def _fulltext_clause():
+    return text("MATCH (book.name, book.author, book.description) AGAINST (:ft_query IN BOOLEAN MODE)")
+
+
+def _fulltext_query(kw):
+    # Mọi từ khóa đều bắt buộc (+) và cho phép khớp tiền tố (*)
+    return ' '.join(f'+{term}*' for term in TOKEN_RE.findall(kw.lower()))
+
+
+def filter_query(query, kw):
+    """Giới hạn một truy vấn Book theo từ khóa, không quan tâm thứ hạng"""
+    backend = get_backend()
+    if backend == 'like':
+        return query.filter(Book.name.ilike(f"%{kw}%"))
+    if backend == 'fulltext':
+        return query.filter(_fulltext_clause().bindparams(ft_query=_fulltext_query(kw)))
+    ids = [book_id for book_id, score in search_index.search(kw)]
+    return query.filter(_ids_clause(ids))
+
+
+def search_books(kw, category_id=None, limit=None):
+    """Tìm kiếm sách theo từ khóa, kết quả xếp theo mức độ phù hợp"""
+    if not kw or not kw.strip():
+        return []
+    backend = get_backend()
+    query = Book.query
+    if category_id:
+        query = query.filter(Book.category_id == category_id)
+
+    if backend == 'like':
+        query = query.filter(Book.name.ilike(f"%{kw}%"))
+        return query.limit(limit).all() if limit else query.all()
+
+    if backend == 'fulltext':
+        clause = _fulltext_clause().bindparams(ft_query=_fulltext_query(kw))
+        query = query.filter(clause).order_by(desc(clause))
+        return query.limit(limit).all() if limit else query.all()
+
+    ranked = search_index.search(kw)
+    result = []
+    # Nạp theo thứ hạng từng đoạn id, bộ lọc danh mục nằm trong cùng câu truy vấn;
+    # đủ limit sách thì dừng, không nạp phần còn lại
+    for chunk in _chunks([book_id for book_id, score in ranked]):
+        books = {b.id: b for b in query.filter(Book.id.in_(chunk)).all()}
+        result.extend(books[book_id] for book_id in chunk if book_id in books)
+        if limit and len(result) >= limit:
+            return result[:limit]
+    return result
+
+
+def create_fulltext_index():
+    # Tạo chỉ mục FULLTEXT cho MySQL (chạy một lần khi chuyển sang backend 'fulltext')
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE book ADD FULLTEXT INDEX ft_book_text (name, author, description)"))
+
+
+@on_books_committed
+def _apply_book_changes(changes):
+    # Cập nhật chỉ mục theo từng thay đổi đã commit của bảng book
+    for book_id, values in changes.items():
+        if values is None:
+            search_index.remove(book_id)
+        else:
+            search_index.update(book_id, values['name'], values['author'], values['description'])
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        create_fulltext_index()
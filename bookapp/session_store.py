@@ -0,0 +1,380 @@
+import os
+import pickle
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from bookapp.cache import LRUCache
+
+SID_RE = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+
+class SessionStore:
+    """Lớp cơ sở cho nơi lưu session phía server, kèm bộ đếm đọc/ghi"""
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.misses = 0
+        self.swept = 0
+
+    def load(self, sid):
+        """Trả về (dữ liệu, hết hạn lúc) hoặc None"""
+        raise NotImplementedError
+
+    def save(self, sid, data, ttl):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sweep(self):
+        """Xóa các session đã hết hạn, trả về số session bị xóa"""
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            'backend': type(self).__name__,
+            'reads': self.reads,
+            'writes': self.writes,
+            'deletes': self.deletes,
+            'misses': self.misses,
+            'swept': self.swept,
+            'size': self.size()
+        }
+
+
+class MemorySessionStore(SessionStore):
+    # Chỉ phù hợp khi chạy một tiến trình: session mất khi khởi động lại
+    def __init__(self, max_size=10000):
+        super().__init__()
+        self._cache = LRUCache(max_size=max_size)
+
+    def load(self, sid):
+        self.reads += 1
+        item = self._cache.get(sid)
+        if item is None or item[1] <= time.time():
+            self.misses += 1
+            return None
+        return pickle.loads(item[0]), item[1]
+
+    def save(self, sid, data, ttl):
+        self.writes += 1
+        # Lưu bản đã tuần tự hóa để các request không dùng chung đối tượng
+        self._cache.set(sid, (pickle.dumps(dict(data)), time.time() + ttl), ttl=ttl)
+
+    def delete(self, sid):
+        self.deletes += 1
+        self._cache.delete(sid)
+
+    def sweep(self):
+        count = self._cache.sweep()
+        self.swept += count
+        return count
+
+    def size(self):
+        return len(self._cache)
+
+    def stats(self):
+        result = super().stats()
+        result['evictions'] = self._cache.evictions
+        return result
+
+
+class FileSystemSessionStore(SessionStore):
+    # Mỗi session là một file; thời điểm hết hạn = thời điểm ghi cuối + ttl
+    def __init__(self, directory, ttl):
+        super().__init__()
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        self.reads += 1
+        path = self._path(sid)
+        try:
+            expires_at = os.path.getmtime(path) + self.ttl
+            if expires_at <= time.time():
+                self.misses += 1
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f), expires_at
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            self.misses += 1
+            return None
+
+    def save(self, sid, data, ttl):
+        self.writes += 1
+        # Ghi ra file tạm rồi đổi tên để không bao giờ đọc phải file ghi dở
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(dict(data), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(sid))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def delete(self, sid):
+        self.deletes += 1
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def sweep(self):
+        deadline = time.time() - self.ttl
+        count = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < deadline:
+                        os.remove(entry.path)
+                        count += 1
+                except OSError:
+                    pass
+        self.swept += count
+        return count
+
+    def size(self):
+        try:
+            return sum(1 for entry in os.scandir(self.directory) if entry.is_file())
+        except OSError:
+            return 0
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                           'sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)')
+
+    def load(self, sid):
+        self.reads += 1
+        with self._lock:
+            row = self._conn.execute('SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?',
+                                     (sid, time.time())).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def save(self, sid, data, ttl):
+        self.writes += 1
+        blob = pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                               (sid, blob, time.time() + ttl))
+
+    def delete(self, sid):
+        self.deletes += 1
+        with self._lock:
+            self._conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def sweep(self):
+        with self._lock:
+            count = self._conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+        self.swept += count
+        return count
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+class LazySession(SessionMixin):
+    """Session chỉ đọc từ nơi lưu khi được truy cập lần đầu"""
+
+    def __init__(self, sid, store, new=False):
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.expires_at = None
+        self.previous_sid = None  # Mã cũ cần xóa khỏi store sau khi đổi mã (xem regenerate)
+        self._store = store
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _load(self):
+        self.accessed = True
+        if self._data is None:
+            item = None if self.new else self._store.load(self.sid)
+            if item is None:
+                self._data = {}
+            else:
+                self._data, self.expires_at = item
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+    def clear(self):
+        if self._load():
+            self._data.clear()
+            self.modified = True
+
+    def data(self):
+        return dict(self._load())
+
+    def regenerate(self):
+        """Đổi sang mã session mới, giữ dữ liệu (chống cố định session khi đăng nhập/đăng xuất)"""
+        self._load()
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Session phía server: cookie chỉ chứa mã session đã ký, dữ liệu nằm trong store.
+    Không đọc nếu request không đụng tới session, chỉ ghi khi session thay đổi."""
+
+    def __init__(self, store, sweep_interval=600):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='bookapp-session')
+
+    def _start_sweeper(self, app):
+        if self._sweeper is not None or not self.sweep_interval:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.sweep_interval)
+                    try:
+                        self.store.sweep()
+                    except Exception:
+                        app.logger.exception('Dọn session hết hạn thất bại')
+
+            self._sweeper = threading.Thread(target=run, name='session-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def open_session(self, app, request):
+        self._start_sweeper(app)
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+                if SID_RE.match(sid):
+                    return LazySession(sid, self.store)
+            except BadSignature:
+                pass
+        return LazySession(secrets.token_urlsafe(32), self.store, new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.loaded:
+            return  # Request không dùng session: không đọc, không ghi
+
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)  # Mã cũ (có thể do kẻ khác cài sẵn) hết hiệu lực
+
+        if not session.data():
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+            if session.modified and (not session.new or session.previous_sid is not None):
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        # Gia hạn session đã dùng quá nửa thời gian sống dù không có thay đổi
+        stale = session.expires_at is not None and session.expires_at - time.time() < ttl / 2
+        if not (session.modified or stale):
+            return
+
+        self.store.save(session.sid, session.data(), ttl)
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode('ascii'),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain,
+                            path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    def stats(self):
+        return self.store.stats()
+
+
+def create_store(app):
+    backend = app.config.get('SESSION_BACKEND', 'filesystem')
+    ttl = app.permanent_session_lifetime.total_seconds()
+    if backend == 'memory':
+        return MemorySessionStore(max_size=app.config.get('SESSION_MEMORY_MAX_SIZE', 10000))
+    if backend == 'sqlite':
+        return SQLiteSessionStore(app.config['SESSION_SQLITE_PATH'])
+    return FileSystemSessionStore(app.config['SESSION_DIR'], ttl)
+
+
+def _regenerate_session(sender, **extra):
+    from flask import session
+    if isinstance(session, LazySession):
+        session.regenerate()
+
+
+def init_session_store(app):
+    if app.config.get('SESSION_BACKEND', 'filesystem') == 'cookie':
+        return None  # Giữ session cookie mặc định của Flask
+    from flask_login import user_logged_in, user_logged_out
+    app.session_interface = ServerSessionInterface(create_store(app),
+                                                   sweep_interval=app.config.get('SESSION_SWEEP_INTERVAL', 600))
+    # Mã session đổi mỗi khi quyền thay đổi: mã có trước khi đăng nhập không dùng được sau đó
+    user_logged_in.connect(_regenerate_session, app)
+    user_logged_out.connect(_regenerate_session, app)
+    return app.session_interface
@@ -10,6 +10,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Cart functionality
     initializeCartButtons();
 
+    // Tồn kho không nằm trong trang đã lưu đệm, lấy riêng theo id sách
+    loadStock();
+
     // Modal functionality
     initializeModal();
 
@@ -325,6 +328,22 @@ function deleteFromCart(productId) {
     });
 }
 
+function loadStock() {
+    const cells = document.querySelectorAll('.book-stock');
+    if (!cells.length) {
+        return;
+    }
+    const ids = Array.from(new Set(Array.from(cells, cell => cell.dataset.id)));
+    fetch('/api/stock?ids=' + ids.join(','))
+        .then(response => response.json())
+        .then(res => {
+            cells.forEach(cell => {
+                const stock = res.data[cell.dataset.id];
+                cell.innerText = stock === undefined ? 0 : stock;
+            });
+        });
+}
+
 function formatPrice(price) {
     return price.toLocaleString('en-US', {
         minimumFractionDigits: 1,
@@ -0,0 +1,376 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from itertools import islice
+from sqlalchemy import func
+from bookapp import db
+from bookapp.models import Book, ReceiptDetail
+from bookapp.catalog import on_books_committed
+from bookapp.search import fold
+
+BOOK, AUTHOR = 'book', 'author'
+MAX_K = 20  # Số gợi ý tối đa của /api/suggest
+# Tiền tố khớp nhiều hơn ngần này khóa ("nặng", ví dụ 'a', 'hoc') được tính sẵn top-k khi dựng lại;
+# tiền tố khác duyệt tối đa ngần ấy khóa lúc gợi ý
+MAX_SCAN = 2000
+END = '\uffff'  # Lớn hơn mọi ký tự trong khóa đã bỏ dấu: [prefix, prefix + END) là mọi khóa bắt đầu bằng prefix
+TOP_KEEP = 4 * MAX_K  # Số mục giữ sẵn cho mỗi tiền tố nặng: mục bị giảm điểm chưa bắt phải duyệt lại ngay
+COMPACT_MIN = 256  # Phần chênh lệch vượt max(COMPACT_MIN, số khóa / 16) thì gộp vào mảng khóa
+
+
+class _State:
+    # Bản chỉ đọc: gợi ý đọc không cần khóa, cập nhật tạo bản mới rồi thay cả bản.
+    # Mảng khóa lúc dựng lại không bị sao chép khi sách thay đổi: phần chênh lệch (thêm, xóa, sách đổi)
+    # nằm riêng và nhỏ, chỉ gộp vào mảng khóa khi đủ lớn (_compact).
+    __slots__ = ('keys', 'added', 'removed', 'books', 'changed', 'top', 'memo')
+
+    def __init__(self, keys, books, added, removed, changed, top, memo):
+        self.keys = keys  # [(khóa đã bỏ dấu, book_id, loại)] đã sắp xếp, từ lần dựng lại/gộp gần nhất
+        self.books = books  # book_id -> (tên, tác giả, độ phổ biến)
+        self.added = added  # khóa thêm sau đó, đã sắp xếp, không trùng với keys
+        self.removed = removed  # frozenset các khóa của keys đã bị xóa
+        self.changed = changed  # book_id -> (tên, tác giả, độ phổ biến) mới, None nếu sách bị xóa
+        self.top = top  # tiền tố nặng -> (TOP_KEEP gợi ý đã xếp hạng, mốc: mọi mục khác xếp sau mốc, None: đủ cả)
+        self.memo = memo  # (tiền tố, k) -> kết quả, chỉ dùng cho bản này
+
+    def info(self, book_id):
+        if book_id in self.changed:
+            return self.changed[book_id]
+        return self.books.get(book_id)
+
+    def scan(self, prefix, upper=None):
+        """Các khóa trong [prefix, upper) (mặc định: mọi khóa bắt đầu bằng prefix) theo thứ tự:
+        gộp keys với added, bỏ các khóa đã xóa"""
+        entries = map(self.keys.__getitem__, _span(self.keys, prefix, upper))
+        if self.added:
+            entries = heapq.merge(entries, map(self.added.__getitem__, _span(self.added, prefix, upper)))
+        for entry in entries:
+            if entry not in self.removed:
+                yield entry
+
+    def count(self, prefix):
+        return len(_span(self.keys, prefix)) + len(_span(self.added, prefix)) \
+            - sum(1 for entry in self.removed if entry[0].startswith(prefix))
+
+    def size(self):
+        return len(self.keys) + len(self.added) - len(self.removed)
+
+    def book_count(self):
+        return len(self.books) + sum((info is not None) - (book_id in self.books)
+                                     for book_id, info in self.changed.items())
+
+    def overlay(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+
+def _span(keys, prefix, upper=None):
+    return range(bisect_left(keys, (prefix,)), bisect_left(keys, (upper or prefix + END,)))
+
+
+def _collect(state, prefix, limit=None):
+    """Điểm của các sách/tác giả có khóa bắt đầu bằng prefix (duyệt tối đa limit khóa)"""
+    matched, authors = {}, {}
+    for key, book_id, kind in islice(state.scan(prefix), limit):
+        name, author, popularity = state.info(book_id)
+        if kind == BOOK:
+            matched[book_id] = popularity
+        else:
+            authors[author] = authors.get(author, 0) + popularity
+    return matched, authors
+
+
+def _order(item):
+    # Điểm cao trước; cùng điểm thì sách trước tác giả, id/tên nhỏ trước
+    if item['type'] == BOOK:
+        return -item['score'], 0, item['id']
+    return -item['score'], 1, item['name']
+
+
+def _book_item(book_id, name, author, score):
+    return {'type': BOOK, 'id': book_id, 'name': name, 'author': author, 'score': score}
+
+
+def _rank(state, matched, authors, k):
+    top_books = heapq.nsmallest(k, matched.items(), key=lambda item: (-item[1], item[0]))
+    top_authors = heapq.nsmallest(k, authors.items(), key=lambda item: (-item[1], item[0]))
+    result = [_book_item(book_id, *state.info(book_id)[:2], score) for book_id, score in top_books]
+    result += [{'type': AUTHOR, 'name': author, 'score': score} for author, score in top_authors]
+    return sorted(result, key=_order)[:k]
+
+
+def _entries(book_id, name, author):
+    words = fold(name).split()
+    for i in range(len(words)):
+        yield ' '.join(words[i:]), book_id, BOOK
+    if author:
+        yield fold(author), book_id, AUTHOR
+
+
+def _item_key(item):
+    return item['type'], item['id'] if item['type'] == BOOK else item['name']
+
+
+def _current_items(state, prefix, book_ids, authors):
+    """{khóa mục: mục hiện tại, None nếu không còn khớp prefix} của các sách/tác giả vừa đổi"""
+    items = {}
+    for book_id in book_ids:
+        info = state.info(book_id)
+        match = info is not None and any(kind == BOOK and key.startswith(prefix)
+                                         for key, _, kind in _entries(book_id, info[0], info[1]))
+        items[(BOOK, book_id)] = _book_item(book_id, info[0], info[1], info[2]) if match else None
+    for author in authors:
+        key = fold(author)
+        # Điểm tác giả = tổng độ phổ biến các sách có đúng khóa tác giả này
+        scores = [state.info(book_id)[2] for _, book_id, kind in state.scan(key, key + '\0')
+                  if kind == AUTHOR and state.info(book_id)[1] == author] if key.startswith(prefix) else []
+        items[(AUTHOR, author)] = {'type': AUTHOR, 'name': author, 'score': sum(scores)} if scores else None
+    return items
+
+
+def _top(state, prefix):
+    ranked = _rank(state, *_collect(state, prefix), TOP_KEEP + 1)
+    if len(ranked) > TOP_KEEP:
+        return ranked[:TOP_KEEP], _order(ranked[TOP_KEEP])
+    return ranked, None
+
+
+def _merge_top(state, prefix, book_ids, authors):
+    """Top mới của một tiền tố nặng từ danh sách giữ sẵn và các mục vừa đổi: mục chưa có trong danh sách
+    luôn xếp sau mốc nên chỉ giữ lại các mục xếp trước mốc; còn dưới MAX_K mục thì mới duyệt lại cả tiền tố."""
+    if prefix in state.top:
+        ranked, bound = state.top[prefix]
+        items = {_item_key(item): item for item in ranked}
+        for item_key, item in _current_items(state, prefix, book_ids, authors).items():
+            if item is None:
+                items.pop(item_key, None)
+            else:
+                items[item_key] = item
+        ranked = sorted(items.values(), key=_order)
+        if bound is not None:
+            ranked = [item for item in ranked if _order(item) < bound]
+        if len(ranked) > TOP_KEEP:
+            ranked, bound = ranked[:TOP_KEEP], _order(ranked[TOP_KEEP])
+        if len(ranked) >= MAX_K or bound is None:
+            return ranked, bound
+    return _top(state, prefix)
+
+
+def _compact(state):
+    """Gộp phần chênh lệch vào mảng khóa (một lượt trộn tuyến tính)"""
+    keys = [entry for entry in heapq.merge(state.keys, state.added) if entry not in state.removed]
+    books = dict(state.books)
+    for book_id, info in state.changed.items():
+        if info is None:
+            books.pop(book_id, None)
+        else:
+            books[book_id] = info
+    return _State(keys, books, [], frozenset(), {}, state.top, state.memo)
+
+
+def _heavy_prefixes(keys):
+    """Các tiền tố khớp hơn MAX_SCAN khóa: mỗi độ dài chỉ có tối đa len(keys) / MAX_SCAN tiền tố như vậy,
+    tiền tố dài hơn chỉ cần tìm trong đoạn của tiền tố nặng ngắn hơn"""
+    heavy = set()
+    ranges = [(0, len(keys))]
+    length = 1
+    while ranges:
+        deeper = []
+        for i, end in ranges:
+            while i < end:
+                key = keys[i][0]
+                if len(key) < length:
+                    i += 1
+                    continue
+                prefix = key[:length]
+                j = bisect_left(keys, (prefix + END,), i, end)
+                if j - i > MAX_SCAN:
+                    deeper.append((i, j))
+                    if not prefix.endswith(' '):  # Từ khóa tìm kiếm đã được cắt khoảng trắng
+                        heavy.add(prefix)
+                i = j
+        ranges = deeper
+        length += 1
+    return heavy
+
+
+class Suggester:
+    """Gợi ý tên sách/tác giả theo tiền tố, dựa trên mảng khóa đã sắp xếp + bisect.
+    Mỗi từ trong tên sách cũng là một điểm bắt đầu ('nhan' -> 'Đắc Nhân Tâm')"""
+
+    def __init__(self, ttl=600, memo_size=4096):
+        self.ttl = ttl
+        self.memo_size = memo_size
+        self._lock = threading.Lock()  # Chỉ giữ khi dựng lại/cập nhật, gợi ý không chờ khóa
+        self._state = None
+        self._popularity = {}  # book_id -> tổng số lượng đã bán
+        self._built_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure(self):
+        state = self._state
+        if state is not None and time.monotonic() - self._built_at <= self.ttl:
+            return state
+        # Hết hạn: một luồng dựng lại, các luồng khác tạm dùng bản cũ
+        if self._lock.acquire(blocking=state is None):
+            try:
+                if self._state is state:
+                    self._build()
+            finally:
+                self._lock.release()
+        return self._state
+
+    def rebuild(self):
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        # Độ phổ biến = tổng số lượng bán của sách trong ReceiptDetail
+        popularity = dict(db.session.query(ReceiptDetail.product_id, func.sum(ReceiptDetail.quantity))
+                          .group_by(ReceiptDetail.product_id).all())
+        rows = db.session.query(Book.id, Book.name, Book.author).all()
+        keys = []
+        books = {}
+        for book_id, name, author in rows:
+            books[book_id] = (name, author, int(popularity.get(book_id) or 0))
+            keys.extend(_entries(book_id, name, author))
+        keys.sort()
+        state = _State(keys, books, [], frozenset(), {}, {}, {})
+        for prefix in _heavy_prefixes(keys):
+            state.top[prefix] = _top(state, prefix)
+        self._popularity = popularity
+        self._state = state
+        self._built_at = time.monotonic()
+
+    def _publish(self, state, touched, book_ids, authors):
+        # Cập nhật top-k các tiền tố nặng, bỏ kết quả lưu đệm có tiền tố của khóa đã đổi,
+        # gộp phần chênh lệch vào mảng khóa khi đủ lớn
+        prefixes = set()
+        for key in touched:
+            for length in range(1, len(key) + 1):
+                prefix = key[:length]
+                if prefix not in state.top and state.count(prefix) <= MAX_SCAN:
+                    break  # Tiền tố dài hơn còn khớp ít khóa hơn
+                prefixes.add(prefix)
+        for prefix in prefixes:
+            if state.count(prefix) <= MAX_SCAN or prefix.endswith(' '):
+                state.top.pop(prefix, None)
+            else:
+                state.top[prefix] = _merge_top(state, prefix, book_ids, authors)
+        state.memo = {memo_key: result for memo_key, result in list(self._state.memo.items())
+                      if not any(key.startswith(memo_key[0]) for key in touched)}
+        if state.overlay() > max(COMPACT_MIN, len(state.keys) // 16):
+            state = _compact(state)
+        self._state = state
+
+    def apply(self, changes):
+        """changes: {book_id: (tên, tác giả) hoặc None nếu bị xóa}. Chỉ sao chép phần chênh lệch (không sao chép
+        mảng khóa), cập nhật top-k các tiền tố nặng có liên quan tới khóa của những sách thay đổi."""
+        with self._lock:
+            state = self._state
+            if state is None:
+                return
+            added, removed, changed = list(state.added), set(state.removed), dict(state.changed)
+            touched, authors = set(), set()
+            for book_id, values in changes.items():
+                old = state.info(book_id)
+                if old is not None:
+                    authors.add(old[1])
+                    for entry in _entries(book_id, old[0], old[1]):
+                        i = bisect_left(added, entry)
+                        if i < len(added) and added[i] == entry:
+                            del added[i]
+                        else:
+                            removed.add(entry)
+                        touched.add(entry[0])
+                if values is None:
+                    changed[book_id] = None
+                    continue
+                name, author = values
+                authors.add(author)
+                popularity = old[2] if old is not None else int(self._popularity.get(book_id) or 0)
+                changed[book_id] = (name, author, popularity)
+                for entry in _entries(book_id, name, author):
+                    if entry in removed:
+                        removed.discard(entry)
+                    else:
+                        insort(added, entry)
+                    touched.add(entry[0])
+
+            state = _State(state.keys, state.books, added, frozenset(removed), changed, dict(state.top), {})
+            self._publish(state, touched, list(changes), authors - {None})
+
+    def sold(self, quantities):
+        """Cộng độ phổ biến ngay khi có hóa đơn (không chờ dựng lại). quantities: {book_id: số lượng}"""
+        with self._lock:
+            state = self._state
+            if state is None:
+                return
+            changed = dict(state.changed)
+            touched, authors, book_ids = set(), set(), []
+            for book_id, qty in quantities.items():
+                info = state.info(book_id)
+                self._popularity[book_id] = int(self._popularity.get(book_id) or 0) + qty
+                if info is None or not qty:
+                    continue
+                name, author, popularity = info
+                changed[book_id] = (name, author, popularity + qty)
+                touched.update(key for key, _, _ in _entries(book_id, name, author))
+                book_ids.append(book_id)
+                if author:
+                    authors.add(author)
+            if book_ids:
+                state = _State(state.keys, state.books, state.added, state.removed, changed, dict(state.top), {})
+                self._publish(state, touched, book_ids, authors)
+
+    def update(self, book_id, name, author):
+        self.apply({book_id: (name, author)})
+
+    def remove(self, book_id):
+        self.apply({book_id: None})
+
+    def suggest(self, kw, k=8):
+        """Trả về tối đa k gợi ý, sách bán chạy đứng trước"""
+        prefix = ' '.join(fold(kw).split())
+        if not prefix:
+            return []
+        state = self._ensure()
+        if prefix in state.top and k <= MAX_K:
+            self.hits += 1
+            return state.top[prefix][0][:k]
+
+        memo_key = (prefix, k)
+        result = state.memo.get(memo_key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+
+        result = _rank(state, *_collect(state, prefix, MAX_SCAN), k)
+        if len(state.memo) >= self.memo_size:
+            state.memo.clear()
+        state.memo[memo_key] = result
+        return result
+
+    def stats(self):
+        state = self._state
+        total = self.hits + self.misses
+        return {
+            'keys': state.size() if state else 0,
+            'books': state.book_count() if state else 0,
+            'overlay': state.overlay() if state else 0,
+            'heavy_prefixes': len(state.top) if state else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0
+        }
+
+
+suggester = Suggester()
+
+
+@on_books_committed
+def _apply_book_changes(changes):
+    suggester.apply({book_id: None if values is None else (values['name'], values['author'])
+                     for book_id, values in changes.items()})
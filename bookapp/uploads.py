@@ -0,0 +1,87 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from werkzeug.utils import secure_filename
+from bookapp import app, db
+from bookapp.models import User
+
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+UPLOAD_ATTEMPTS = 3
+
+
+class LocalStorage:
+    """Lưu file trong thư mục static/uploads (thay cho Cloudinary khi chạy cục bộ/thử nghiệm),
+    tên file là mã băm nội dung nên tải lại cùng một ảnh không tạo thêm file"""
+
+    def __init__(self, root, url_prefix):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def upload(self, path, folder):
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:24]
+        name = f'{digest}{os.path.splitext(path)[1].lower()}'
+        target_dir = os.path.join(self.root, folder)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, name)
+        if not os.path.exists(target):
+            tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        return f'{self.url_prefix}/{folder}/{name}'
+
+
+class CloudinaryStorage:
+    def upload(self, path, folder):
+        import cloudinary.uploader
+        return cloudinary.uploader.upload(path, folder=folder)['secure_url']
+
+
+def get_storage():
+    if app.config.get('UPLOAD_STORAGE') == 'local':
+        return LocalStorage(app.config['UPLOAD_DIR'], app.static_url_path + '/uploads')
+    return CloudinaryStorage()
+
+
+def spool_dir():
+    path = os.path.join(app.config['JOB_ARTIFACT_DIR'], 'upload-spool')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue_avatar(user_id, file):
+    """Lưu tạm ảnh đại diện trên đĩa rồi giao cho hàng đợi nền tải lên (request không chờ mạng)"""
+    ext = os.path.splitext(secure_filename(file.filename or ''))[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        return None
+    path = os.path.join(spool_dir(), f'{uuid.uuid4().hex}{ext}')
+    file.save(path)
+
+    from bookapp import jobs
+    return jobs.get_queue().submit('upload-avatar', {'user_id': user_id, 'spool': os.path.basename(path)},
+                                   user_id=user_id)
+
+
+def upload_avatar_job(params, path):
+    """Chạy trong hàng đợi: tải ảnh lên kho lưu trữ (thử lại khi lỗi mạng), ghi URL vào user.avatar.
+    Không tạo file kết quả; file tạm luôn bị xóa dù tải lên thành công hay không."""
+    spool = os.path.join(spool_dir(), os.path.basename(params['spool']))
+    try:
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                url = get_storage().upload(spool, 'avatars')
+                break
+            except Exception:
+                if attempt == UPLOAD_ATTEMPTS:
+                    raise
+                time.sleep(2 ** attempt)
+        user = db.session.get(User, params['user_id'])
+        if user is not None:
+            user.avatar = url
+            db.session.commit()
+    finally:
+        if os.path.exists(spool):
+            os.remove(spool)
+    return None
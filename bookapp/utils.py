@@ -1,30 +1,63 @@
-import openpyxl
-from openpyxl.utils import get_column_letter
-from sqlalchemy import func
-from bookapp.models import BookCategory, Book, User, Receipt, ReceiptDetail, UserRole, DeliveryMethod, PaymentMethod
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import joinedload
+from bookapp.models import BookCategory, Book, User, Receipt, ReceiptDetail, UserRole, DeliveryMethod, PaymentMethod, \
+    Regulation, ImportEntry
 from bookapp import app, db
+from bookapp.catalog import category_catalog
+from bookapp.page_cache import page_cache
+from bookapp.principals import principal_cache
+from bookapp.recommendations import recommender
+from bookapp.analytics import sales_analytics, GRANULARITIES
+from bookapp.ledger import stock_ledger
+from bookapp import search, checkout, rollup
+from bookapp.suggest import suggester
+from bookapp.cart import Cart
+from bookapp.database import read_only
 from flask_login import  current_user
 import hashlib
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
+import base64
+import json
+from datetime import datetime, timedelta
+from math import ceil
 
 
 
 def load_book_categories():
-    categories = BookCategory.query.order_by('id').all()
-    if not categories:
-        return []  # Đảm bảo trả về danh sách rỗng nếu không có danh mục
-    for category in categories:
-        category.product_count = Book.query.filter(Book.category_id == category.id).count()
-    return categories
+    # Lấy từ bộ nhớ đệm, chỉ truy vấn lại CSDL khi sách/danh mục thay đổi
+    return list(category_catalog.load())
 
 
+def invalidate_book_categories():
+    category_catalog.invalidate()
+    page_cache.bump()
 
+
+def category_catalog_stats():
+    return category_catalog.stats()
+
+
+def page_cache_stats():
+    return page_cache.stats()
+
+
+
+@read_only
 def load_books(kw: object = None) -> object:
-    products = Book.query
     if kw:
-        products = products.filter(Book.name.contains(kw))
-    return products.all()
+        return search.search_books(kw)
+    return Book.query.all()
+
+
+def load_stock(book_ids):
+    # Tồn kho không nằm trong trang/fragment được lưu đệm, luôn đọc mới từ CSDL chính
+    if not book_ids:
+        return {}
+    return dict(db.session.query(Book.id, Book.stock).filter(Book.id.in_(book_ids)).all())
+
+
+@read_only
+def get_book_by_id(book_id):
+    return Book.query.options(joinedload(Book.category)).filter(Book.id == book_id).first()
 
 
 def add_user(name, username, password, **kwargs):
@@ -36,23 +69,259 @@ def add_user(name, username, password, **kwargs):
                 avatar=kwargs.get('avatar'))
     db.session.add(user)
     db.session.commit()
+    return user
 
-def search_books(kw):
+@read_only
+def search_books(kw, category_id=None):
     if not kw:
         return []
-    # Bỏ khoảng trắng thừa, chuyển về chữ thường, tìm kiếm
-    return Book.query.filter(
-        Book.name.ilike(f"%{kw}%")
-    ).all()
+    # Tìm trên tên, tác giả, mô tả (không phân biệt dấu), kết quả đã xếp hạng
+    return search.search_books(kw.strip(), category_id=category_id)
+
+def suggest_books(kw, limit=8):
+    # Gợi ý tên sách/tác giả cho ô tìm kiếm, phục vụ hoàn toàn từ bộ nhớ
+    return suggester.suggest(kw, k=limit)
 
+@read_only
 def load_books_by_category(category_id):
     return Book.query.filter(Book.category_id == category_id).all()
 
-def load_book_categories():
-    categories = BookCategory.query.order_by('id').all()
-    for category in categories:
-        category.product_count = Book.query.filter(Book.category_id == category.id).count()
-    return categories
+
+# Các kiểu sắp xếp cho phân trang: tên tham số -> cột trong bảng book
+BOOK_SORTS = {
+    'id': Book.id,
+    'name': Book.name,
+    'price': Book.price,
+    'created_date': Book.created_date
+}
+
+# Các lựa chọn hiển thị trên trang danh sách sản phẩm: (sort, direction, nhãn)
+BOOK_SORT_OPTIONS = [
+    ('id', 'asc', 'Mặc định'),
+    ('created_date', 'desc', 'Mới nhất'),
+    ('price', 'asc', 'Giá tăng dần'),
+    ('price', 'desc', 'Giá giảm dần'),
+    ('name', 'asc', 'Tên A-Z')
+]
+
+
+class KeysetPage:
+    def __init__(self, items, page, per_page, total, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.total_pages = max(1, ceil(total / per_page)) if total is not None else None
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    """Phân trang kiểu keyset (seek) trên cặp (cột sắp xếp, id) với con trỏ mờ,
+    không dùng OFFSET nên trang sâu vẫn nhanh như trang đầu"""
+
+    def __init__(self, query, sort='id', direction='asc', per_page=6, count=None):
+        if sort not in BOOK_SORTS:
+            sort = 'id'
+        self.query = query
+        self.sort = sort
+        self.column = BOOK_SORTS[sort]
+        self.descending = direction == 'desc'
+        self.per_page = per_page
+        # Hàm đếm tổng (thường là bản đã lưu đệm), None nếu không cần tổng số trang
+        self.count = count
+
+    def encode_cursor(self, book, page, backward=False):
+        value = getattr(book, self.sort)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        raw = json.dumps([self.sort, value, book.id, page, 1 if backward else 0])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            sort, value, last_id, page, backward = json.loads(raw)
+            if sort != self.sort:
+                return None  # Con trỏ của kiểu sắp xếp khác -> quay về trang đầu
+            if value is not None and self.sort == 'created_date':
+                value = datetime.fromisoformat(value)
+            return value, int(last_id), max(1, int(page)), bool(backward)
+        except (ValueError, TypeError):
+            return None
+
+    def _seek(self, value, last_id, forward):
+        # forward=True: lấy các dòng đứng SAU (value, last_id) theo thứ tự hiển thị
+        col = self.column
+        greater = forward != self.descending
+        if col is Book.id:
+            return Book.id > last_id if greater else Book.id < last_id
+        # MySQL/SQLite xếp NULL nhỏ nhất: đứng đầu khi tăng dần, cuối khi giảm dần
+        if value is None:
+            tie = Book.id > last_id if greater else Book.id < last_id
+            if greater:
+                return or_(col.isnot(None), and_(col.is_(None), tie))
+            return and_(col.is_(None), tie)
+        if greater:
+            return or_(col > value, and_(col == value, Book.id > last_id))
+        return or_(col < value, and_(col == value, Book.id < last_id), col.is_(None))
+
+    def _ordered(self, query, forward):
+        descending = self.descending != (not forward)
+        if self.column is Book.id:
+            return query.order_by(Book.id.desc() if descending else Book.id.asc())
+        if descending:
+            return query.order_by(self.column.desc(), Book.id.desc())
+        return query.order_by(self.column.asc(), Book.id.asc())
+
+    def page(self, cursor=None, page=1):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        query = self.query
+        backward = False
+
+        if decoded:
+            value, last_id, page, backward = decoded
+            query = query.filter(self._seek(value, last_id, forward=not backward))
+        elif page > 1:
+            # Tương thích với liên kết ?page=N cũ: chỉ dùng OFFSET khi không có con trỏ
+            query = self._ordered(query, True).offset((page - 1) * self.per_page)
+            return self._build(query.limit(self.per_page + 1).all(), page, has_more=None)
+        else:
+            page = 1
+
+        rows = self._ordered(query, not backward).limit(self.per_page + 1).all()
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backward:
+            rows.reverse()
+        return self._build(rows, page, has_more=has_more, backward=backward)
+
+    def _build(self, rows, page, has_more, backward=False):
+        if has_more is None:
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+
+        has_next = True if backward else has_more
+        has_prev = has_more if backward else page > 1
+        next_cursor = self.encode_cursor(rows[-1], page + 1) if rows and has_next else None
+        prev_cursor = self.encode_cursor(rows[0], page - 1, backward=True) if rows and has_prev else None
+        total = self.count() if self.count else None
+        return KeysetPage(rows, page, self.per_page, total, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def book_query(kw=None, category_id=None):
+    query = Book.query
+    if kw:
+        query = search.filter_query(query, kw)
+    if category_id:
+        query = query.filter(Book.category_id == category_id)
+    return query
+
+
+@read_only
+def count_books(kw=None, category_id=None):
+    if not kw and category_id:
+        # Số sách theo danh mục đã có sẵn trong ảnh chụp danh mục
+        for category in category_catalog.load():
+            if category.id == category_id:
+                return category.product_count
+        return 0
+    return category_catalog.count(('books', kw or None, category_id),
+                                  lambda: book_query(kw, category_id).count())
+
+
+@read_only
+def paginate_books(kw=None, category_id=None, sort='id', direction='asc', cursor=None, page=1, per_page=6):
+    paginator = KeysetPaginator(book_query(kw, category_id),
+                                sort=sort,
+                                direction=direction,
+                                per_page=per_page,
+                                count=lambda: count_books(kw, category_id))
+    return paginator.page(cursor=cursor, page=page)
+
+# Truy vấn cho từng trang kèm sẵn các quan hệ mà template sẽ đọc: số câu SQL không tăng theo số dòng
+def admin_book_query():
+    """Danh sách sách trong trang quản trị: danh mục nạp cùng câu SELECT"""
+    return db.session.query(Book).options(joinedload(Book.category))
+
+
+def regulation_query():
+    """Danh sách quy định (template chỉ đọc các cột của bảng regulations)"""
+    return Regulation.query.order_by(Regulation.id)
+
+
+def import_entry_query(**filters):
+    """Lịch sử phiếu nhập: kèm sách, danh mục của sách và phiên bản quy định đã áp dụng"""
+    query = ImportEntry.query.options(
+        joinedload(ImportEntry.book).joinedload(Book.category),
+        joinedload(ImportEntry.regulation_version)
+    )
+    return filter_import_entries(query, **filters).order_by(ImportEntry.import_date.desc(), ImportEntry.id.desc())
+
+
+def filter_import_entries(query, book_id=None, kw=None, start=None, end=None):
+    # Khoảng ngày [start, end) trên import_date để dùng được chỉ mục
+    if book_id:
+        query = query.filter(ImportEntry.book_id == book_id)
+    if kw:
+        query = query.filter(ImportEntry.book_name.icontains(kw, autoescape=True))
+    if start:
+        query = query.filter(ImportEntry.import_date >= start)
+    if end:
+        query = query.filter(ImportEntry.import_date < end)
+    return query
+
+
+def import_filters(args):
+    """Đọc bộ lọc lịch sử nhập từ query string: book_id, kw, from, to (YYYY-MM-DD, tính cả ngày to)"""
+    def parse_date(name, days=0):
+        # days=1: mốc mở ngay sau ngày đã chọn; 9999-12-31 + 1 ngày tràn datetime (OverflowError)
+        try:
+            return datetime.strptime(args[name], '%Y-%m-%d') + timedelta(days=days) if args.get(name) else None
+        except (ValueError, OverflowError):
+            return None
+
+    return {
+        'book_id': args.get('book_id', type=int),
+        'kw': (args.get('kw') or '').strip() or None,
+        'start': parse_date('from'),
+        'end': parse_date('to', days=1)
+    }
+
+
+@read_only
+def paginate_import_entries(page=1, per_page=20, **filters):
+    # Chỉ nạp một trang; tổng số dòng đếm trên chỉ mục import_date/book_id
+    return import_entry_query(**filters).paginate(page=page, per_page=per_page, error_out=False)
+
+
+@read_only
+def import_summary(limit=100, **filters):
+    """Tổng số lượng và tiền nhập theo sách theo tháng, tính trong SQL"""
+    year = func.extract('year', ImportEntry.import_date)
+    month = func.extract('month', ImportEntry.import_date)
+    quantity = func.sum(ImportEntry.quantity)
+    query = db.session.query(
+        year,
+        month,
+        ImportEntry.book_id,
+        func.max(ImportEntry.book_name),
+        quantity,
+        func.sum(ImportEntry.quantity * ImportEntry.unit_price),
+        func.count(ImportEntry.id)
+    )
+    return filter_import_entries(query, **filters) \
+        .group_by(year, month, ImportEntry.book_id) \
+        .order_by(year.desc(), month.desc(), quantity.desc()) \
+        .limit(limit).all()
 
 
 def check_login(username, password, user_role=None):
@@ -75,44 +344,106 @@ def check_login(username, password, user_role=None):
 def get_user_by_id(user_id):
     return User.query.get(user_id)
 
+
+def load_user_principal(user_id):
+    # Dùng cho user_loader: thông tin đăng nhập lấy từ bộ nhớ đệm, không SELECT mỗi request
+    return principal_cache.load(user_id)
+
+
+def principal_cache_stats():
+    return principal_cache.stats()
+
+
+@read_only
+def load_recommendations(book_id, limit=6):
+    """Sách thường được mua cùng book_id (chỉ sách đang bán), theo thứ tự điểm giảm dần"""
+    scores = dict(recommender.recommend(book_id, limit * 2))  # Dư ra cho các sách đã ngừng bán
+    if not scores:
+        return []
+    books = Book.query.filter(Book.id.in_(list(scores)), Book.active.is_(True)).all()
+    books.sort(key=lambda b: (-scores[b.id], b.id))
+    return [(book, scores[book.id]) for book in books[:limit]]
+
+
+def recommendation_stats():
+    return recommender.stats()
+
+def load_cart(raw):
+    # Giỏ hàng trong session chỉ gồm {book_id: số lượng} đã được nén
+    return Cart.load(raw)
+
+
 def count_cart(cart):
-    total_quantity, total_amount = 0, 0
-    if cart:
-        for c in cart.values():
-            c['price'] = float(c['price'])  # Chuyển price thành float
-            c['quantity'] = int(c['quantity'])  # Chuyển quantity thành int
-            total_quantity += c['quantity']
-            total_amount += c['quantity'] * c['price']
-    return {
-        'total_quantity': total_quantity,
-        'total_amount': total_amount
-    }
+    # Tổng được lưu sẵn trong giỏ, không cần duyệt lại từng dòng
+    if not isinstance(cart, Cart):
+        cart = Cart.load(cart)
+    return cart.stats()
 
 
 def add_receipt(cart, delivery_method, payment_method, phone, email, delivery_address=None):
+    if not isinstance(cart, Cart):
+        cart = Cart.load(cart)
     if cart:
-        receipt = Receipt(
-            user=current_user,
-            delivery_method=DeliveryMethod[delivery_method.upper()],
-            payment_method=PaymentMethod[payment_method.upper()],
-            delivery_address=delivery_address,
-            phone=phone,
-            email=email
-        )
-        db.session.add(receipt)
-        for c in cart.values():
-            book = Book.query.get(c['id'])
-            if not book or book.stock < c['quantity']:
-                raise Exception(f"Sản phẩm {c['name']} không đủ số lượng trong kho!")
-            d = ReceiptDetail(receipt=receipt,
-                              product_id=c['id'],
-                              quantity=c['quantity'],
-                              unit_price=c['price'])
-            db.session.add(d)
-        db.session.commit()
-
+        # Kiểm tra tồn kho, trừ kho và lưu chi tiết hóa đơn trong cùng một giao dịch
+        receipt = checkout.place_order(cart.items,
+                                       user=current_user,
+                                       delivery_method=delivery_method,
+                                       payment_method=payment_method,
+                                       phone=phone,
+                                       email=email,
+                                       delivery_address=delivery_address)
+        # Cập nhật gợi ý "khách hàng cũng mua" ngay, không chờ lần dựng lại chỉ mục
+        recommender.record(receipt.id, [book_id for book_id, qty in cart.items.items() if qty > 0])
+        return receipt
+
+@read_only
 def stats_by_category(month, year):
     """Thống kê doanh thu theo thể loại sách trong tháng của năm"""
+    return rollup.stats_by_category(month, year) or stats_by_category_live(month, year)
+
+@read_only
+def stats_book_sold(month, year):
+    """Thống kê tần suất sách bán trong tháng của năm"""
+    return rollup.stats_book_sold(month, year) or stats_book_sold_live(month, year)
+
+def sales_range(args, today=None):
+    """Đọc khoảng báo cáo từ query string: from, to (YYYY-MM-DD, tính cả ngày to), granularity, window.
+    Mặc định từ đầu năm tới hôm nay, theo tháng."""
+    today = today or datetime.now().date()
+
+    def parse_date(name, default, days=0):
+        # days=1: mốc mở ngay sau ngày to; 9999-12-31 + 1 ngày tràn datetime (OverflowError)
+        try:
+            return datetime.strptime(args[name], '%Y-%m-%d') + timedelta(days=days) if args.get(name) else default
+        except (ValueError, OverflowError):
+            return default
+
+    granularity = args.get('granularity', 'month')
+    return {
+        'start': parse_date('from', datetime(today.year, 1, 1)),
+        'end': parse_date('to', datetime.combine(today, datetime.min.time()) + timedelta(days=1), days=1),
+        'granularity': granularity if granularity in GRANULARITIES else 'month',
+        'window': min(max(args.get('window', 3, type=int), 1), 30)
+    }
+
+
+@read_only
+def sales_report(start, end, granularity='month', window=3, top=10):
+    """Doanh thu/số lượng theo ngày, tuần, tháng hoặc năm trong khoảng bất kỳ (lưu đệm theo khoảng)"""
+    return sales_analytics.report(start, end, granularity, window, top)
+
+
+def sales_analytics_stats():
+    return sales_analytics.stats()
+
+
+def stock_ledger_stats():
+    return stock_ledger.stats()
+
+
+def stats_by_category_live(month, year):
+    """Thống kê doanh thu trực tiếp từ hóa đơn (khi bảng tổng hợp chưa có dữ liệu)"""
+    start, end = rollup.month_range(month, year)
     return db.session.query(
         BookCategory.name,
         func.sum(ReceiptDetail.quantity * ReceiptDetail.unit_price),
@@ -125,12 +456,13 @@ def stats_by_category(month, year):
     ).join(BookCategory, Book.category_id == BookCategory.id
     ).join(Receipt, ReceiptDetail.receipt_id == Receipt.id
     ).filter(
-        func.extract('month', Receipt.created_date) == month,
-        func.extract('year', Receipt.created_date) == year
+        Receipt.created_date >= start,
+        Receipt.created_date < end
     ).group_by(BookCategory.name).all()
 
-def stats_book_sold(month, year):
-    """Thống kê tần suất sách bán trong tháng của năm"""
+def stats_book_sold_live(month, year):
+    """Thống kê tần suất sách bán trực tiếp từ hóa đơn"""
+    start, end = rollup.month_range(month, year)
     return db.session.query(
         Book.name,
         BookCategory.name,
@@ -142,103 +474,6 @@ def stats_book_sold(month, year):
     ).join(BookCategory, Book.category_id == BookCategory.id
     ).join(Receipt, ReceiptDetail.receipt_id == Receipt.id
     ).filter(
-        func.extract('month', Receipt.created_date) == month,
-        func.extract('year', Receipt.created_date) == year
+        Receipt.created_date >= start,
+        Receipt.created_date < end
     ).group_by(Book.name,BookCategory.name).all()
-
-
-def export_stats_to_excel(revenue_stats, book_stats, month, year, total_revenue):
-    wb = Workbook()
-
-    # Tạo sheet báo cáo doanh thu
-    revenue_sheet = wb.active
-    revenue_sheet.title = "Báo cáo doanh thu"
-
-    # Định dạng tiêu đề
-    header_font = Font(bold=True, size=14)
-    header_fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-
-    # Tiêu đề báo cáo doanh thu
-    revenue_sheet['A1'] = f"BÁO CÁO DOANH THU THEO THÁNG {month}/{year}"
-    revenue_sheet.merge_cells('A1:E1')
-    revenue_sheet['A1'].font = header_font
-    revenue_sheet['A1'].alignment = Alignment(horizontal='center')
-
-    # Header cho bảng doanh thu
-    headers = ['STT', 'Thể loại sách', 'Doanh thu (VNĐ)', 'Số lượt bán', 'Tỷ lệ (%)']
-    for col, header in enumerate(headers, 1):
-        cell = revenue_sheet.cell(row=3, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = header_fill
-
-    # Thêm dữ liệu doanh thu
-    for row, stat in enumerate(revenue_stats, 4):
-        revenue_sheet.cell(row=row, column=1).value = row - 3  # STT
-        revenue_sheet.cell(row=row, column=2).value = stat[0]  # Thể loại
-        revenue_sheet.cell(row=row, column=3).value = float(stat[1])  # Doanh thu
-        revenue_sheet.cell(row=row, column=4).value = stat[2]  # Số lượt bán
-        revenue_sheet.cell(row=row, column=5).value = float(stat[3])  # Tỷ lệ
-
-    # Tổng doanh thu
-    total_row = len(revenue_stats) + 4
-    revenue_sheet.cell(row=total_row, column=2).value = "Tổng doanh thu:"
-    revenue_sheet.cell(row=total_row, column=3).value = float(total_revenue)
-    revenue_sheet.cell(row=total_row, column=2).font = Font(bold=True)
-    revenue_sheet.cell(row=total_row, column=3).font = Font(bold=True)
-
-    # Tạo sheet báo cáo tần suất
-    freq_sheet = wb.create_sheet("Báo cáo tần suất")
-
-    # Tiêu đề báo cáo tần suất
-    freq_sheet['A1'] = f"BÁO CÁO TẦN SUẤT SÁCH BÁN THÁNG {month}/{year}"
-    freq_sheet.merge_cells('A1:E1')
-    freq_sheet['A1'].font = header_font
-    freq_sheet['A1'].alignment = Alignment(horizontal='center')
-
-    # Header cho bảng tần suất
-    freq_headers = ['STT', 'Tên sách', 'Thể loại', 'Số lượng', 'Tỷ lệ (%)']
-    for col, header in enumerate(freq_headers, 1):
-        cell = freq_sheet.cell(row=3, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = header_fill
-
-    # Thêm dữ liệu tần suất
-    for row, stat in enumerate(book_stats, 4):
-        freq_sheet.cell(row=row, column=1).value = row - 3  # STT
-        freq_sheet.cell(row=row, column=2).value = stat[0]  # Tên sách
-        freq_sheet.cell(row=row, column=3).value = stat[1]  # Thể loại
-        freq_sheet.cell(row=row, column=4).value = float(stat[2])  # Số lượng
-        freq_sheet.cell(row=row, column=5).value = float(stat[3])  # Tỷ lệ
-
-    # Điều chỉnh độ rộng cột cho cả hai sheet
-    for sheet in [revenue_sheet, freq_sheet]:
-        for i in range(1, sheet.max_column + 1):
-            max_length = 0
-            column_letter = get_column_letter(i)
-
-            for cell in sheet[column_letter]:
-                try:
-                    if cell.value:
-                        cell_length = len(str(cell.value))
-                        max_length = max(max_length, cell_length)
-                except:
-                    pass
-
-            adjusted_width = (max_length + 2)
-            sheet.column_dimensions[column_letter].width = adjusted_width
-
-    # Định dạng số cho các cột số liệu
-    for sheet in [revenue_sheet, freq_sheet]:
-        # Định dạng cột doanh thu với phân cách hàng nghìn
-        for row in range(4, sheet.max_row + 1):
-            if sheet == revenue_sheet:
-                revenue_cell = sheet.cell(row=row, column=3)
-                revenue_cell.number_format = '#,##0'
-
-            # Định dạng cột tỷ lệ với 2 số thập phân
-            ratio_cell = sheet.cell(row=row, column=5)
-            ratio_cell.number_format = '0.00%'
-
-    return wb
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# Đếm số câu SQL của các trang dùng truy vấn nạp trước ở hai cỡ dữ liệu khác nhau: số câu phải bằng nhau
+# (không có truy vấn lười theo từng dòng). Luôn chạy trên một file SQLite tạm riêng, không đụng tới CSDL đang dùng:
+#     python scripts/check_query_counts.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='bookapp-queries-')
+os.environ['BOOKAPP_DATABASE_URI'] = 'sqlite:///' + os.path.join(WORKDIR, 'queries.db')
+os.environ.pop('BOOKAPP_DATABASE_REPLICA_URI', None)
+os.environ['BOOKAPP_SESSION_BACKEND'] = 'memory'
+sys.path.insert(0, ROOT)
+os.chdir(os.path.join(ROOT, 'bookapp'))  # app = Flask("__name__"): templates/static tìm theo thư mục hiện tại
+
+from sqlalchemy import event, insert
+from bookapp import app, db, benchmark, utils, index, admin  # Đăng ký route và các view quản trị
+from bookapp.models import Book, ImportEntry, RegulationVersion
+
+PAGES = ['/admin/book/', '/admin/regulationview/']
+
+
+def check_query_counts(sizes=(5, 60)):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    results = {}
+    for size in sizes:
+        with app.app_context():
+            # Mỗi sách một danh mục riêng, mỗi phiếu nhập một sách và một phiên bản quy định riêng
+            benchmark.seed(books=size, categories=size, users=1, receipts=0)
+            db.session.execute(insert(RegulationVersion), [{'id': i + 1, 'rules': '{}'} for i in range(size)])
+            db.session.execute(insert(ImportEntry), [{
+                'book_id': i + 1, 'book_name': f'Sách {i + 1}', 'quantity': 150, 'unit_price': 1000,
+                'import_date': datetime.now(), 'regulation_version_id': i + 1
+            } for i in range(size)])
+            db.session.execute(Book.__table__.update().values(category_id=Book.id))
+            db.session.commit()
+            utils.invalidate_book_categories()  # Dữ liệu chèn thẳng bằng INSERT, bộ nhớ đệm không tự biết
+            engine = db.engine
+
+        client = app.test_client()
+        client.post('/user-login', data={'username': 'bench-admin', 'password': benchmark.PASSWORD})
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            for page in PAGES:
+                statements.clear()
+                response = client.get(page)
+                assert response.status_code == 200, (page, response.status_code)
+                results.setdefault(page, []).append(len(statements))
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+
+    results['ok'] = all(len(set(counts)) == 1 for counts in results.values())
+    return results
+
+
+if __name__ == '__main__':
+    result = check_query_counts()
+    print(result)
+    sys.exit(0 if result['ok'] else 1)